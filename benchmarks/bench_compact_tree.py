@@ -0,0 +1,63 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codeclr.cass import CassConfig  # noqa: E402
+from codeclr.cass.util import deserialize, deserialize_compact  # noqa: E402
+from synthetic import synthetic_cass_line  # noqa: E402
+
+
+EXAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'cass', 'examples')
+
+
+def measure(parse, lines, config):
+    # Parses every line and keeps the trees alive, as load_file does for a
+    # directory, reporting the wall time and the memory the trees hold.
+    gc.collect()
+    start = time.perf_counter()
+    trees = [parse(line, config) for line in lines]
+    elapsed = time.perf_counter() - start
+    del trees
+    gc.collect()
+    tracemalloc.start()
+    trees = [parse(line, config) for line in lines]
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del trees
+    return elapsed, size
+
+
+def run(name, lines, config):
+    object_time, object_size = measure(deserialize, lines, config)
+    compact_time, compact_size = measure(deserialize_compact, lines, config)
+    print(f'{name:<28} CassTree {object_time * 1e3:8.1f} ms '
+          f'{object_size / 2**20:7.2f} MiB  '
+          f'CompactCassTree {compact_time * 1e3:8.1f} ms '
+          f'{compact_size / 2**20:7.2f} MiB')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_files', type=int, default=500,
+                        help='Files per simulated problem directory.')
+    args = parser.parse_args()
+    config = CassConfig(annot_mode=2, compound_mode=1, gfun_mode=1,
+                        gvar_mode=3, fsig_mode=1)
+
+    lines = []
+    for file_name in sorted(os.listdir(EXAMPLES_DIR)):
+        with open(os.path.join(EXAMPLES_DIR, file_name)) as f:
+            lines.extend(f.readlines())
+    run('examples x num_files', lines * args.num_files, config)
+    run('synthetic 300 nodes x num_files',
+        [synthetic_cass_line(300, 20, seed=i) for i in range(args.num_files)],
+        config)
+    run('synthetic 10000 nodes x 10',
+        [synthetic_cass_line(10000, 50, seed=i) for i in range(10)], config)
@@ -0,0 +1,70 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codeclr.cass import util  # noqa: E402
+from synthetic import synthetic_cass_line  # noqa: E402
+
+
+EXAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'cass', 'examples')
+
+
+def build_tree_rec(nodes):
+    # The recursive builder this module replaced, kept for comparison.
+    node = nodes[0]
+    nodes = nodes[1:]
+    for i in range(len(node.children)):
+        child, nodes = build_tree_rec(nodes)
+        child.parent = node
+        child.child_id = i
+        node.children[i] = child
+    return node, nodes
+
+
+def legacy_build_tree(nodes, start=0):
+    root, rem_nodes = build_tree_rec(nodes[start:])
+    assert len(rem_nodes) == 0
+    return root
+
+
+def time_deserialize(lines, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for line in lines:
+            util.deserialize(line, None)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(name, lines, repeat):
+    current = time_deserialize(lines, repeat)
+    build_tree = util.build_tree
+    util.build_tree = legacy_build_tree
+    try:
+        legacy = time_deserialize(lines, repeat)
+    except RecursionError:
+        legacy = None
+    finally:
+        util.build_tree = build_tree
+    legacy_str = 'RecursionError' if legacy is None else f'{legacy * 1e3:.2f} ms'
+    print(f'{name:<32} legacy {legacy_str:>16}  current {current * 1e3:.2f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    for file_name in sorted(os.listdir(EXAMPLES_DIR)):
+        with open(os.path.join(EXAMPLES_DIR, file_name)) as f:
+            run(file_name, f.readlines(), args.repeat)
+    for num_nodes, max_depth in [(1000, 20), (10000, 20), (50000, 50),
+                                 (5000, 5000)]:
+        run(f'synthetic n={num_nodes} depth<={max_depth}',
+            [synthetic_cass_line(num_nodes, max_depth)], args.repeat)
@@ -0,0 +1,50 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codeclr.cass import CassConfig, feature_ids, load_file  # noqa: E402
+from codeclr.cass.features import NUM_BUCKETS, hash_feature  # noqa: E402
+from codeclr.cass.util import deserialize_compact  # noqa: E402
+from synthetic import synthetic_cass_line  # noqa: E402
+
+
+EXAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'cass', 'examples')
+
+
+def featurize_and_hash(cass_tree):
+    return [hash_feature(feature) % NUM_BUCKETS
+            for feature in cass_tree.featurize()]
+
+
+def run(name, cass_trees, repeat):
+    for label, fn in [('featurize + hash', featurize_and_hash),
+                      ('feature_ids', feature_ids)]:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for cass_tree in cass_trees:
+                fn(cass_tree)
+            best = min(best, time.perf_counter() - start)
+        print(f'{name:<28} {label:<18} {best * 1e3:8.2f} ms')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    config = CassConfig(annot_mode=2, compound_mode=1, gfun_mode=1,
+                        gvar_mode=3, fsig_mode=1)
+
+    cass_trees = []
+    for file_name in sorted(os.listdir(EXAMPLES_DIR)):
+        cass_trees.extend(load_file(
+            os.path.join(EXAMPLES_DIR, file_name), config, compact=True))
+    run('examples', cass_trees, args.repeat)
+    run('synthetic 10000 nodes x 10',
+        [deserialize_compact(synthetic_cass_line(10000, 50, seed=i), config)
+         for i in range(10)], args.repeat)
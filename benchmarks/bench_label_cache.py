@@ -0,0 +1,46 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from codeclr.cass import CassConfig, label_cache_info, set_label_cache_size  # noqa: E402
+from codeclr.cass.cass import LABEL_CACHE_SIZE  # noqa: E402
+from codeclr.cass.util import deserialize, deserialize_compact  # noqa: E402
+
+
+EXAMPLES_DIR = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    'tests', 'cass', 'examples')
+
+
+def time_parse(parse, lines, config, cache_size):
+    set_label_cache_size(cache_size)
+    start = time.perf_counter()
+    for line in lines:
+        parse(line, config)
+    return time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--num_files', type=int, default=500)
+    args = parser.parse_args()
+    config = CassConfig(annot_mode=2, compound_mode=1, gfun_mode=1,
+                        gvar_mode=3, fsig_mode=1)
+
+    lines = []
+    for file_name in sorted(os.listdir(EXAMPLES_DIR)):
+        with open(os.path.join(EXAMPLES_DIR, file_name)) as f:
+            lines.extend(f.readlines())
+    lines = lines * args.num_files
+
+    for name, parse in [('CassTree', deserialize),
+                        ('CompactCassTree', deserialize_compact)]:
+        uncached = time_parse(parse, lines, config, 0)
+        cached = time_parse(parse, lines, config, LABEL_CACHE_SIZE)
+        info = label_cache_info()
+        print(f'{name:<16} uncached {uncached * 1e3:7.1f} ms  '
+              f'cached {cached * 1e3:7.1f} ms  '
+              f'hit rate {info["hit_rate"]:.3f} ({info["size"]} entries)')
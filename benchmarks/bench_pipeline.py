@@ -0,0 +1,250 @@
+import argparse
+import json
+import math
+import multiprocessing
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+from torchtext.vocab import build_vocab_from_iterator  # noqa: E402
+
+from codeclr import DenseGraph, GraphBatch, load_graph  # noqa: E402
+from codeclr.cass import cass_tree_to_graph, iter_file  # noqa: E402
+from codeclr.model import ContrastiveLearner  # noqa: E402
+from codeclr.model.augmenter import NodeDropper, NodeMasker, SubtreeMasker  # noqa: E402
+from codeclr.model.encoder import Encoder  # noqa: E402
+from synthetic import write_synthetic_cas_file  # noqa: E402
+
+
+# Per-file node counts are drawn log-uniformly from (low, high), and trees
+# are at most max_depth deep.
+DISTRIBUTIONS = {
+    'small': {'low': 50, 'high': 200, 'max_depth': 10},
+    'medium': {'low': 200, 'high': 2000, 'max_depth': 20},
+    'large': {'low': 2000, 'high': 20000, 'max_depth': 50},
+    'deep': {'low': 1000, 'high': 5000, 'max_depth': 1000},
+    'mixed': {'low': 50, 'high': 20000, 'max_depth': 30},
+}
+GCN_LAYERS = [128, 128, 64, 32]
+
+
+def peak_rss_mb() -> float:
+    # The high-water mark of this process (ru_maxrss is in KB on Linux and
+    # in bytes on macOS).
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1 << 20 if sys.platform == 'darwin' else 1 << 10)
+
+
+def percentile(values, q: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def time_stage(fn, items, num_graphs, num_nodes, unit='files'):
+    # Runs fn on every item, returning its outputs and the throughput,
+    # per-item latency and peak RSS of the stage. The items are files or
+    # batches, as unit says; graphs_per_sec is comparable across both. One
+    # untimed call first keeps one-off initialization out of the latencies.
+    fn(items[0])
+    outputs = []
+    latencies = []
+    start = time.perf_counter()
+    for item in items:
+        item_start = time.perf_counter()
+        outputs.append(fn(item))
+        latencies.append(time.perf_counter() - item_start)
+    elapsed = time.perf_counter() - start
+    return outputs, {
+        'seconds': elapsed,
+        'unit': unit,
+        'items_per_sec': len(items) / elapsed,
+        'graphs_per_sec': num_graphs / elapsed,
+        'nodes_per_sec': num_nodes / elapsed,
+        'latency_ms_mean': 1e3 * elapsed / len(items),
+        'latency_ms_p50': 1e3 * percentile(latencies, 0.5),
+        'latency_ms_p95': 1e3 * percentile(latencies, 0.95),
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+
+def run_distribution(name, num_files, batch_size, dense_max_nodes, seed):
+    # Times every stage of the pipeline on num_files synthetic .cas files.
+    # Runs in a fresh process per distribution, so that peak RSS is not
+    # inherited from the other distributions.
+    torch.manual_seed(seed)
+    distribution = DISTRIBUTIONS[name]
+    rng = random.Random(seed)
+    sizes = [int(math.exp(rng.uniform(math.log(distribution['low']),
+                                      math.log(distribution['high']))))
+             for _ in range(num_files)]
+    results = {'baseline_rss_mb': peak_rss_mb()}
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        files = []
+        for i, size in enumerate(sizes):
+            files.append(os.path.join(tmp_dir, f'{i}.cas'))
+            write_synthetic_cas_file(
+                files[-1], size, distribution['max_depth'],
+                num_trees=1 + size // 500, seed=seed + i)
+        num_nodes = sum(sizes)
+
+        _, results['deserialize'] = time_stage(
+            lambda file: list(iter_file(file)), files, num_files, num_nodes)
+        trees, results['deserialize_compact'] = time_stage(
+            lambda file: list(iter_file(file, compact=True)), files,
+            num_files, num_nodes)
+
+        vocab = build_vocab_from_iterator(
+            [[label for file_trees in trees for tree in file_trees
+              for label in tree.node_labels()]], specials=['<unk>'])
+        vocab.set_default_index(vocab['<unk>'])
+        graphs, results['cass_tree_to_graph'] = time_stage(
+            lambda file_trees: cass_tree_to_graph(
+                file_trees, vocabulary=vocab, sparse=True),
+            trees, num_files, num_nodes)
+        del trees
+
+        for i, graph in enumerate(graphs):
+            graph.save(os.path.join(tmp_dir, f'{i}.sparse.pt'))
+        _, results['load_sparse'] = time_stage(
+            lambda i: load_graph(os.path.join(tmp_dir, f'{i}.sparse.pt')),
+            range(len(graphs)), num_files, num_nodes)
+        # Dense graphs take N^2 memory, so only small ones are stored.
+        dense = [i for i, graph in enumerate(graphs)
+                 if graph.num_nodes <= dense_max_nodes]
+        if dense:
+            for i in dense:
+                graphs[i].to_dense().save(
+                    os.path.join(tmp_dir, f'{i}.dense.pt'))
+            _, results['load_dense'] = time_stage(
+                lambda i: DenseGraph.load(
+                    os.path.join(tmp_dir, f'{i}.dense.pt')),
+                dense, len(dense), sum(sizes[i] for i in dense))
+
+    batches = [graphs[i:i + batch_size]
+               for i in range(0, len(graphs), batch_size)]
+    collated, results['collate'] = time_stage(
+        GraphBatch.from_graphs, batches, num_files, num_nodes, unit='batches')
+    for stage, augmenter in [('augment_node_mask', NodeMasker()),
+                             ('augment_node_drop', NodeDropper()),
+                             ('augment_subtree_mask', SubtreeMasker())]:
+        _, results[stage] = time_stage(
+            augmenter, collated, num_files, num_nodes, unit='batches')
+
+    encoder = Encoder(GCN_LAYERS, vocab_size=len(vocab))
+    with torch.no_grad():
+        _, results['encode'] = time_stage(
+            encoder, batches, num_files, num_nodes, unit='batches')
+    model = ContrastiveLearner(GCN_LAYERS, vocab_size=len(vocab), seed=seed)
+
+    def train_step(batch):
+        model.zero_grad()
+        model(batch).backward()
+    _, results['train_step'] = time_stage(
+        train_step, batches, num_files, num_nodes, unit='batches')
+    results['num_files'] = num_files
+    results['num_nodes'] = num_nodes
+    return results
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline, tolerance: float):
+    # The stages whose throughput in graphs/sec dropped by more than
+    # tolerance against baseline. Unlike items/sec, graphs/sec does not
+    # depend on --batch_size.
+    regressions = []
+    for name, stages in results['distributions'].items():
+        for stage, metrics in stages.items():
+            if not isinstance(metrics, dict):
+                continue
+            previous = baseline['distributions'].get(name, {}).get(stage)
+            if previous is None or 'graphs_per_sec' not in previous:
+                continue
+            ratio = metrics['graphs_per_sec'] / previous['graphs_per_sec']
+            if ratio < 1 - tolerance:
+                regressions.append((name, stage, ratio))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--distributions', type=str, nargs='+',
+                        default=list(DISTRIBUTIONS),
+                        choices=list(DISTRIBUTIONS))
+    parser.add_argument('--num_files', type=int, default=64)
+    parser.add_argument('--batch_size', type=int, default=16)
+    parser.add_argument('--dense_max_nodes', type=int, default=2000)
+    parser.add_argument('--num_threads', type=int, default=None)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', type=str, default=None,
+                        help='Where to write the JSON results.')
+    parser.add_argument(
+        '--compare',
+        type=str,
+        default=None,
+        help='A JSON file of earlier results. Exits with status 1 if a stage got slower by more than --tolerance.')
+    parser.add_argument('--tolerance', type=float, default=0.1)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    results = {
+        'meta': {
+            'git_commit': git_commit(),
+            'python': platform.python_version(),
+            'torch': torch.__version__,
+            'platform': platform.platform(),
+            'num_threads': torch.get_num_threads(),
+            'args': vars(args),
+        },
+        'distributions': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    for name in args.distributions:
+        with context.Pool(1, initializer=torch.set_num_threads,
+                          initargs=(torch.get_num_threads(),)) as pool:
+            stages = pool.apply(run_distribution, (
+                name, args.num_files, args.batch_size,
+                args.dense_max_nodes, args.seed))
+        results['distributions'][name] = stages
+        print(f'{name} ({stages["num_nodes"]} nodes in '
+              f'{stages["num_files"]} files)')
+        for stage, metrics in stages.items():
+            if isinstance(metrics, dict):
+                print(
+                    f'  {stage:<22} '
+                    f'{metrics["items_per_sec"]:10.1f} '
+                    f'{metrics["unit"] + "/sec":<11} '
+                    f'{metrics["graphs_per_sec"]:10.1f} graphs/sec '
+                    f'{metrics["nodes_per_sec"]:12.0f} nodes/sec  '
+                    f'p95 {metrics["latency_ms_p95"]:9.2f} ms  '
+                    f'peak RSS {metrics["peak_rss_mb"]:7.1f} MB')
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare is not None:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for name, stage, ratio in regressions:
+            print(f'REGRESSION {name}/{stage}: {ratio:.2f}x the baseline '
+                  'throughput')
+        if regressions:
+            exit(1)
@@ -0,0 +1,63 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import torch  # noqa: E402
+
+from codeclr.model import ContrastiveLearner  # noqa: E402
+from synthetic import synthetic_graph  # noqa: E402
+
+
+def train_throughput(graphs, batch_size, steps, bf16, compile):
+    # Graphs per second of pretrain.py's training step after a warm-up pass
+    # over every batch (which is when torch.compile compiles).
+    torch.manual_seed(0)
+    model = ContrastiveLearner([128, 128, 64, 32], vocab_size=1000, seed=0)
+    if compile:
+        model.encoder.pad_to_buckets = True
+        model.encoder.compile(dynamic=False)
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    batches = [graphs[i:i + batch_size]
+               for i in range(0, len(graphs), batch_size)]
+
+    def step(batch):
+        optimizer.zero_grad()
+        with torch.autocast('cpu', dtype=torch.bfloat16, enabled=bf16):
+            loss = model(batch)
+        loss.backward()
+        optimizer.step()
+
+    start = time.perf_counter()
+    for batch in batches:
+        step(batch)
+    warmup = time.perf_counter() - start
+    start = time.perf_counter()
+    for i in range(steps):
+        step(batches[i % len(batches)])
+    elapsed = time.perf_counter() - start
+    return steps * batch_size / elapsed, warmup
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--batch_size', type=int, default=64)
+    parser.add_argument('--num_batches', type=int, default=4)
+    parser.add_argument('--steps', type=int, default=8)
+    parser.add_argument('--num_threads', type=int, default=None)
+    args = parser.parse_args()
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    graphs = [synthetic_graph(100 + (37 * i) % 400, seed=i)
+              for i in range(args.batch_size * args.num_batches)]
+    modes = [('fp32 eager', False, False), ('bf16 eager', True, False)]
+    if hasattr(torch.nn.Module, 'compile'):
+        modes += [('fp32 compile', False, True), ('bf16 compile', True, True)]
+    for name, bf16, compile in modes:
+        graphs_per_sec, warmup = train_throughput(
+            graphs, args.batch_size, args.steps, bf16, compile)
+        print(f'{name:<14} {graphs_per_sec:8.1f} graphs/sec '
+              f'(warm-up {warmup:.1f} s)')
@@ -0,0 +1,66 @@
+import random
+
+
+def synthetic_cass_line(num_nodes: int, max_depth: int, seed: int = 0) -> str:
+    # Builds a random preorder CASS line with num_nodes nodes whose depth
+    # never exceeds max_depth. Leaves are global variables, so no use-chain
+    # indices are needed.
+    rng = random.Random(seed)
+    tokens = []
+    # Each frame is [token position of the child count, child count].
+    stack = []
+    for i in range(num_nodes):
+        remaining = num_nodes - i - 1
+        leaf = remaining == 0 or (
+            len(stack) >= max_depth) or (
+            len(stack) > 0 and rng.random() < 0.5)
+        if leaf:
+            tokens.append(f'Vx{rng.randrange(100)}')
+        else:
+            tokens.append('I#compound_statement#{$$$}')
+            tokens.append('0')
+        if stack:
+            stack[-1][1] += 1
+        if not leaf:
+            stack.append([len(tokens) - 1, 0])
+        # Close the innermost frames at random, keeping the root open until
+        # the last node.
+        while stack and stack[-1][1] > 0 and (
+                remaining == 0 or (len(stack) > 1 and rng.random() < 0.3)):
+            position, num_children = stack.pop()
+            tokens[position] = str(num_children)
+    assert len(stack) == 0
+    return '\t'.join([str(num_nodes)] + tokens)
+
+
+def synthetic_graph(
+        num_nodes: int,
+        max_depth: int = 20,
+        vocab_size: int = 1000,
+        seed: int = 0):
+    # A preprocessed-style sparse graph of a synthetic CASS tree.
+    from codeclr.cass import build_graph, collect_graph_arrays
+    from codeclr.cass.util import deserialize_compact
+
+    cass_tree = deserialize_compact(
+        synthetic_cass_line(num_nodes, max_depth, seed))
+    node_types, labels, parents, children = collect_graph_arrays([cass_tree])
+    rng = random.Random(seed)
+    label_ids = [rng.randrange(vocab_size) for _ in labels]
+    return build_graph(node_types, label_ids, parents, children, sparse=True)
+
+
+def write_synthetic_cas_file(
+        file_name: str,
+        num_nodes: int,
+        max_depth: int,
+        num_trees: int = 1,
+        seed: int = 0) -> None:
+    # A .cas file of num_trees synthetic trees (one per line) with
+    # num_nodes nodes between them.
+    sizes = [num_nodes // num_trees + (i < num_nodes % num_trees)
+             for i in range(num_trees)]
+    with open(file_name, 'w') as f:
+        for i, size in enumerate(sizes):
+            f.write(synthetic_cass_line(
+                max(size, 1), max_depth, seed * num_trees + i) + '\n')
@@ -1 +1,3 @@
 from .dense_graph import DenseGraph
+from .sparse_graph import SparseGraph, load_graph
+from .graph_batch import GraphBatch
@@ -1,2 +1,3 @@
-from .cass import CassConfig, CassNode, CassTree
-from .util import load_file, cass_tree_to_graph
+from .cass import CassConfig, CassNode, CassTree, CompactCassTree, label_cache_info, set_label_cache_size
+from .features import bag_of_features, bags_of_features, feature_ids
+from .util import iter_file, load_file, cass_tree_to_graph, build_graph, collect_graph_arrays
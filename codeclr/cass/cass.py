@@ -17,7 +17,10 @@ LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
 OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 SOFTWARE.
 '''
+from array import array
 from enum import Enum
+import functools
+import sys
 from typing import List
 
 
@@ -53,8 +56,149 @@ class CassConfig:
     def tag(self):
         return f'annot_mode={self.annot_mode}_compound_mode={self.compound_mode}_gfun_mode={self.gfun_mode}_gvar_mode={self.gvar_mode}_fsig_mode={self.fsig_mode}'
 
+    def _key(self):
+        return (self.annot_mode, self.compound_mode, self.gfun_mode,
+                self.gvar_mode, self.fsig_mode)
+
+    def __eq__(self, other):
+        return isinstance(other, CassConfig) and self._key() == other._key()
+
+    def __hash__(self):
+        return hash(self._key())
+
+
+DEFAULT_CONFIG = CassConfig()
+LABEL_CACHE_SIZE = 1 << 16
+
+
+def resolve_label(
+        node_type: NodeType,
+        label: str = '',
+        config: CassConfig = None):
+    # Returns the (annot, label, n, removed) a node of this type and raw
+    # label resolves to under the given configuration. Resolutions are
+    # memoized for the whole process, so the same few labels repeated across
+    # files are only resolved once.
+    config = DEFAULT_CONFIG if not config else config
+    return _cached_resolve_label(config, node_type, label)
+
+
+def label_cache_info():
+    info = _cached_resolve_label.cache_info()
+    lookups = info.hits + info.misses
+    return {
+        'hits': info.hits,
+        'misses': info.misses,
+        'size': info.currsize,
+        'maxsize': info.maxsize,
+        'hit_rate': info.hits / lookups if lookups > 0 else 0.0,
+    }
+
+
+def set_label_cache_size(maxsize: int):
+    # Replaces the cache, dropping its entries and statistics.
+    global _cached_resolve_label
+    _cached_resolve_label = functools.lru_cache(maxsize=maxsize)(
+        _resolve_label)
+
+
+def _resolve_label(config: CassConfig, node_type: NodeType, label: str):
+    annot = None
+    n = None
+    removed = False
+
+    if len(label) == 0:
+        n = label
+
+    elif node_type == NodeType.FunSig:
+        if config.fsig_mode == 0:
+            n = None
+        else:
+            n = label
+
+    elif node_type == NodeType.Internal:
+        assert label[0] == '#'
+        p = label[1:].find('#')
+        assert p > 0
+        p += 2
+        annot = label[:p]
+        label = label[p:]
+
+        if annot == '#compound_statement#':
+            if config.compound_mode == 0:
+                pass
+            elif config.compound_mode == 1:
+                removed = True
+            elif config.compound_mode == 2:
+                label = '{#}'
+            else:
+                raise Exception()
+
+        if config.annot_mode == 0:
+            n = label
+        elif config.annot_mode == 1:
+            n = annot + label
+        elif config.annot_mode == 2:
+            if annot == '#parenthesized_expression#' or annot == '#argument_list#':
+                n = annot + label
+            else:
+                n = label
+        else:
+            raise Exception()
+
+    else:
+        if node_type == NodeType.LocalVar or node_type == NodeType.LocalFun:
+            n = '$VAR'
+
+        elif node_type == NodeType.GlobalVar:
+            if config.gvar_mode == 0:
+                n = label
+            elif config.gvar_mode == 1:
+                n = label
+                removed = True
+            elif config.gvar_mode == 2:
+                n = '$GVAR'
+            elif config.gvar_mode == 3:
+                n = '$VAR'
+            else:
+                raise Exception()
+
+        elif node_type == NodeType.GlobalFun:
+            if config.gfun_mode == 0:
+                n = label
+            elif config.gfun_mode == 1:
+                n = label
+                removed = True
+            elif config.gfun_mode == 2:
+                n = '$GFUN'
+            elif config.gfun_mode == 3:
+                if config.gvar_mode == 3:
+                    n = '$VAR'
+                else:
+                    n = '$GVAR'
+            else:
+                raise Exception()
+
+        else:
+            n = label
+
+    # Interned so every node with this label shares one string object.
+    if annot is not None:
+        annot = sys.intern(annot)
+    if n is not None:
+        n = sys.intern(n)
+    return annot, sys.intern(label), n, removed
+
+
+_cached_resolve_label = functools.lru_cache(maxsize=LABEL_CACHE_SIZE)(
+    _resolve_label)
+
 
 class CassNode:
+    __slots__ = ('node_type', 'children', 'prev_use', 'next_use', 'parent',
+                 'child_id', 'config', 'removed', 'annot', 'label', 'n',
+                 'features', 'id')
+
     def __init__(
             self,
             node_type: NodeType,
@@ -67,86 +211,9 @@ class CassNode:
         self.next_use = None
         self.parent = None
         self.child_id = 0
-        self.config = CassConfig() if not config else config
-
-        self.removed = False
-
-        if len(label) == 0:
-            self.label = label
-            self.n = label
-
-        elif node_type == NodeType.FunSig:
-            if self.config.fsig_mode == 0:
-                self.n = None
-            else:
-                self.n = label
-
-        elif node_type == NodeType.Internal:
-            assert label[0] == '#'
-            p = label[1:].find('#')
-            assert p > 0
-            p += 2
-            self.annot = label[:p]
-            self.label = label[p:]
-
-            if self.annot == '#compound_statement#':
-                if self.config.compound_mode == 0:
-                    pass
-                elif self.config.compound_mode == 1:
-                    self.removed = True
-                elif self.config.compound_mode == 2:
-                    self.label = '{#}'
-                else:
-                    raise Exception()
-
-            if self.config.annot_mode == 0:
-                self.n = self.label
-            elif self.config.annot_mode == 1:
-                self.n = self.annot + self.label
-            elif self.config.annot_mode == 2:
-                if self.annot == '#parenthesized_expression#' or self.annot == '#argument_list#':
-                    self.n = self.annot + self.label
-                else:
-                    self.n = self.label
-            else:
-                raise Exception()
-
-        else:
-            if node_type == NodeType.LocalVar or node_type == NodeType.LocalFun:
-                self.n = '$VAR'
-
-            elif node_type == NodeType.GlobalVar:
-                if self.config.gvar_mode == 0:
-                    self.n = label
-                elif self.config.gvar_mode == 1:
-                    self.n = label
-                    self.removed = True
-                elif self.config.gvar_mode == 2:
-                    self.n = '$GVAR'
-                elif self.config.gvar_mode == 3:
-                    self.n = '$VAR'
-                else:
-                    raise Exception()
-
-            elif node_type == NodeType.GlobalFun:
-                if self.config.gfun_mode == 0:
-                    self.n = label
-                elif self.config.gfun_mode == 1:
-                    self.n = label
-                    self.removed = True
-                elif self.config.gfun_mode == 2:
-                    self.n = '$GFUN'
-                elif self.config.gfun_mode == 3:
-                    if self.config.gvar_mode == 3:
-                        self.n = '$VAR'
-                    else:
-                        self.n = '$GVAR'
-                else:
-                    raise Exception()
-
-            else:
-                self.n = label
-
+        self.config = DEFAULT_CONFIG if not config else config
+        self.annot, self.label, self.n, self.removed = resolve_label(
+            node_type, label, self.config)
         self.features = []
 
     def set_id(self, id: int):
@@ -154,9 +221,10 @@ class CassNode:
 
 
 class CassTree:
-    def __init__(self, nodes, leaf_nodes):
+    def __init__(self, nodes, leaf_nodes, config: CassConfig = None):
         self.nodes = nodes
         self.leaf_nodes = leaf_nodes
+        self.config = DEFAULT_CONFIG if not config else config
         if nodes[0].node_type == NodeType.FunSig:
             self.fun_sig_node = nodes[0]
             self.root = nodes[1]
@@ -171,17 +239,16 @@ class CassTree:
         for i, node in enumerate(self.leaf_nodes):
             node2leaf_id[node] = i
 
-        def compute_leaf_ranges_rec(node):
+        # Nodes are stored in preorder, so walking them backwards visits every
+        # child before its parent.
+        start = 0 if self.fun_sig_node is None else 1
+        for node in reversed(self.nodes[start:]):
             if len(node.children) == 0:
                 x = node2leaf_id[node]
                 leaf_ranges[node] = (x, x + 1)
             else:
-                for c in node.children:
-                    compute_leaf_ranges_rec(c)
                 leaf_ranges[node] = (
                     leaf_ranges[node.children[0]][0], leaf_ranges[node.children[-1]][1])
-
-        compute_leaf_ranges_rec(self.root)
         return leaf_ranges
 
     def _get_context(self, node):
@@ -250,3 +317,200 @@ class CassTree:
             features.append(self.fun_sig_node.n)
 
         return features
+
+
+class CompactCassTree:
+    # A CassTree stored as flat int arrays indexed by preorder node position
+    # instead of one CassNode object per node. Labels are ids into a table
+    # of the tree's distinct strings.
+    __slots__ = (
+        'config',
+        'labels',
+        'node_types',
+        'label_ids',
+        'n_ids',
+        'removed',
+        'num_children',
+        'prev_use',
+        'next_use',
+        'parent',
+        'child_id',
+        'first_child',
+        'next_sibling',
+        'subtree_sizes',
+        'leaf_nodes',
+        'leaf_prefix',
+        'fun_sig_node',
+        'root')
+
+    def __init__(
+            self,
+            labels: List[str],
+            node_types: array,
+            label_ids: array,
+            n_ids: array,
+            removed: array,
+            num_children: array,
+            prev_use: array,
+            next_use: array,
+            config: CassConfig = None):
+        self.config = DEFAULT_CONFIG if not config else config
+        self.labels = labels
+        self.node_types = node_types
+        self.label_ids = label_ids
+        self.n_ids = n_ids
+        self.removed = removed
+        self.num_children = num_children
+        self.prev_use = prev_use
+        self.next_use = next_use
+
+        num_nodes = len(node_types)
+        fun_sig = NodeType.FunSig.value[0]
+        if num_nodes > 0 and node_types[0] == fun_sig:
+            self.fun_sig_node = 0
+            self.root = 1
+        else:
+            self.fun_sig_node = None
+            self.root = 0
+        self._link(num_nodes)
+
+        internal = NodeType.Internal.value[0]
+        self.leaf_nodes = array('i', [i for i in range(self.root, num_nodes)
+                                      if node_types[i] != internal])
+        self.leaf_prefix = array('i', [0]) * (num_nodes + 1)
+        count = 0
+        for i in range(num_nodes):
+            self.leaf_prefix[i] = count
+            if i >= self.root and node_types[i] != internal:
+                count += 1
+        self.leaf_prefix[num_nodes] = count
+
+    def _link(self, num_nodes: int):
+        # Same single pass as build_tree: the stack holds [node, number of
+        # children seen, last child] for nodes with unfilled child slots.
+        self.parent = array('i', [-1]) * num_nodes
+        self.child_id = array('i', [0]) * num_nodes
+        self.first_child = array('i', [-1]) * num_nodes
+        self.next_sibling = array('i', [-1]) * num_nodes
+        stack = []
+        for i in range(self.root, num_nodes):
+            if len(stack) > 0:
+                frame = stack[-1]
+                p, k, last = frame
+                self.parent[i] = p
+                self.child_id[i] = k
+                if k == 0:
+                    self.first_child[p] = i
+                else:
+                    self.next_sibling[last] = i
+                frame[1] = k + 1
+                frame[2] = i
+                if k + 1 == self.num_children[p]:
+                    stack.pop()
+            else:
+                assert i == self.root
+            if self.num_children[i] > 0:
+                stack.append([i, 0, -1])
+        assert len(stack) == 0
+
+        self.subtree_sizes = array('i', [1]) * num_nodes
+        for i in range(num_nodes - 1, self.root, -1):
+            self.subtree_sizes[self.parent[i]] += self.subtree_sizes[i]
+
+    @property
+    def num_nodes(self) -> int:
+        return len(self.node_types)
+
+    def node_type(self, node: int) -> NodeType:
+        return NodeType((self.node_types[node],))
+
+    def label(self, node: int) -> str:
+        return self.labels[self.label_ids[node]]
+
+    def n(self, node: int) -> str:
+        return self.labels[self.n_ids[node]]
+
+    def node_labels(self) -> List[str]:
+        return [self.labels[i] for i in self.n_ids]
+
+    def children(self, node: int) -> List[int]:
+        children = []
+        child = self.first_child[node]
+        while child >= 0:
+            children.append(child)
+            child = self.next_sibling[child]
+        return children
+
+    def leaf_range(self, node: int):
+        return (self.leaf_prefix[node],
+                self.leaf_prefix[node + self.subtree_sizes[node]])
+
+    def _get_context(self, node: int):
+        assert not self.removed[node]
+
+        p = self.parent[node]
+        if p < 0:
+            return None
+        if self.label(p) != '$.$':
+            if self.removed[p]:
+                return None
+            return (self.child_id[node], self.n(p))
+        else:
+            global_types = (NodeType.GlobalVar.value[0],
+                            NodeType.GlobalFun.value[0])
+            for i in range(*self.leaf_range(p)):
+                l = self.leaf_nodes[i]
+                if self.node_types[l] in global_types:
+                    if self.removed[l]:
+                        return None
+                    return self.n(l)
+            return None
+
+    def featurize(self):
+        features = []
+        leaf_nodes = self.leaf_nodes
+        for i, node in enumerate(leaf_nodes):
+            if self.removed[node]:
+                continue
+            n = self.n(node)
+
+            features.append(n)
+
+            p = node
+            for _ in range(3):
+                cid = self.child_id[p]
+                p = self.parent[p]
+                if p < 0:
+                    break
+                if self.removed[p]:
+                    continue
+                features.append((n, cid, self.n(p)))
+
+            if i > 0:
+                sib = leaf_nodes[i - 1]
+                if not self.removed[sib]:
+                    features.append((self.n(sib), n))
+            if i < len(leaf_nodes) - 1:
+                sib = leaf_nodes[i + 1]
+                if not self.removed[sib]:
+                    features.append((n, self.n(sib)))
+
+            prev_use = self.prev_use[node]
+            if prev_use >= 0:
+                if not self.removed[prev_use]:
+                    prev_ctx = self._get_context(prev_use)
+                    ctx = self._get_context(node)
+                    if prev_ctx is not None and ctx is not None:
+                        features.append((prev_ctx, ctx))
+            next_use = self.next_use[node]
+            if next_use >= 0:
+                if not self.removed[next_use]:
+                    ctx = self._get_context(node)
+                    next_ctx = self._get_context(next_use)
+                    if ctx is not None and next_ctx is not None:
+                        features.append((ctx, next_ctx))
+
+        if self.config.fsig_mode == 1 and self.fun_sig_node is not None:
+            features.append(self.n(self.fun_sig_node))
+
+        return features
@@ -0,0 +1,156 @@
+import zlib
+from typing import Iterable, List
+
+import numpy as np
+import torch
+
+from .cass import CompactCassTree, NodeType
+
+
+NUM_BUCKETS = 1 << 20
+FNV_OFFSET = 0xcbf29ce484222325
+FNV_PRIME = 0x100000001b3
+MASK = (1 << 64) - 1
+
+
+def hash_label(label: str) -> int:
+    # crc32 is stable across processes, unlike hash(). None hashes outside
+    # the crc32 range.
+    if label is None:
+        return 1 << 32
+    return zlib.crc32(label.encode())
+
+
+def hash_feature(feature) -> int:
+    # Structural 64-bit FNV hash of one CassTree.featurize feature: labels,
+    # child ids and (nested) tuples of them. feature_ids computes the same
+    # hashes in bulk.
+    if isinstance(feature, tuple):
+        x = FNV_OFFSET ^ len(feature)
+        for element in feature:
+            x = ((x ^ hash_feature(element)) * FNV_PRIME) & MASK
+        return x
+    if isinstance(feature, int):
+        return feature
+    return hash_label(feature)
+
+
+def _combine(*hashes: np.ndarray) -> np.ndarray:
+    x = np.full(len(hashes[0]), FNV_OFFSET ^ len(hashes), dtype=np.uint64)
+    for h in hashes:
+        x = (x ^ h.astype(np.uint64)) * np.uint64(FNV_PRIME)
+    return x
+
+
+def feature_ids(
+        cass_tree: CompactCassTree,
+        num_buckets: int = NUM_BUCKETS) -> np.ndarray:
+    # The multiset of hash_feature(f) % num_buckets over the features f of
+    # cass_tree.featurize(), computed with array ops over the whole tree.
+    n = np.array([hash_label(label) for label in cass_tree.labels],
+                 dtype=np.uint64)[np.frombuffer(cass_tree.n_ids, np.intc)]
+    parent = np.frombuffer(cass_tree.parent, np.intc).astype(np.int64)
+    child_id = np.frombuffer(cass_tree.child_id, np.intc).astype(np.uint64)
+    removed = np.frombuffer(cass_tree.removed, np.int8).astype(bool)
+    leaves = np.frombuffer(cass_tree.leaf_nodes, np.intc).astype(np.int64)
+    hashes = []
+
+    if len(leaves) > 0:
+        nodes = leaves[~removed[leaves]]
+        hashes.append(n[nodes])
+
+        # Up to three ancestors, skipping removed ones without stopping.
+        p = nodes
+        alive = np.ones(len(nodes), dtype=bool)
+        for _ in range(3):
+            cid = child_id[p]
+            p = parent[p]
+            alive &= p >= 0
+            p = np.where(alive, p, 0)
+            emit = alive & ~removed[p]
+            hashes.append(_combine(n[nodes[emit]], cid[emit], n[p[emit]]))
+
+        # Each pair of adjacent leaves is a feature of both of them.
+        a, b = leaves[:-1], leaves[1:]
+        pairs = ~removed[a] & ~removed[b]
+        sibling_hashes = _combine(n[a[pairs]], n[b[pairs]])
+        hashes.extend([sibling_hashes, sibling_hashes])
+
+        context, has_context = _contexts(cass_tree, n, parent, child_id,
+                                         removed, leaves)
+        for first, second, use in [('prev', 'node', cass_tree.prev_use),
+                                   ('node', 'next', cass_tree.next_use)]:
+            use = np.frombuffer(use, np.intc).astype(np.int64)[nodes]
+            valid = use >= 0
+            use = np.where(valid, use, 0)
+            valid &= ~removed[use] & has_context[use] & has_context[nodes]
+            ends = {'node': nodes[valid], 'prev': use[valid],
+                    'next': use[valid]}
+            hashes.append(_combine(context[ends[first]],
+                                   context[ends[second]]))
+
+    if cass_tree.config.fsig_mode == 1 and cass_tree.fun_sig_node is not None:
+        hashes.append(n[[cass_tree.fun_sig_node]])
+
+    if len(hashes) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return (np.concatenate(hashes) % np.uint64(num_buckets)).astype(np.int64)
+
+
+def _contexts(cass_tree, n, parent, child_id, removed, leaves):
+    # CassTree._get_context for every node at once: (child_id, parent n)
+    # below ordinary parents, and the first global leaf below '$.$' ones.
+    has_parent = parent >= 0
+    p = np.where(has_parent, parent, 0)
+    label_ids = np.frombuffer(cass_tree.label_ids, np.intc)
+    dot_id = cass_tree.labels.index('$.$') if '$.$' in cass_tree.labels else -1
+    is_dot = label_ids[p] == dot_id
+
+    node_types = np.frombuffer(cass_tree.node_types, np.int8)
+    is_global = np.isin(node_types[leaves], [NodeType.GlobalVar.value[0],
+                                             NodeType.GlobalFun.value[0]])
+    num_leaves = len(leaves)
+    # next_global[i] is the first global leaf position >= i.
+    next_global = np.where(is_global, np.arange(num_leaves), num_leaves)
+    next_global = np.append(
+        np.minimum.accumulate(next_global[::-1])[::-1], num_leaves)
+    leaf_prefix = np.frombuffer(cass_tree.leaf_prefix, np.intc)
+    subtree_sizes = np.frombuffer(cass_tree.subtree_sizes, np.intc)
+    first_global = next_global[leaf_prefix[p]]
+    found = first_global < leaf_prefix[p + subtree_sizes[p]]
+    global_leaf = leaves[np.minimum(first_global, num_leaves - 1)]
+
+    context = np.where(is_dot, n[global_leaf], _combine(child_id, n[p]))
+    has_context = has_parent & np.where(
+        is_dot, found & ~removed[global_leaf], ~removed[p])
+    return context, has_context
+
+
+def bag_of_features(
+        cass_trees: Iterable[CompactCassTree],
+        num_buckets: int = NUM_BUCKETS) -> torch.Tensor:
+    # Sparse (num_buckets,) feature counts of one program.
+    ids = [feature_ids(cass_tree, num_buckets) for cass_tree in cass_trees]
+    ids = torch.from_numpy(np.concatenate(ids + [np.zeros(0, np.int64)]))
+    return torch.sparse_coo_tensor(
+        ids.unsqueeze(0),
+        torch.ones(len(ids)),
+        (num_buckets,)).coalesce()
+
+
+def bags_of_features(
+        programs: List[Iterable[CompactCassTree]],
+        num_buckets: int = NUM_BUCKETS) -> torch.Tensor:
+    # Sparse (len(programs), num_buckets) feature counts, one row per program.
+    bags = [bag_of_features(cass_trees, num_buckets)
+            for cass_trees in programs]
+    rows = torch.cat([torch.full((bag._nnz(),), i, dtype=torch.long)
+                      for i, bag in enumerate(bags)] +
+                     [torch.zeros(0, dtype=torch.long)])
+    cols = torch.cat([bag.indices()[0] for bag in bags] +
+                     [torch.zeros(0, dtype=torch.long)])
+    values = torch.cat([bag.values() for bag in bags] + [torch.zeros(0)])
+    return torch.sparse_coo_tensor(
+        torch.stack([rows, cols]),
+        values,
+        (len(programs), num_buckets)).coalesce()
@@ -1,23 +1,40 @@
-from typing import List
+from typing import Iterable, List, Union
 
 import torch
-import torchtext
+import torchtext.vocab
 
-from .cass import CassConfig, CassNode, CassTree, NodeType
-from .. import DenseGraph
+from array import array
 
+from .cass import CassConfig, CassNode, CassTree, CompactCassTree, NodeType, resolve_label
+from .. import DenseGraph, SparseGraph
+from ..sparse_graph import compute_subtree_sizes
 
-def load_file(file_name, config: CassConfig = None):
-    casses = []
+
+def load_file(file_name, config: CassConfig = None, compact: bool = False):
+    return list(iter_file(file_name, config, compact=compact))
+
+
+def iter_file(
+        file_name,
+        config: CassConfig = None,
+        compact: bool = False,
+        labels_only: bool = False):
+    # Yields the trees of a file one line at a time, so only one is held in
+    # memory. With labels_only, yields the list of node labels (n) of each
+    # tree instead, without building the tree at all.
     with open(file_name) as f:
         for line in f:
-            cass = deserialize(line, config)
+            if labels_only:
+                cass = deserialize_labels(line, config)
+            elif compact:
+                cass = deserialize_compact(line, config)
+            else:
+                cass = deserialize(line, config)
             if cass is not None:
-                casses.append(cass)
-    return casses
+                yield cass
 
 
-def deserialize(s, config: CassConfig):
+def deserialize(s, config: CassConfig = None):
     tokens = s.strip().split('\t')
     return deserialize_from_tokens(tokens, config)
 
@@ -120,46 +137,262 @@ def deserialize_from_tokens(tokens, config: CassConfig = None):
     else:
         tree_start = 0
 
-    root, rem_nodes = build_tree_rec(nodes[tree_start:])
+    root = build_tree(nodes, tree_start)
 
     assert root == nodes[tree_start]
-    assert len(rem_nodes) == 0
 
-    return CassTree(nodes, leaf_nodes)
+    return CassTree(nodes, leaf_nodes, config)
+
+
+NODE_TYPE_CHARS = {
+    'I': NodeType.Internal,
+    'N': NodeType.NumLit,
+    'C': NodeType.CharLit,
+    'S': NodeType.StringLit,
+    'V': NodeType.GlobalVar,
+    'F': NodeType.GlobalFun,
+    'v': NodeType.LocalVar,
+    'f': NodeType.LocalFun,
+    'E': NodeType.Error,
+}
+INTERNAL = NodeType.Internal.value[0]
+LOCAL_VAR = NodeType.LocalVar.value[0]
+LOCAL_FUN = NodeType.LocalFun.value[0]
+
+
+def deserialize_compact(s, config: CassConfig = None):
+    tokens = s.strip().split('\t')
+    return deserialize_compact_from_tokens(tokens, config)
+
+
+def deserialize_compact_from_tokens(tokens, config: CassConfig = None):
+    # Parses straight into the flat arrays of a CompactCassTree without
+    # creating a CassNode per node.
+    num_tokens = len(tokens)
+    if num_tokens == 0:
+        return None
+
+    num_nodes = int(tokens[0])
+
+    label_index = {}
+    labels = []
+    node_types = []
+    label_ids = []
+    n_ids = []
+    removed = []
+    num_children = []
+    prev_use = []
+    next_use = []
+
+    def intern(label):
+        label_id = label_index.get(label)
+        if label_id is None:
+            label_id = label_index[label] = len(labels)
+            labels.append(label)
+        return label_id
+
+    # Tokens repeat a lot within a tree, so each distinct one is resolved
+    # once into (node type, label id, n id, removed).
+    resolved = {}
+
+    def resolve(node_type, label, node_config):
+        _, label, n, is_removed = resolve_label(node_type, label, node_config)
+        return node_type.value[0], intern(label), intern(n), is_removed
+
+    i = 1
+    if tokens[i][0] == 'S':
+        # Like deserialize, the signature node uses the default config.
+        node = resolve(NodeType.FunSig, tokens[i][1:], None)
+        node_types.append(node[0])
+        label_ids.append(node[1])
+        n_ids.append(node[2])
+        removed.append(node[3])
+        num_children.append(0)
+        prev_use.append(-1)
+        next_use.append(-1)
+        i += 1
+
+    while i < num_tokens:
+        node_type_label = tokens[i]
+        i += 1
+        node = resolved.get(node_type_label)
+        if node is None:
+            node_type = NODE_TYPE_CHARS.get(node_type_label[0])
+            if node_type is None:
+                raise Exception()
+            label = node_type_label[1:] if node_type != NodeType.Error else ''
+            node = resolved[node_type_label] = resolve(
+                node_type, label, config)
+        node_type = node[0]
+        node_types.append(node_type)
+        label_ids.append(node[1])
+        n_ids.append(node[2])
+        removed.append(node[3])
+        if node_type == INTERNAL:
+            num_children.append(int(tokens[i]))
+            prev_use.append(-1)
+            next_use.append(-1)
+            i += 1
+        elif node_type == LOCAL_VAR or node_type == LOCAL_FUN:
+            num_children.append(0)
+            prev_use.append(max(int(tokens[i]), -1))
+            next_use.append(max(int(tokens[i + 1]), -1))
+            i += 2
+        else:
+            num_children.append(0)
+            prev_use.append(-1)
+            next_use.append(-1)
+
+    assert num_nodes == len(node_types)
+
+    return CompactCassTree(
+        labels,
+        array('b', node_types),
+        array('i', label_ids),
+        array('i', n_ids),
+        array('b', removed),
+        array('i', num_children),
+        array('i', prev_use),
+        array('i', next_use),
+        config)
 
 
-def build_tree_rec(nodes):
-    node = nodes[0]
-    nodes = nodes[1:]
-    for i in range(len(node.children)):
-        child, nodes = build_tree_rec(nodes)
-        child.parent = node
-        child.child_id = i
-        node.children[i] = child
-    return node, nodes
+def deserialize_labels(s, config: CassConfig = None):
+    tokens = s.strip().split('\t')
+    return deserialize_labels_from_tokens(tokens, config)
+
+
+def deserialize_labels_from_tokens(tokens, config: CassConfig = None):
+    # Resolves the label of every node in preorder, skipping the child
+    # counts and use indices that only matter for the tree structure.
+    num_tokens = len(tokens)
+    if num_tokens == 0:
+        return None
+
+    num_nodes = int(tokens[0])
+    labels = []
+
+    i = 1
+    if tokens[i][0] == 'S':
+        # Like deserialize, the signature node uses the default config.
+        labels.append(resolve_label(NodeType.FunSig, tokens[i][1:])[2])
+        i += 1
+
+    while i < num_tokens:
+        node_type_label = tokens[i]
+        i += 1
+        node_type = NODE_TYPE_CHARS.get(node_type_label[0])
+        label = node_type_label[1:]
+        if node_type is None:
+            raise Exception()
+        elif node_type == NodeType.Internal:
+            i += 1
+        elif node_type == NodeType.LocalVar or node_type == NodeType.LocalFun:
+            i += 2
+        elif node_type == NodeType.Error:
+            label = ''
+        labels.append(resolve_label(node_type, label, config)[2])
+
+    assert num_nodes == len(labels)
+
+    return labels
+
+
+def build_tree(nodes, start: int = 0):
+    # Links the preorder node list in one pass. The stack holds the internal
+    # nodes that still have unfilled child slots, innermost last.
+    root = nodes[start]
+    stack = []
+    num_filled = []
+    if len(root.children) > 0:
+        stack.append(root)
+        num_filled.append(0)
+    for i in range(start + 1, len(nodes)):
+        assert len(stack) > 0
+        node = nodes[i]
+        parent = stack[-1]
+        child_id = num_filled[-1]
+        node.parent = parent
+        node.child_id = child_id
+        parent.children[child_id] = node
+        if child_id + 1 == len(parent.children):
+            stack.pop()
+            num_filled.pop()
+        else:
+            num_filled[-1] = child_id + 1
+        if len(node.children) > 0:
+            stack.append(node)
+            num_filled.append(0)
+    assert len(stack) == 0
+    return root
 
 
 def cass_tree_to_graph(
-        cass_trees: List[CassTree],
-        vocabulary: torchtext.vocab.Vocab = None) -> DenseGraph:
-    nodes = []
-    [nodes.extend(cass_tree.nodes) for cass_tree in cass_trees]
-    num_nodes = len(nodes)
-    for i, node in enumerate(nodes):
-        node.set_id(i)
+        cass_trees: Iterable[Union[CassTree, CompactCassTree]],
+        vocabulary: torchtext.vocab.Vocab = None,
+        sparse: bool = False) -> Union[DenseGraph, SparseGraph]:
+    node_types, labels, parents, children = collect_graph_arrays(cass_trees)
+    label_ids = vocabulary.lookup_indices(labels)
+    return build_graph(node_types, label_ids, parents, children, sparse=sparse)
+
+
+def collect_graph_arrays(
+        cass_trees: Iterable[Union[CassTree, CompactCassTree]]):
+    node_types = []
+    labels = []
+    parents = []
+    children = []
+    i = 0
+    for cass_tree in cass_trees:
+        if isinstance(cass_tree, CompactCassTree):
+            node_types.extend(cass_tree.node_types)
+            labels.extend([label if label else ''
+                           for label in cass_tree.node_labels()])
+            for child, parent in enumerate(cass_tree.parent):
+                if parent >= 0:
+                    parents.append(parent + i)
+                    children.append(child + i)
+            i += cass_tree.num_nodes
+            continue
+        for node in cass_tree.nodes:
+            node.set_id(i)
+            node_types.append(node.node_type.value[0])
+            labels.append(node.n if node.n else '')
+            if node.parent is not None:
+                parents.append(node.parent.id)
+                children.append(i)
+            i += 1
+    return node_types, labels, parents, children
+
+
+def build_graph(
+        node_types: List[int],
+        label_ids: List[int],
+        parents: List[int],
+        children: List[int],
+        sparse: bool = False) -> Union[DenseGraph, SparseGraph]:
+    num_nodes = len(node_types)
+    node_features = torch.stack([
+        torch.as_tensor(node_types, dtype=torch.long),
+        torch.as_tensor(label_ids, dtype=torch.long)], dim=1).float()
+    parents = torch.as_tensor(parents, dtype=torch.long)
+    children = torch.as_tensor(children, dtype=torch.long)
+    loops = torch.arange(num_nodes)
+    rows = torch.cat([parents, children, loops])
+    cols = torch.cat([children, parents, loops])
+
+    if sparse:
+        order = torch.argsort(rows * num_nodes + cols)
+        edge_index = torch.stack([rows[order], cols[order]])
+        return SparseGraph(
+            node_features=node_features,
+            edge_index=edge_index,
+            subtree_sizes=compute_subtree_sizes(
+                num_nodes, parents.tolist(), children.tolist()),
+            degree=torch.bincount(rows, minlength=num_nodes))
 
-    node_features = torch.zeros(num_nodes, 2)
     adjacency_matrix = torch.zeros(num_nodes, num_nodes)
-    for node in nodes:
-        node_features[node.id, 0] = node.node_type.value[0]
-        if node.n:
-            node_features[node.id, 1] = vocabulary[node.n]
-        else:
-            node_features[node.id, 1] = vocabulary['']
-        for child in node.children:
-            adjacency_matrix[node.id, child.id] = 1
-            adjacency_matrix[child.id, node.id] = 1
-        adjacency_matrix[node.id, node.id] = 1
+    adjacency_matrix[rows, cols] = 1
     return DenseGraph(
         node_features=node_features,
         adjacency_matrix=adjacency_matrix)
@@ -1 +1,3 @@
 from .util import train_val_test_split
+from .graph_dataset import GraphDataset
+from .graph_shards import ShardedGraphDataset
@@ -1,21 +1,38 @@
+import json
 import os
-import random
 
 import torch
 
-from .. import DenseGraph
+from .. import load_graph
+from ..profiling import timer
+
+
+NODE_COUNTS_FILE = 'node_counts.json'
 
 
 class GraphDataset(torch.utils.data.Dataset):
     def __init__(self, data_dir: str):
         self.data_dir = data_dir
 
-        self.file_names = os.listdir(data_dir)
-        random.shuffle(self.file_names)
+        # A fixed order, so that every process indexes the same graphs.
+        self.file_names = sorted(
+            file_name for file_name in os.listdir(data_dir)
+            if file_name.endswith('.pt'))
 
     def __len__(self):
         return len(self.file_names)
 
     def __getitem__(self, index):
-        file_name = self.file_names[index]
-        return DenseGraph.load(os.path.join(self.data_dir, file_name))
+        with timer('getitem'):
+            file_name = self.file_names[index]
+            return load_graph(os.path.join(self.data_dir, file_name))
+
+    def node_counts(self):
+        # Read from the index written by preprocess.py; graphs are only loaded
+        # when there is no index.
+        index_file = os.path.join(self.data_dir, NODE_COUNTS_FILE)
+        if os.path.exists(index_file):
+            with open(index_file) as f:
+                node_counts = json.load(f)
+            return [node_counts[file_name] for file_name in self.file_names]
+        return [self[i].num_nodes for i in range(len(self))]
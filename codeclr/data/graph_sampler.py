@@ -2,11 +2,128 @@ import torch
 
 
 class GraphSampler(torch.utils.data.Sampler):
-    def __init__(self, indices: range):
+    def __init__(
+            self,
+            indices: range,
+            shuffle: bool = False,
+            seed: int = 0,
+            num_replicas: int = 1,
+            rank: int = 0):
+        # Like DistributedSampler, the order only changes through set_epoch,
+        # which the training loop calls before every epoch. With several
+        # replicas (distributed training), every rank sees every
+        # num_replicas-th index of the same order. The order is padded with
+        # its first indices so that all ranks get the same number.
+        assert 0 <= rank < num_replicas
         self.indices = indices
+        self.shuffle = shuffle
+        self.seed = seed
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def __iter__(self):
+        indices = list(self.indices)
+        if self.shuffle:
+            # Seeded by epoch, so the order changes every epoch but is the
+            # same across runs and processes.
+            generator = torch.Generator()
+            generator.manual_seed(self.seed + self.epoch)
+            order = torch.randperm(len(indices), generator=generator)
+            indices = [indices[i] for i in order.tolist()]
+        if self.num_replicas == 1:
+            return iter(indices)
+        num_padding = len(self) * self.num_replicas - len(indices)
+        indices += (indices * self.num_replicas)[:num_padding]
+        return iter(indices[self.rank::self.num_replicas])
+
+    def __len__(self):
+        return -(-len(self.indices) // self.num_replicas)
+
+
+class BucketBatchSampler(torch.utils.data.Sampler):
+    def __init__(
+            self,
+            indices: range,
+            node_counts,
+            batch_size: int = None,
+            max_nodes: int = None,
+            bucket_size: int = 1024,
+            shuffle: bool = True,
+            seed: int = 0,
+            drop_last: bool = False,
+            num_replicas: int = 1,
+            rank: int = 0):
+        # Yields batches of graphs of similar size: the indices are shuffled,
+        # cut into buckets of bucket_size graphs, and each bucket is sorted by
+        # node count before it is split into batches of batch_size graphs
+        # and/or at most max_nodes nodes. As with GraphSampler, the batches
+        # only change through set_epoch; they are built once per epoch. With
+        # several replicas, every rank takes every num_replicas-th batch, and
+        # the batches left over after an equal share are dropped.
+        assert batch_size is not None or max_nodes is not None
+        assert 0 <= rank < num_replicas
+        self.indices = indices
+        self.node_counts = node_counts
+        self.batch_size = batch_size
+        self.max_nodes = max_nodes
+        self.bucket_size = bucket_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.drop_last = drop_last
+        self.num_replicas = num_replicas
+        self.rank = rank
+        self.epoch = 0
+        self.epoch_batches = None
+
+    def set_epoch(self, epoch: int):
+        self.epoch = epoch
+
+    def _batches(self, epoch: int):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + epoch)
+        indices = list(self.indices)
+        if self.shuffle:
+            order = torch.randperm(len(indices), generator=generator)
+            indices = [indices[i] for i in order.tolist()]
+
+        batches = []
+        for start in range(0, len(indices), self.bucket_size):
+            bucket = sorted(
+                indices[start:start + self.bucket_size],
+                key=lambda i: self.node_counts[i])
+            batch = []
+            num_nodes = 0
+            for i in bucket:
+                if batch and (
+                    (self.batch_size is not None and len(batch) == self.batch_size) or (
+                        self.max_nodes is not None and num_nodes +
+                        self.node_counts[i] > self.max_nodes)):
+                    batches.append(batch)
+                    batch = []
+                    num_nodes = 0
+                batch.append(i)
+                num_nodes += self.node_counts[i]
+            if batch and not (
+                    self.drop_last and self.batch_size is not None and len(batch) < self.batch_size):
+                batches.append(batch)
+
+        if self.shuffle:
+            order = torch.randperm(len(batches), generator=generator)
+            batches = [batches[i] for i in order.tolist()]
+        num_batches = len(batches) // self.num_replicas * self.num_replicas
+        return batches[self.rank:num_batches:self.num_replicas]
+
+    def _current_batches(self):
+        if self.epoch_batches is None or self.epoch_batches[0] != self.epoch:
+            self.epoch_batches = (self.epoch, self._batches(self.epoch))
+        return self.epoch_batches[1]
 
     def __iter__(self):
-        return iter(self.indices)
+        return iter(self._current_batches())
 
     def __len__(self):
-        return len(self.indices)
+        return len(self._current_batches())
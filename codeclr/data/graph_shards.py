@@ -0,0 +1,137 @@
+import json
+import os
+from typing import List
+
+import numpy as np
+import torch
+
+from .. import SparseGraph
+from ..profiling import timer
+
+
+INDEX_FILE = 'index.json'
+
+
+def write_shard(
+        shard_dir: str,
+        shard: str,
+        graphs: List[SparseGraph],
+        names: List[str]) -> None:
+    # A shard stores the node features and edge indices of all of its graphs
+    # back to back, plus the offsets at which each graph starts.
+    offsets = np.zeros((len(graphs) + 1, 2), dtype=np.int64)
+    for i, graph in enumerate(graphs):
+        offsets[i + 1, 0] = offsets[i, 0] + graph.num_nodes
+        offsets[i + 1, 1] = offsets[i, 1] + graph.edge_index.shape[1]
+
+    node_features = np.concatenate(
+        [graph.node_features.numpy() for graph in graphs] +
+        [np.zeros((0, 2), dtype=np.float32)]).astype(np.float32)
+    edge_index = np.concatenate(
+        [graph.edge_index.numpy() for graph in graphs] +
+        [np.zeros((2, 0), dtype=np.int64)], axis=1).astype(np.int64)
+
+    prefix = os.path.join(shard_dir, shard)
+    np.save(f'{prefix}.node_features.npy', node_features)
+    np.save(f'{prefix}.edge_index.npy', edge_index)
+    if all(graph.subtree_sizes is not None for graph in graphs):
+        subtree_sizes = np.concatenate(
+            [graph.subtree_sizes.numpy() for graph in graphs] +
+            [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        np.save(f'{prefix}.subtree_sizes.npy', subtree_sizes)
+    if all(graph.degree is not None for graph in graphs):
+        degree = np.concatenate(
+            [graph.degree.numpy() for graph in graphs] +
+            [np.zeros(0, dtype=np.int64)]).astype(np.int64)
+        np.save(f'{prefix}.degree.npy', degree)
+    np.save(f'{prefix}.offsets.npy', offsets)
+    with open(f'{prefix}.names.json', 'w') as f:
+        json.dump(names, f)
+
+
+def write_index(shard_dir: str, shards: List[str]) -> None:
+    with open(os.path.join(shard_dir, INDEX_FILE), 'w') as f:
+        json.dump(shards, f)
+
+
+def is_shard_dir(data_dir: str) -> bool:
+    return os.path.exists(os.path.join(data_dir, INDEX_FILE))
+
+
+class GraphShard:
+    def __init__(self, shard_dir: str, shard: str):
+        self.prefix = os.path.join(shard_dir, shard)
+        self.offsets = np.load(f'{self.prefix}.offsets.npy')
+        with open(f'{self.prefix}.names.json') as f:
+            self.names = json.load(f)
+        self.node_features = None
+        self.edge_index = None
+        self.subtree_sizes = None
+        self.degree = None
+
+    def __len__(self):
+        return len(self.names)
+
+    def node_counts(self):
+        return (self.offsets[1:, 0] - self.offsets[:-1, 0]).tolist()
+
+    def _open(self):
+        # Copy-on-write maps are writable, so torch.from_numpy can wrap them
+        # without copying while the files on disk stay untouched.
+        self.node_features = torch.from_numpy(
+            np.load(f'{self.prefix}.node_features.npy', mmap_mode='c'))
+        self.edge_index = torch.from_numpy(
+            np.load(f'{self.prefix}.edge_index.npy', mmap_mode='c'))
+        if os.path.exists(f'{self.prefix}.subtree_sizes.npy'):
+            self.subtree_sizes = torch.from_numpy(
+                np.load(f'{self.prefix}.subtree_sizes.npy', mmap_mode='c'))
+        if os.path.exists(f'{self.prefix}.degree.npy'):
+            self.degree = torch.from_numpy(
+                np.load(f'{self.prefix}.degree.npy', mmap_mode='c'))
+
+    def __getitem__(self, index) -> SparseGraph:
+        if self.node_features is None:
+            self._open()
+        node_start, edge_start = self.offsets[index]
+        node_end, edge_end = self.offsets[index + 1]
+        subtree_sizes = None
+        if self.subtree_sizes is not None:
+            subtree_sizes = self.subtree_sizes[node_start:node_end]
+        degree = None
+        if self.degree is not None:
+            degree = self.degree[node_start:node_end]
+        return SparseGraph(
+            node_features=self.node_features[node_start:node_end],
+            edge_index=self.edge_index[:, edge_start:edge_end],
+            subtree_sizes=subtree_sizes,
+            degree=degree)
+
+
+class ShardedGraphDataset(torch.utils.data.Dataset):
+    def __init__(self, data_dir: str, shards: List[str] = None):
+        self.data_dir = data_dir
+
+        if shards is None:
+            with open(os.path.join(data_dir, INDEX_FILE)) as f:
+                shards = json.load(f)
+        self.shards = [GraphShard(data_dir, shard) for shard in shards]
+
+        self.file_names = []
+        self.index = []
+        for i, (name, shard) in enumerate(zip(shards, self.shards)):
+            for j, graph_name in enumerate(shard.names):
+                self.file_names.append(f'{name}_{graph_name}')
+                self.index.append((i, j))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __getitem__(self, index):
+        with timer('getitem'):
+            shard, graph = self.index[index]
+            return self.shards[shard][graph]
+
+    def node_counts(self):
+        shard_node_counts = [shard.node_counts() for shard in self.shards]
+        return [shard_node_counts[shard][graph]
+                for shard, graph in self.index]
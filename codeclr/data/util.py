@@ -1,43 +1,153 @@
+import json
+import os
+import random
+
 import torch
 
 from .graph_dataset import GraphDataset
-from .graph_sampler import GraphSampler
+from .graph_shards import ShardedGraphDataset, is_shard_dir
+from .graph_sampler import BucketBatchSampler, GraphSampler
 
 
 def identity(x):
     return x
 
 
-def train_val_test_split(
-        data_dir: str,
+def load_dataset(data_dir: str):
+    if is_shard_dir(data_dir):
+        return ShardedGraphDataset(data_dir)
+    return GraphDataset(data_dir)
+
+
+def split_file_names(
+        file_names,
         train_frac: float = 0.8,
-        batch_size: int = 1):
+        seed: int = 0,
+        split_file: str = None):
+    # The split is made over sorted file names with its own RNG, so it does
+    # not depend on listing order or global random state. When split_file is
+    # given, the first split is saved there and reused afterwards, as long as
+    # it covers exactly the same file names.
+    if split_file is not None and os.path.exists(split_file):
+        with open(split_file) as f:
+            split = json.load(f)
+        if sorted(name for names in split.values() for name in names) != \
+                sorted(file_names):
+            raise ValueError(
+                f'The split in {split_file} does not match the graphs in the '
+                'dataset; delete it to make a new split.')
+        return split
 
-    dataset = GraphDataset(data_dir)
-    n = len(dataset)
+    file_names = sorted(file_names)
+    random.Random(seed).shuffle(file_names)
+    n = len(file_names)
     train_size = int(train_frac * n)
     val_size = (n - train_size) // 2
+    split = {
+        'train': file_names[:train_size],
+        'val': file_names[train_size:train_size + val_size],
+        'test': file_names[train_size + val_size:],
+    }
+
+    if split_file is not None:
+        with open(split_file, 'w') as f:
+            json.dump(split, f)
+    return split
+
+
+def load_split(
+        data_dir: str,
+        train_frac: float = 0.8,
+        seed: int = 0,
+        split_file: str = None):
+    # The dataset, and the indices of its train, val and test graphs.
+    dataset = load_dataset(data_dir)
+    split = split_file_names(
+        dataset.file_names,
+        train_frac=train_frac,
+        seed=seed,
+        split_file=split_file)
+    index = {file_name: i for i, file_name in enumerate(dataset.file_names)}
+    return dataset, {name: [index[file_name] for file_name in file_names]
+                     for name, file_names in split.items()}
+
+
+def problem_labels(file_names) -> torch.Tensor:
+    # CodeNet graphs are named {problem}_{submission}; programs that solve
+    # the same problem share a label.
+    labels = {}
+    return torch.tensor([
+        labels.setdefault(file_name.split('_')[0], len(labels))
+        for file_name in file_names], dtype=torch.long)
+
+
+def train_val_test_split(
+        data_dir: str,
+        train_frac: float = 0.8,
+        batch_size: int = 1,
+        seed: int = 0,
+        split_file: str = None,
+        shuffle: bool = False,
+        num_workers: int = 0,
+        pin_memory: bool = False,
+        prefetch_factor: int = 2,
+        bucket_by_size: bool = False,
+        max_nodes_per_batch: int = None,
+        num_replicas: int = 1,
+        rank: int = 0):
+    # With num_replicas > 1, every dataloader yields only the share of
+    # process rank, and all ranks yield the same number of batches.
+
+    dataset, split = load_split(
+        data_dir, train_frac=train_frac, seed=seed, split_file=split_file)
+    train_indices = split['train']
+    val_indices = split['val']
+    test_indices = split['test']
+
+    loader_kwargs = {
+        'collate_fn': identity,
+        'num_workers': num_workers,
+        'pin_memory': pin_memory,
+    }
+    if num_workers > 0:
+        loader_kwargs['persistent_workers'] = True
+        loader_kwargs['prefetch_factor'] = prefetch_factor
+
+    bucketing = bucket_by_size or max_nodes_per_batch is not None
+    if bucketing:
+        node_counts = dataset.node_counts()
+
+        def make_dataloader(indices, shuffle):
+            return torch.utils.data.DataLoader(
+                dataset,
+                batch_sampler=BucketBatchSampler(
+                    indices,
+                    node_counts,
+                    batch_size=None if max_nodes_per_batch else batch_size,
+                    max_nodes=max_nodes_per_batch,
+                    shuffle=shuffle,
+                    seed=seed,
+                    drop_last=True,
+                    num_replicas=num_replicas,
+                    rank=rank),
+                **loader_kwargs)
+    else:
+        def make_dataloader(indices, shuffle):
+            return torch.utils.data.DataLoader(
+                dataset,
+                batch_size=batch_size,
+                sampler=GraphSampler(
+                    indices,
+                    shuffle=shuffle,
+                    seed=seed,
+                    num_replicas=num_replicas,
+                    rank=rank),
+                drop_last=True,
+                **loader_kwargs)
 
-    train_indices = range(train_size)
-    val_indices = range(train_size, train_size + val_size)
-    test_indices = range(train_size + val_size, n)
-
-    train_dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=batch_size,
-        sampler=GraphSampler(train_indices),
-        collate_fn=identity,
-        drop_last=True)
-    val_dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=batch_size,
-        sampler=GraphSampler(val_indices),
-        collate_fn=identity,
-        drop_last=True)
-    test_dataloader = torch.utils.data.DataLoader(
-        dataset,
-        batch_size=batch_size,
-        sampler=GraphSampler(test_indices),
-        collate_fn=identity,
-        drop_last=True)
+    # Size-bucketed batches are always reshuffled for training, since
+    # otherwise every epoch would see the same batches.
+    train_dataloader = make_dataloader(train_indices, shuffle or bucketing)
+    val_dataloader = make_dataloader(val_indices, False)
+    test_dataloader = make_dataloader(test_indices, False)
     return train_dataloader, val_dataloader, test_dataloader
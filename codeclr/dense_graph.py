@@ -15,6 +15,17 @@ class DenseGraph:
     def num_edges(self) -> int:
         return self.adjacency_matrix.sum().item() / 2
 
+    def neighbors(self, node: int) -> torch.Tensor:
+        return self.adjacency_matrix[node].nonzero().squeeze(-1)
+
+    def with_node_features(self, node_features: torch.Tensor) -> 'DenseGraph':
+        return DenseGraph(node_features, self.adjacency_matrix)
+
+    def drop_nodes(self, node_mask: torch.Tensor) -> 'DenseGraph':
+        return DenseGraph(
+            self.node_features * node_mask.unsqueeze(-1),
+            self.adjacency_matrix * node_mask.unsqueeze(-1) * node_mask.unsqueeze(-2))
+
     def save(self, path: str) -> None:
         torch.save({'node_features': self.node_features,
                     'adjacency_matrix': self.adjacency_matrix}, path)
@@ -0,0 +1,125 @@
+from typing import List, Union
+
+import torch
+
+from .dense_graph import DenseGraph
+from .sparse_graph import SparseGraph, compute_subtree_sizes, drop_edges_degree
+
+
+class GraphBatch:
+    def __init__(self, node_features: torch.Tensor, edge_index: torch.Tensor,
+                 batch: torch.Tensor, num_graphs: int,
+                 subtree_sizes: torch.Tensor = None,
+                 degree: torch.Tensor = None) -> None:
+        # The graphs of a batch form one block-diagonal graph: edge indices
+        # are offset by the position of each graph's first node, and batch
+        # maps every node to the graph it belongs to.
+        self.node_features = node_features
+        self.edge_index = edge_index
+        self.batch = batch
+        self.num_graphs = num_graphs
+        self.subtree_sizes = subtree_sizes
+        self.degree = degree
+
+    @property
+    def num_nodes(self) -> int:
+        return self.node_features.shape[0]
+
+    @property
+    def num_edges(self) -> int:
+        return self.edge_index.shape[1] / 2
+
+    @property
+    def graph_sizes(self) -> torch.Tensor:
+        return torch.bincount(self.batch, minlength=self.num_graphs)
+
+    @property
+    def ptr(self) -> torch.Tensor:
+        ptr = torch.zeros(
+            self.num_graphs + 1,
+            dtype=torch.long,
+            device=self.batch.device)
+        torch.cumsum(self.graph_sizes, dim=0, out=ptr[1:])
+        return ptr
+
+    def with_node_features(self, node_features: torch.Tensor) -> 'GraphBatch':
+        return GraphBatch(
+            node_features,
+            self.edge_index,
+            self.batch,
+            self.num_graphs,
+            self.subtree_sizes,
+            self.degree)
+
+    def drop_nodes(self, node_mask: torch.Tensor) -> 'GraphBatch':
+        row, col = self.edge_index
+        edge_mask = node_mask[row] & node_mask[col]
+        return GraphBatch(
+            self.node_features * node_mask.unsqueeze(-1),
+            self.edge_index[:, edge_mask],
+            self.batch,
+            self.num_graphs,
+            self.subtree_sizes,
+            drop_edges_degree(self.degree, self.edge_index, edge_mask))
+
+    def pad(self, num_nodes: int, num_graphs: int) -> 'GraphBatch':
+        # Appends isolated zero-feature nodes up to num_nodes, all in one
+        # extra graph, and empty graphs up to num_graphs.
+        num_padding = num_nodes - self.num_nodes
+        assert num_padding >= 0 and num_graphs >= self.num_graphs
+        assert num_padding == 0 or num_graphs > self.num_graphs
+        subtree_sizes = None
+        if self.subtree_sizes is not None:
+            subtree_sizes = torch.cat([
+                self.subtree_sizes,
+                self.subtree_sizes.new_ones(num_padding)])
+        degree = None
+        if self.degree is not None:
+            degree = torch.cat([self.degree,
+                                self.degree.new_zeros(num_padding)])
+        return GraphBatch(
+            torch.cat([self.node_features, self.node_features.new_zeros(
+                num_padding, self.node_features.shape[1])]),
+            self.edge_index,
+            torch.cat([self.batch, self.batch.new_full(
+                (num_padding,), self.num_graphs)]),
+            num_graphs,
+            subtree_sizes,
+            degree)
+
+    def compute_subtree_sizes(self) -> torch.Tensor:
+        # Fallback for graphs stored without subtree sizes: in preorder the
+        # only neighbour with a smaller index is the parent.
+        row, col = self.edge_index
+        tree_edges = col < row
+        return compute_subtree_sizes(
+            self.num_nodes,
+            col[tree_edges].tolist(),
+            row[tree_edges].tolist())
+
+    @staticmethod
+    def from_graphs(
+            graphs: List[Union[DenseGraph, SparseGraph]]) -> 'GraphBatch':
+        graphs = [SparseGraph.from_dense(graph) if isinstance(
+            graph, DenseGraph) else graph for graph in graphs]
+        sizes = torch.tensor([graph.num_nodes for graph in graphs])
+        offsets = torch.cumsum(sizes, dim=0) - sizes
+        node_features = torch.cat(
+            [graph.node_features for graph in graphs]).float()
+        edge_index = torch.cat([graph.edge_index + offset for graph,
+                                offset in zip(graphs, offsets.tolist())], dim=1)
+        batch = torch.repeat_interleave(torch.arange(len(graphs)), sizes)
+        subtree_sizes = None
+        if all(graph.subtree_sizes is not None for graph in graphs):
+            subtree_sizes = torch.cat(
+                [graph.subtree_sizes for graph in graphs])
+        degree = None
+        if all(graph.degree is not None for graph in graphs):
+            degree = torch.cat([graph.degree for graph in graphs])
+        return GraphBatch(
+            node_features,
+            edge_index,
+            batch,
+            len(graphs),
+            subtree_sizes,
+            degree)
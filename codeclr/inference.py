@@ -0,0 +1,140 @@
+import json
+import os
+from typing import Iterator, List, Tuple
+
+import numpy as np
+import torch
+import torchtext
+
+from .cass import CassConfig, cass_tree_to_graph, iter_file
+from .model.encoder import Encoder
+
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+IDS_FILE = 'ids.json'
+
+
+def load_encoder(checkpoint_file: str) -> Encoder:
+    # Rebuilds the encoder of a pretrain.py checkpoint, reading the layer
+    # sizes and vocabulary size off its weights.
+    checkpoint = torch.load(checkpoint_file, map_location='cpu')
+    state_dict = checkpoint.get('model_state_dict', checkpoint)
+    state_dict = {key[len('encoder.'):]: value
+                  for key, value in state_dict.items()
+                  if key.startswith('encoder.')}
+    vocab_size, embedding_dim = state_dict['node_label_embedding.weight'].shape
+    layer_sizes = [2 * embedding_dim]
+    while f'layers.{len(layer_sizes) - 1}.bias' in state_dict:
+        layer_sizes.append(
+            state_dict[f'layers.{len(layer_sizes) - 1}.bias'].shape[0])
+    encoder = Encoder(layer_sizes, vocab_size=vocab_size)
+    encoder.load_state_dict(state_dict)
+    return encoder.eval()
+
+
+def find_cas_files(cas_dir: str) -> List[str]:
+    # Every .cas file below cas_dir, in a fixed order.
+    return sorted(
+        os.path.relpath(os.path.join(root, file_name), cas_dir)
+        for root, _, file_names in os.walk(cas_dir)
+        for file_name in file_names if file_name.endswith('.cas'))
+
+
+class CassFileDataset(torch.utils.data.Dataset):
+    # Builds the sparse graph of each .cas file on access, as preprocess.py
+    # does. The ids name a file by its path relative to cas_dir, which for
+    # the CodeNet layout matches the names of the preprocessed graphs
+    # (<problem>_<submission>).
+    def __init__(
+            self,
+            cas_dir: str,
+            vocabulary: torchtext.vocab.Vocab,
+            config: CassConfig = None,
+            file_names: List[str] = None):
+        self.cas_dir = cas_dir
+        self.vocabulary = vocabulary
+        self.config = config
+        if file_names is None:
+            file_names = find_cas_files(cas_dir)
+        self.file_names = file_names
+        self.ids = [file_name[:-len('.cas')].replace(os.sep, '_')
+                    for file_name in file_names]
+
+    def __len__(self):
+        return len(self.file_names)
+
+    def __getitem__(self, index):
+        cass_trees = iter_file(
+            os.path.join(self.cas_dir, self.file_names[index]),
+            self.config,
+            compact=True)
+        return cass_tree_to_graph(
+            cass_trees, vocabulary=self.vocabulary, sparse=True)
+
+
+def dataset_ids(dataset: torch.utils.data.Dataset) -> List[str]:
+    if hasattr(dataset, 'ids'):
+        return dataset.ids
+    return [file_name[:-len('.pt')] if file_name.endswith('.pt')
+            else file_name for file_name in dataset.file_names]
+
+
+def identity(x):
+    return x
+
+
+def embed_batches(
+        encoder: Encoder,
+        dataset: torch.utils.data.Dataset,
+        batch_size: int = 256,
+        num_workers: int = 0) -> Iterator[torch.Tensor]:
+    # Yields the embeddings of the graphs of dataset, batch by batch and in
+    # order. Workers build the graphs while the encoder runs.
+    loader_kwargs = {}
+    if num_workers > 0:
+        loader_kwargs['prefetch_factor'] = 4
+    dataloader = torch.utils.data.DataLoader(
+        dataset,
+        batch_size=batch_size,
+        collate_fn=identity,
+        num_workers=num_workers,
+        **loader_kwargs)
+    with torch.inference_mode():
+        for graphs in dataloader:
+            yield encoder(graphs)
+
+
+def write_embeddings(
+        output_dir: str,
+        encoder: Encoder,
+        dataset: torch.utils.data.Dataset,
+        batch_size: int = 256,
+        num_workers: int = 0,
+        dtype: str = 'float32') -> np.ndarray:
+    # Writes the embeddings of dataset as one (len(dataset), dim) .npy
+    # matrix, row i embedding the graph with id ids[i] of the id index.
+    # The matrix is written through a memory map, so it never has to fit in
+    # memory.
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, IDS_FILE), 'w') as f:
+        json.dump(dataset_ids(dataset), f)
+    embeddings = np.lib.format.open_memmap(
+        os.path.join(output_dir, EMBEDDINGS_FILE),
+        mode='w+',
+        dtype=dtype,
+        shape=(len(dataset), encoder.layer_sizes[-1]))
+    start = 0
+    for batch in embed_batches(encoder, dataset, batch_size, num_workers):
+        embeddings[start:start + len(batch)] = batch.float().numpy()
+        start += len(batch)
+    embeddings.flush()
+    return embeddings
+
+
+def load_embeddings(output_dir: str) -> Tuple[np.ndarray, List[str]]:
+    # The embedding matrix, memory-mapped read-only, and its id index.
+    embeddings = np.load(
+        os.path.join(output_dir, EMBEDDINGS_FILE), mmap_mode='r')
+    with open(os.path.join(output_dir, IDS_FILE)) as f:
+        ids = json.load(f)
+    return embeddings, ids
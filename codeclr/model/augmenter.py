@@ -1,9 +1,8 @@
-import random
-from typing import List
+from typing import List, Union
 
 import torch
 
-from .. import DenseGraph
+from .. import DenseGraph, GraphBatch, SparseGraph
 from ..cass.cass import NodeType
 
 
@@ -13,122 +12,177 @@ class Augmenter(torch.nn.Module):
         mask_frac: float = 0.25,
         mask_idx: int = 0,
         augment_1: str = 'node_mask',
-        augment_2: str = 'node_mask'
+        augment_2: str = 'node_mask',
+        seed: int = None
     ):
         super().__init__()
         self.mask_frac = mask_frac
         self.mask_idx = mask_idx
 
+        # Both augmentations draw from one generator so a seed makes the pair
+        # of views reproducible; without one they use the global RNG.
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator()
+            self.generator.manual_seed(seed)
+
         if augment_1 == 'identity':
             self.augment_1 = Identity()
         elif augment_1 == 'node_mask':
-            self.augment_1 = NodeMasker(mask_frac=mask_frac, mask_idx=mask_idx)
+            self.augment_1 = NodeMasker(
+                mask_frac=mask_frac,
+                mask_idx=mask_idx,
+                generator=self.generator)
         elif augment_1 == 'node_drop':
-            self.augment_1 = NodeDropper(drop_frac=mask_frac)
+            self.augment_1 = NodeDropper(
+                drop_frac=mask_frac, generator=self.generator)
         elif augment_1 == 'subtree_mask':
             self.augment_1 = SubtreeMasker(
-                mask_frac=mask_frac, mask_idx=mask_idx)
+                mask_frac=mask_frac,
+                mask_idx=mask_idx,
+                generator=self.generator)
 
         if augment_2 == 'identity':
             self.augment_2 = Identity()
         elif augment_2 == 'node_mask':
-            self.augment_2 = NodeMasker(mask_frac=mask_frac, mask_idx=mask_idx)
+            self.augment_2 = NodeMasker(
+                mask_frac=mask_frac,
+                mask_idx=mask_idx,
+                generator=self.generator)
         elif augment_2 == 'node_drop':
-            self.augment_2 = NodeDropper(drop_frac=mask_frac)
+            self.augment_2 = NodeDropper(
+                drop_frac=mask_frac, generator=self.generator)
         elif augment_2 == 'subtree_mask':
             self.augment_2 = SubtreeMasker(
-                mask_frac=mask_frac, mask_idx=mask_idx)
-
-    def forward(self, graphs: List[DenseGraph]):
+                mask_frac=mask_frac,
+                mask_idx=mask_idx,
+                generator=self.generator)
+
+    def forward(self, graphs: Union[GraphBatch,
+                                    List[Union[DenseGraph, SparseGraph]]]):
+        if not isinstance(graphs, GraphBatch):
+            graphs = GraphBatch.from_graphs(graphs)
         augment_1 = self.augment_1(graphs)
         augment_2 = self.augment_2(graphs)
         return augment_1, augment_2
 
 
+def sample_nodes(
+        graphs: GraphBatch,
+        num_samples: torch.Tensor,
+        generator: torch.Generator = None,
+        candidates: torch.Tensor = None) -> torch.Tensor:
+    # Draws num_samples[i] distinct nodes uniformly from every graph i (out of
+    # the candidate nodes, if given) with a single random draw: order the
+    # nodes by (graph, random key) and keep the first positions of each graph.
+    keys = torch.rand(graphs.num_nodes, generator=generator)
+    if candidates is not None:
+        keys = keys.masked_fill(~candidates, 2)
+    order = torch.argsort(keys)
+    order = order[torch.argsort(graphs.batch[order], stable=True)]
+    batch = graphs.batch[order]
+    rank = torch.arange(graphs.num_nodes) - graphs.ptr[batch]
+    selected = rank < num_samples[batch]
+    if candidates is not None:
+        selected &= candidates[order]
+    node_mask = torch.zeros(graphs.num_nodes, dtype=torch.bool)
+    node_mask[order[selected]] = True
+    return node_mask
+
+
+def mask_node_features(
+        graphs: GraphBatch,
+        node_mask: torch.Tensor,
+        mask_idx: int) -> GraphBatch:
+    mask_value = torch.tensor(
+        [NodeType.Mask.value, mask_idx], dtype=graphs.node_features.dtype)
+    return graphs.with_node_features(torch.where(
+        node_mask.unsqueeze(-1), mask_value, graphs.node_features))
+
+
 class Identity(torch.nn.Module):
     def __init__(self):
         super().__init__()
 
-    def forward(self, graphs: List[DenseGraph]):
+    def forward(self, graphs: GraphBatch):
         return graphs
 
 
 class NodeMasker(torch.nn.Module):
-    def __init__(self, mask_frac: float = 0.25, mask_idx: int = 0):
+    def __init__(
+            self,
+            mask_frac: float = 0.25,
+            mask_idx: int = 0,
+            generator: torch.Generator = None):
         super().__init__()
         self.mask_frac = mask_frac
         self.mask_idx = mask_idx
+        self.generator = generator
 
-    def forward(self, graphs: List[DenseGraph]):
-        augments = []
-        for graph in graphs:
-            num_nodes = graph.num_nodes
-            node_features = graph.node_features.clone()
-
-            num_nodes_to_mask = int(num_nodes * self.mask_frac)
-            nodes_to_mask = torch.randperm(num_nodes)[:num_nodes_to_mask]
-            node_features[:, 0][nodes_to_mask] = NodeType.Mask.value
-            node_features[:, 1][nodes_to_mask] = self.mask_idx
-
-            augments.append(DenseGraph(node_features, graph.adjacency_matrix))
-        return augments
+    def forward(self, graphs: GraphBatch):
+        num_nodes_to_mask = (
+            graphs.graph_sizes.double() *
+            self.mask_frac).long()
+        node_mask = sample_nodes(graphs, num_nodes_to_mask, self.generator)
+        return mask_node_features(graphs, node_mask, self.mask_idx)
 
 
 class NodeDropper(torch.nn.Module):
-    def __init__(self, drop_frac: float = 0.25):
+    def __init__(
+            self,
+            drop_frac: float = 0.25,
+            generator: torch.Generator = None):
         super().__init__()
         self.drop_frac = drop_frac
+        self.generator = generator
 
-    def forward(self, graphs: List[DenseGraph]):
-        augments = []
-        for graph in graphs:
-            num_nodes = graph.num_nodes
-            node_features = graph.node_features.clone()
-            adj = graph.adjacency_matrix.clone()
-
-            num_nodes_to_drop = int(num_nodes * self.drop_frac)
-            nodes_to_drop = torch.randperm(num_nodes)[:num_nodes_to_drop]
-            node_mask = torch.ones(num_nodes, dtype=torch.bool)
-            node_mask[nodes_to_drop] = False
-
-            node_features = node_features * node_mask.unsqueeze(-1)
-            adj = adj * node_mask.unsqueeze(-1) * node_mask.unsqueeze(-2)
-            augments.append(DenseGraph(node_features, adj))
-        return augments
+    def forward(self, graphs: GraphBatch):
+        num_nodes_to_drop = (
+            graphs.graph_sizes.double() *
+            self.drop_frac).long()
+        node_mask = ~sample_nodes(graphs, num_nodes_to_drop, self.generator)
+        return graphs.drop_nodes(node_mask)
 
 
 class SubtreeMasker(torch.nn.Module):
-    def __init__(self, mask_frac: float = 0.25, mask_idx: int = 0):
+    def __init__(
+            self,
+            mask_frac: float = 0.25,
+            mask_idx: int = 0,
+            generator: torch.Generator = None):
         super().__init__()
         self.mask_frac = mask_frac
         self.mask_idx = mask_idx
-
-    def forward(self, graphs: List[DenseGraph]):
-        augments = []
-        for graph in graphs:
-            num_nodes = graph.num_nodes
-            node_features = graph.node_features.clone()
-            adj = graph.adjacency_matrix
-
-            num_nodes_to_mask = int(num_nodes * self.mask_frac)
-            node_mask = torch.ones(num_nodes, dtype=torch.bool)
-
-            root = random.randint(0, num_nodes - 1)
-            node_mask[root] = False
-            bfs_queue = [root]
-            seen = set()
-            while node_mask.sum().item() < num_nodes_to_mask and len(bfs_queue) > 0:
-                node = bfs_queue.pop(0)
-                seen.add(node)
-                neighbors = adj[node].nonzero().squeeze()
-                for neighbor in neighbors:
-                    if neighbor not in seen:
-                        bfs_queue.append(neighbor)
-                        node_mask[neighbor] = False
-
-            node_features[:, 0][node_mask] = NodeType.Mask.value
-            node_features[:, 1][node_mask] = self.mask_idx
-
-            augments.append(DenseGraph(node_features, graph.adjacency_matrix))
-
-        return augments
+        self.generator = generator
+
+    def forward(self, graphs: GraphBatch):
+        # Nodes are numbered in preorder, so the subtree of a root is the
+        # contiguous slice [root, root + subtree_size), and a preorder prefix
+        # of it is itself a connected subtree. The root is drawn among the
+        # nodes whose subtree holds int(num_nodes * mask_frac) nodes, and
+        # exactly that many are masked (fewer only if every tree of a forest
+        # is smaller).
+        subtree_sizes = graphs.subtree_sizes
+        if subtree_sizes is None:
+            subtree_sizes = graphs.compute_subtree_sizes()
+        largest = torch.zeros(graphs.num_graphs, dtype=torch.long)
+        largest.scatter_reduce_(0, graphs.batch, subtree_sizes, reduce='amax')
+        num_nodes_to_mask = torch.minimum(
+            (graphs.graph_sizes.double() * self.mask_frac).long(), largest)
+        roots = sample_nodes(
+            graphs,
+            (num_nodes_to_mask > 0).long(),
+            self.generator,
+            candidates=subtree_sizes >= num_nodes_to_mask[graphs.batch],
+        ).nonzero().squeeze(-1)
+
+        start = torch.zeros(graphs.num_graphs, dtype=torch.long)
+        end = torch.zeros(graphs.num_graphs, dtype=torch.long)
+        root_graphs = graphs.batch[roots]
+        start[root_graphs] = roots
+        end[root_graphs] = roots + num_nodes_to_mask[root_graphs]
+
+        nodes = torch.arange(graphs.num_nodes)
+        node_mask = (nodes >= start[graphs.batch]) & (
+            nodes < end[graphs.batch])
+        return mask_node_features(graphs, node_mask, self.mask_idx)
@@ -1,11 +1,21 @@
-from typing import List
+import copy
+from typing import List, Union
 
 import torch
-import torchmetrics
 
 from .augmenter import Augmenter
+from .distributed import all_gather
 from .encoder import Encoder
-from .. import DenseGraph
+from .loss import info_nce_loss, moco_loss
+from .. import DenseGraph, GraphBatch, SparseGraph
+from ..profiling import timer
+
+
+def backward(tensors, grad_tensors=None):
+    # Outside autocast, since the CPU sparse CSR matmul has no bfloat16
+    # kernel for the backward pass of the aggregation.
+    with torch.autocast('cpu', enabled=False):
+        torch.autograd.backward(tensors, grad_tensors)
 
 
 class ContrastiveLearner(torch.nn.Module):
@@ -16,7 +26,11 @@ class ContrastiveLearner(torch.nn.Module):
             mask_frac: float = 0.25,
             mask_idx: int = 0,
             augment_1: str = 'node_drop',
-            augment_2: str = 'node_drop'):
+            augment_2: str = 'node_drop',
+            seed: int = None,
+            temperature: float = 0.1,
+            queue_size: int = 0,
+            momentum: float = 0.999):
         super().__init__()
         self.layer_sizes = layer_sizes
         self.vocab_size = vocab_size
@@ -24,26 +38,130 @@ class ContrastiveLearner(torch.nn.Module):
         self.mask_idx = mask_idx
         self.augment_1 = augment_1
         self.augment_2 = augment_2
+        self.seed = seed
+        self.temperature = temperature
+        self.queue_size = queue_size
+        self.momentum = momentum
 
         self.augmenter = Augmenter(
             mask_frac=self.mask_frac,
             mask_idx=self.mask_idx,
             augment_1=self.augment_1,
-            augment_2=self.augment_2)
+            augment_2=self.augment_2,
+            seed=self.seed)
         self.encoder = Encoder(layer_sizes, vocab_size=vocab_size)
 
-    def forward(self, graphs: List[DenseGraph]):
-        anchor_graphs, positive_graphs = self.augmenter(graphs)
-        anchors = self.encoder(anchor_graphs)
-        positives = self.encoder(positive_graphs)
+        # With a queue, the second view is embedded by a momentum copy of the
+        # encoder and the last queue_size keys serve as negatives (MoCo).
+        # Without one, the negatives are the other views in the batch. In
+        # distributed training, the batch is the union of the batches of all
+        # ranks, and the queue receives the keys of all ranks. The key
+        # encoder takes a momentum step on every training batch unless
+        # update_key_encoder is cleared, as it should be while gradients are
+        # accumulated and the encoder does not change.
+        self.update_key_encoder = True
+        if self.queue_size > 0:
+            self.key_encoder = copy.deepcopy(self.encoder)
+            self.key_encoder.requires_grad_(False)
+            self.register_buffer('queue', torch.nn.functional.normalize(
+                torch.randn(self.queue_size, layer_sizes[-1]), dim=-1))
+            self.register_buffer(
+                'queue_ptr', torch.zeros(1, dtype=torch.long))
+
+    def forward(self, graphs: Union[GraphBatch,
+                                    List[Union[DenseGraph, SparseGraph]]]):
+        with timer('augment'):
+            anchor_graphs, positive_graphs = self.augmenter(graphs)
+        with timer('forward'):
+            anchors = self.encoder(anchor_graphs)
+            if self.queue_size == 0:
+                positives = self.encoder(positive_graphs)
+            else:
+                self._momentum_update()
+                with torch.no_grad():
+                    keys = self.key_encoder(positive_graphs)
+        with timer('loss'):
+            if self.queue_size == 0:
+                return info_nce_loss(
+                    all_gather(anchors), all_gather(positives),
+                    self.temperature)
+            # The loss keeps its own copy of the queue, which is updated
+            # below before backward runs.
+            loss = moco_loss(
+                anchors, keys, self.queue.clone(), self.temperature)
+            self._enqueue(keys)
+            return loss
+
+    def forward_backward(
+            self,
+            graphs: List[Union[DenseGraph, SparseGraph]],
+            chunk_size: int) -> torch.Tensor:
+        # Gradient caching: embeds the batch chunk by chunk without a graph,
+        # takes the loss gradient with respect to the embeddings, then
+        # re-encodes each chunk and backpropagates its slice of that
+        # gradient. Only one chunk's activations are alive at a time, so the
+        # batch size the loss sees is not bounded by memory.
+        with timer('augment'):
+            chunks = [self.augmenter(graphs[i:i + chunk_size])
+                      for i in range(0, len(graphs), chunk_size)]
+        if self.queue_size > 0:
+            self._momentum_update()
+            positive_encoder = self.key_encoder
+        else:
+            positive_encoder = self.encoder
+        with timer('forward'), torch.no_grad():
+            anchors = torch.cat([self.encoder(anchor_graphs)
+                                 for anchor_graphs, _ in chunks])
+            positives = torch.cat([positive_encoder(positive_graphs)
+                                   for _, positive_graphs in chunks])
+        with timer('loss'):
+            anchors.requires_grad_()
+            if self.queue_size > 0:
+                loss = moco_loss(
+                    anchors, positives, self.queue, self.temperature)
+            else:
+                positives.requires_grad_()
+                loss = info_nce_loss(
+                    all_gather(anchors), all_gather(positives),
+                    self.temperature)
+            backward(loss)
 
-        pos_cosine_sim = torch.nn.functional.cosine_similarity(
-            anchors, positives, dim=-1)
-        neg_cosine_sim = torchmetrics.functional.pairwise_cosine_similarity(
-            anchors)
+        # Re-encoding the chunks is part of their backward pass.
+        with timer('backward'):
+            start = 0
+            for anchor_graphs, positive_graphs in chunks:
+                end = start + anchor_graphs.num_graphs
+                if self.queue_size > 0:
+                    backward(
+                        self.encoder(anchor_graphs), anchors.grad[start:end])
+                else:
+                    backward(
+                        [self.encoder(anchor_graphs),
+                         self.encoder(positive_graphs)],
+                        [anchors.grad[start:end], positives.grad[start:end]])
+                start = end
+        if self.queue_size > 0:
+            self._enqueue(positives)
+        return loss.detach()
 
-        numerator = torch.exp(pos_cosine_sim)
-        denominator = torch.exp(neg_cosine_sim).sum(dim=-1)
-        loss = -torch.log(numerator / denominator).mean()
+    @torch.no_grad()
+    def _momentum_update(self):
+        if not self.training or not self.update_key_encoder:
+            return
+        for key_param, param in zip(self.key_encoder.parameters(),
+                                    self.encoder.parameters()):
+            key_param.mul_(self.momentum).add_(
+                param.detach(), alpha=1 - self.momentum)
 
-        return loss
+    @torch.no_grad()
+    def _enqueue(self, keys: torch.Tensor):
+        # Overwrites the oldest entries of the ring buffer. Evaluation
+        # batches leave the queue untouched.
+        if not self.training:
+            return
+        keys = torch.nn.functional.normalize(
+            all_gather(keys.detach())[-self.queue_size:], dim=-1)
+        ptr = self.queue_ptr.item()
+        index = (ptr + torch.arange(keys.shape[0])) % self.queue_size
+        self.queue[index] = keys.to(self.queue.dtype)
+        self.queue_ptr[0] = (ptr + keys.shape[0]) % self.queue_size
@@ -0,0 +1,55 @@
+import torch
+import torch.distributed as dist
+
+
+def is_distributed() -> bool:
+    return dist.is_available() and dist.is_initialized() and \
+        dist.get_world_size() > 1
+
+
+class _AllGather(torch.autograd.Function):
+    # Concatenates the rows of x from all ranks, in rank order. Ranks may
+    # hold different numbers of rows. The backward pass sums the gradient
+    # of the concatenation over ranks and returns each rank its own rows,
+    # so that averaging the parameter gradients over ranks (as
+    # DistributedDataParallel does) yields the gradient of the mean loss.
+    @staticmethod
+    def forward(ctx, x: torch.Tensor) -> torch.Tensor:
+        world_size = dist.get_world_size()
+        size = torch.tensor([x.shape[0]])
+        sizes = [torch.zeros_like(size) for _ in range(world_size)]
+        dist.all_gather(sizes, size)
+        sizes = [size.item() for size in sizes]
+
+        # all_gather needs equally shaped tensors, so pad to the largest.
+        padded = x.new_zeros((max(sizes),) + x.shape[1:])
+        padded[:x.shape[0]] = x
+        gathered = [torch.zeros_like(padded) for _ in range(world_size)]
+        dist.all_gather(gathered, padded.contiguous())
+
+        rank = dist.get_rank()
+        ctx.start = sum(sizes[:rank])
+        ctx.end = ctx.start + sizes[rank]
+        return torch.cat([
+            tensor[:size] for tensor, size in zip(gathered, sizes)])
+
+    @staticmethod
+    def backward(ctx, grad: torch.Tensor) -> torch.Tensor:
+        grad = grad.contiguous()
+        dist.all_reduce(grad)
+        return grad[ctx.start:ctx.end]
+
+
+def all_gather(x: torch.Tensor) -> torch.Tensor:
+    if not is_distributed():
+        return x
+    return _AllGather.apply(x)
+
+
+def average_gradients(module: torch.nn.Module) -> None:
+    # For the steps that bypass DistributedDataParallel's own reduction.
+    world_size = dist.get_world_size()
+    for parameter in module.parameters():
+        if parameter.grad is not None:
+            dist.all_reduce(parameter.grad)
+            parameter.grad.div_(world_size)
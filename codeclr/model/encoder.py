@@ -1,22 +1,112 @@
-from typing import List
+from typing import List, Union
 
 import torch
 from torch_geometric.nn.dense import DenseGCNConv
 
-from .. import DenseGraph
+from .. import DenseGraph, SparseGraph
+from ..graph_batch import GraphBatch
 from ..cass.cass import NodeType
 
 
+def gcn_norm_adjacency(
+        edge_index: torch.Tensor,
+        num_nodes: int,
+        dtype: torch.dtype = torch.float,
+        degree: torch.Tensor = None) -> torch.Tensor:
+    # D^-1/2 A D^-1/2 as a sparse matrix, with degrees clamped to 1 like
+    # DenseGCNConv(add_loop=False).
+    row, col = edge_index
+    if degree is None:
+        deg = torch.bincount(row, minlength=num_nodes)
+    else:
+        deg = degree
+    deg_inv_sqrt = deg.clamp(min=1).to(dtype).pow(-0.5)
+    edge_weight = deg_inv_sqrt[row] * deg_inv_sqrt[col]
+
+    # Degrees stored with the graphs are the row lengths of the adjacency
+    # matrix, so for row-sorted edges (as preprocessing writes them) they
+    # give the CSR row pointers directly, with no sort or coalesce.
+    if degree is not None and bool((row[1:] >= row[:-1]).all()):
+        crow = torch.zeros(num_nodes + 1, dtype=torch.long,
+                           device=degree.device)
+        torch.cumsum(degree, dim=0, out=crow[1:])
+        return torch.sparse_csr_tensor(
+            crow, col, edge_weight, (num_nodes, num_nodes))
+    return torch.sparse_coo_tensor(
+        edge_index, edge_weight, (num_nodes, num_nodes)).coalesce()
+
+
+def eager(fn):
+    # Keeps fn out of torch.compile graphs (when compile is available). Used
+    # for the edge-shaped work, so that compiled graphs only see tensors
+    # shaped by the (bucketed) node and graph counts.
+    compiler = getattr(torch, 'compiler', None)
+    if compiler is None or not hasattr(compiler, 'disable'):
+        return fn
+    return compiler.disable(fn)
+
+
+@eager
+def propagate(adjacency: torch.Tensor, x: torch.Tensor) -> torch.Tensor:
+    # Under bfloat16 autocast x arrives in bfloat16; the aggregation runs
+    # outside autocast in the adjacency's dtype, which CPU sparse kernels
+    # support.
+    with torch.autocast(x.device.type, enabled=False):
+        return torch.sparse.mm(adjacency, x.to(adjacency.dtype))
+
+
+def sparse_gcn_conv(
+        layer: DenseGCNConv,
+        x: torch.Tensor,
+        adjacency: torch.Tensor) -> torch.Tensor:
+    out = propagate(adjacency, layer.lin(x))
+    if layer.bias is not None:
+        out = out + layer.bias
+    return out
+
+
+def bucket_size(n: int, steps: int = 4) -> int:
+    # Rounds n up to one of steps sizes per power of two (steps a power of
+    # two), so padding to it wastes less than 1 / steps.
+    shift = max((n - 1).bit_length() - steps.bit_length(), 0)
+    return -(-n >> shift) << shift
+
+
+def global_mean_pool(
+        x: torch.Tensor,
+        batch: torch.Tensor,
+        num_graphs: int) -> torch.Tensor:
+    out = x.new_zeros(num_graphs, x.shape[-1]).index_add_(0, batch, x)
+    count = torch.bincount(batch, minlength=num_graphs).clamp(min=1)
+    return out / count.unsqueeze(-1).to(x.dtype)
+
+
+def global_max_pool(
+        x: torch.Tensor,
+        batch: torch.Tensor,
+        num_graphs: int) -> torch.Tensor:
+    out = x.new_full((num_graphs, x.shape[-1]), float('-inf'))
+    out = out.scatter_reduce(
+        0, batch.unsqueeze(-1).expand_as(x), x, reduce='amax')
+    # Graphs without nodes (bucket padding) pool to 0 rather than -inf.
+    empty = torch.bincount(batch, minlength=num_graphs) == 0
+    return out.masked_fill(empty.unsqueeze(-1), 0)
+
+
 class Encoder(torch.nn.Module):
     def __init__(
             self,
             layer_sizes: List[int],
             vocab_size: int = 1000,
-            activation=torch.relu):
+            activation=torch.relu,
+            pad_to_buckets: bool = False):
         super().__init__()
         self.layer_sizes = layer_sizes
         self.vocab_size = vocab_size
         self.activation = activation
+        # Pads every batch to bucketed node and graph counts, which bounds
+        # the number of shapes (and torch.compile recompiles) it sees.
+        self.pad_to_buckets = pad_to_buckets
 
         self.embedding_dim = int(layer_sizes[0] / 2)
 
@@ -33,18 +123,43 @@ class Encoder(torch.nn.Module):
         self.readout = torch.nn.Linear(
             2 * self.layer_sizes[-1], self.layer_sizes[-1])
 
-    def forward(self, graphs: List[DenseGraph]):
-        graph_embeddings = []
-        for graph in graphs:
-            x, adj = graph.node_features, graph.adjacency_matrix
-            x = x.int()
-            x = torch.cat([self.node_type_embedding(x[:, 0]),
-                           self.node_label_embedding(x[:, 1])], dim=-1)
-            for layer in self.layers:
-                x = layer(x, adj, add_loop=False)
-                x = self.activation(x)
-            x = x.squeeze(0)
-            pooled = torch.cat([x.mean(dim=0), x.max(dim=0)[0]], dim=-1)
-            graph_embedding = self.readout(pooled)
-            graph_embeddings.append(graph_embedding)
-        return torch.stack(graph_embeddings)
+    def forward(self, graphs: Union[GraphBatch,
+                                    List[Union[DenseGraph, SparseGraph]]]):
+        node_features, batch, num_graphs, adjacency = prepare_batch(
+            graphs, self.pad_to_buckets, self.node_type_embedding.weight.dtype)
+        x = node_features.int()
+        x = torch.cat([self.node_type_embedding(x[:, 0]),
+                       self.node_label_embedding(x[:, 1])], dim=-1)
+        for layer in self.layers:
+            x = sparse_gcn_conv(layer, x, adjacency)
+            x = self.activation(x)
+        num_padded_graphs = num_graphs[1]
+        pooled = torch.cat([
+            global_mean_pool(x, batch, num_padded_graphs),
+            global_max_pool(x, batch, num_padded_graphs)], dim=-1)
+        return self.readout(pooled)[:num_graphs[0]]
+
+
+@eager
+def prepare_batch(
+        graphs: Union[GraphBatch, List[Union[DenseGraph, SparseGraph]]],
+        pad_to_buckets: bool,
+        dtype: torch.dtype):
+    # Collates, pads and normalizes a batch. This runs outside of compiled
+    # graphs, which then only see node-shaped tensors. Returns the node
+    # features, the batch vector, the (real, padded) graph counts and the
+    # normalized adjacency.
+    if not isinstance(graphs, GraphBatch):
+        graphs = GraphBatch.from_graphs(graphs)
+    num_graphs = graphs.num_graphs
+    if pad_to_buckets:
+        graphs = graphs.pad(
+            bucket_size(graphs.num_nodes),
+            bucket_size(num_graphs + 1))
+    adjacency = gcn_norm_adjacency(
+        graphs.edge_index,
+        graphs.num_nodes,
+        dtype=dtype,
+        degree=graphs.degree)
+    return (graphs.node_features, graphs.batch,
+            (num_graphs, graphs.num_graphs), adjacency)
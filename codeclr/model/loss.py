@@ -0,0 +1,38 @@
+import torch
+
+
+def info_nce_loss(
+        anchors: torch.Tensor,
+        positives: torch.Tensor,
+        temperature: float = 0.1) -> torch.Tensor:
+    # NT-Xent: each of the 2B embeddings is scored against the other 2B - 1
+    # in one normalized matmul, and cross_entropy takes the log-softmax with
+    # logsumexp. The positive of anchor i is positive i and vice versa. The
+    # loss is computed in float32 even under autocast.
+    batch_size = anchors.shape[0]
+    with torch.autocast(anchors.device.type, enabled=False):
+        z = torch.nn.functional.normalize(
+            torch.cat([anchors, positives]).float(), dim=-1)
+        logits = z @ z.t() / temperature
+        logits = logits.fill_diagonal_(float('-inf'))
+        targets = torch.arange(2 * batch_size, device=anchors.device)
+        targets = (targets + batch_size) % (2 * batch_size)
+        return torch.nn.functional.cross_entropy(logits, targets)
+
+
+def moco_loss(
+        queries: torch.Tensor,
+        keys: torch.Tensor,
+        queue: torch.Tensor,
+        temperature: float = 0.1) -> torch.Tensor:
+    # InfoNCE against a queue of past keys: each query's positive is its own
+    # key and its negatives are the (already normalized) queue entries.
+    with torch.autocast(queries.device.type, enabled=False):
+        queries = torch.nn.functional.normalize(queries.float(), dim=-1)
+        keys = torch.nn.functional.normalize(keys.float(), dim=-1)
+        logits = torch.cat([
+            (queries * keys).sum(dim=-1, keepdim=True),
+            queries @ queue.t()], dim=-1) / temperature
+        targets = torch.zeros(
+            queries.shape[0], dtype=torch.long, device=queries.device)
+        return torch.nn.functional.cross_entropy(logits, targets)
@@ -0,0 +1,113 @@
+import collections
+import json
+import time
+
+import torch
+
+
+class _Timer:
+    __slots__ = ('instrumentation', 'name', 'start', 'record_function')
+
+    def __init__(self, instrumentation: 'Instrumentation', name: str):
+        self.instrumentation = instrumentation
+        self.name = name
+
+    def __enter__(self):
+        # Also marks the phase in torch.profiler traces.
+        self.record_function = torch.profiler.record_function(self.name)
+        self.record_function.__enter__()
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        self.instrumentation.times[self.name] += \
+            time.perf_counter() - self.start
+        self.record_function.__exit__(*exc_info)
+        return False
+
+
+class _NullTimer:
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Instrumentation:
+    # Opt-in wall-clock timers and counters for the phases of training.
+    # While disabled, timer() returns a shared no-op context manager and
+    # record() and count() return at once, so instrumented code pays only a
+    # call and a branch.
+    def __init__(self):
+        self.enabled = False
+        self.reset()
+
+    def reset(self):
+        self.times = collections.defaultdict(float)
+        self.counts = collections.defaultdict(int)
+        self.start = time.perf_counter()
+
+    def timer(self, name: str):
+        if not self.enabled:
+            return _NULL_TIMER
+        return _Timer(self, name)
+
+    def record(self, name: str, seconds: float):
+        if self.enabled:
+            self.times[name] += seconds
+
+    def count(self, name: str, value: int = 1):
+        if self.enabled:
+            self.counts[name] += value
+
+    def summary(self) -> dict:
+        # The totals since the last reset: seconds per phase, the counters,
+        # and the counters per second of wall-clock time.
+        seconds = time.perf_counter() - self.start
+        summary = {'seconds': seconds}
+        summary.update({f'{name}_seconds': value
+                        for name, value in self.times.items()})
+        summary.update(self.counts)
+        summary.update({f'{name}_per_sec': value / seconds
+                        for name, value in self.counts.items()})
+        return summary
+
+    def flush(self, step: int, writer=None, jsonl_file=None) -> dict:
+        # Writes the summary to TensorBoard (under profile/) and as one
+        # JSON line, then starts a new interval.
+        summary = self.summary()
+        if writer is not None:
+            for name, value in summary.items():
+                writer.add_scalar(f'profile/{name}', value, step)
+        if jsonl_file is not None:
+            jsonl_file.write(json.dumps({'step': step, **summary}) + '\n')
+            jsonl_file.flush()
+        self.reset()
+        return summary
+
+
+# Shared by the whole process. Timings taken in DataLoader worker processes
+# stay in those processes; the main process sees them as data wait time.
+INSTRUMENTATION = Instrumentation()
+
+
+def enable(enabled: bool = True):
+    INSTRUMENTATION.enabled = enabled
+    INSTRUMENTATION.reset()
+
+
+def timer(name: str):
+    return INSTRUMENTATION.timer(name)
+
+
+def record(name: str, seconds: float):
+    INSTRUMENTATION.record(name, seconds)
+
+
+def count(name: str, value: int = 1):
+    INSTRUMENTATION.count(name, value)
@@ -0,0 +1,3 @@
+from .exact import ExactIndex
+from .ivf import IVFIndex
+from .evaluate import evaluate_index, evaluate_retrieval, map_at_r, recall_at_k
@@ -0,0 +1,100 @@
+import time
+from typing import List
+
+import torch
+
+from ..data.util import problem_labels
+from ..inference import embed_batches
+from .exact import BLOCK_SIZE, ExactIndex, normalize, top_k
+
+
+def recall_at_k(indices: torch.Tensor, exact_indices: torch.Tensor) -> float:
+    # The mean fraction of the exact k nearest neighbours of a query that
+    # the approximate search also returns.
+    if exact_indices.numel() == 0:
+        return 1.0
+    hits = (indices.unsqueeze(2) == exact_indices.unsqueeze(1)).any(dim=1)
+    return hits.float().mean().item()
+
+
+def evaluate_index(
+        index,
+        exact_index: ExactIndex,
+        queries,
+        k: int = 10) -> dict:
+    # Recall@k of index against exact search over the same embeddings, and
+    # the queries/sec of both.
+    start = time.perf_counter()
+    _, indices = index.search(queries, k)
+    elapsed = time.perf_counter() - start
+    start = time.perf_counter()
+    _, exact_indices = exact_index.search(queries, k)
+    exact_elapsed = time.perf_counter() - start
+    return {
+        f'recall@{k}': recall_at_k(indices[:, :exact_indices.shape[1]],
+                                   exact_indices),
+        'queries_per_sec': len(queries) / elapsed,
+        'exact_queries_per_sec': len(queries) / exact_elapsed,
+    }
+
+
+def map_at_r(
+        embeddings,
+        labels: torch.Tensor,
+        block_size: int = BLOCK_SIZE) -> dict:
+    # MAP@R and precision@1 of cosine retrieval: every embedding queries all
+    # others, and its R relevant results are the other embeddings with its
+    # label. Queries are processed in blocks, each retrieving only its top
+    # (max R + 1) through the blocked top_k, so no N x N matrix is ever
+    # built. Queries without another embedding of their label are skipped.
+    embeddings = normalize(embeddings)
+    num_relevant = torch.bincount(labels)[labels] - 1
+    average_precisions = []
+    hits_at_1 = []
+    for start in range(0, embeddings.shape[0], block_size):
+        rows = torch.arange(start, min(start + block_size,
+                                       embeddings.shape[0]))
+        rows = rows[num_relevant[rows] > 0]
+        if rows.shape[0] == 0:
+            continue
+        r = num_relevant[rows]
+        max_r = r.max().item()
+        _, indices = top_k(embeddings[rows], embeddings, max_r + 1,
+                           block_size)
+        # Drops the query itself, wherever ties put it.
+        is_self = indices == rows.unsqueeze(1)
+        order = torch.argsort(is_self.int(), dim=1, stable=True)
+        indices = indices.gather(1, order)[:, :max_r]
+
+        positions = torch.arange(1, max_r + 1)
+        relevant = (labels[indices] == labels[rows].unsqueeze(1)) & (
+            positions <= r.unsqueeze(1))
+        precisions = relevant.cumsum(dim=1) / positions
+        average_precisions.append((precisions * relevant).sum(dim=1) / r)
+        hits_at_1.append(relevant[:, 0].float())
+
+    if not average_precisions:
+        return {'map@r': 0.0, 'precision@1': 0.0}
+    return {
+        'map@r': torch.cat(average_precisions).mean().item(),
+        'precision@1': torch.cat(hits_at_1).mean().item(),
+    }
+
+
+def evaluate_retrieval(
+        encoder: torch.nn.Module,
+        dataset: torch.utils.data.Dataset,
+        indices: List[int],
+        batch_size: int = 256,
+        num_workers: int = 0) -> dict:
+    # Embeds the graphs of dataset at indices and computes map_at_r with
+    # their CodeNet problems as labels.
+    training = encoder.training
+    encoder.eval()
+    embeddings = torch.cat([torch.zeros(0, encoder.layer_sizes[-1])] + [
+        batch.float() for batch in embed_batches(
+            encoder, torch.utils.data.Subset(dataset, indices),
+            batch_size, num_workers)])
+    encoder.train(training)
+    labels = problem_labels([dataset.file_names[i] for i in indices])
+    return map_at_r(embeddings, labels)
@@ -0,0 +1,98 @@
+from typing import List, Tuple
+
+import numpy as np
+import torch
+
+
+BLOCK_SIZE = 4096
+
+
+def normalize(embeddings) -> torch.Tensor:
+    # float32 rows of unit length, so that dot products are cosines. Arrays
+    # are copied, since a read-only memmap cannot back a tensor.
+    if isinstance(embeddings, torch.Tensor):
+        embeddings = embeddings.float()
+    else:
+        embeddings = torch.from_numpy(np.array(embeddings, dtype=np.float32))
+    return torch.nn.functional.normalize(embeddings, dim=-1)
+
+
+def merge_top_k(
+        scores: torch.Tensor,
+        indices: torch.Tensor,
+        new_scores: torch.Tensor,
+        new_indices: torch.Tensor,
+        k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+    # The k best of two sets of candidates per row.
+    scores = torch.cat([scores, new_scores], dim=1)
+    indices = torch.cat([indices, new_indices], dim=1)
+    scores, order = scores.topk(k, dim=1)
+    return scores, indices.gather(1, order)
+
+
+def top_k(
+        queries: torch.Tensor,
+        keys: torch.Tensor,
+        k: int,
+        block_size: int = BLOCK_SIZE) -> Tuple[torch.Tensor, torch.Tensor]:
+    # The k largest dot products of every query with the keys, and their key
+    # indices, best first. The keys are scanned in blocks of block_size
+    # rows, so memory stays at O(num_queries * (k + block_size)).
+    k = min(k, keys.shape[0])
+    scores = queries.new_full((queries.shape[0], k), -float('inf'))
+    indices = torch.full((queries.shape[0], k), -1, dtype=torch.long)
+    for start in range(0, keys.shape[0], block_size):
+        block = keys[start:start + block_size]
+        scores, indices = merge_top_k(
+            scores,
+            indices,
+            queries @ block.T,
+            torch.arange(start, start + block.shape[0]).expand(
+                queries.shape[0], -1),
+            k)
+    return scores, indices
+
+
+class ExactIndex:
+    # Brute-force cosine search over all embeddings.
+    def __init__(self, dim: int, block_size: int = BLOCK_SIZE):
+        self.dim = dim
+        self.block_size = block_size
+        self.ids = []
+        self._chunks = []
+        self._embeddings = torch.zeros(0, dim)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def embeddings(self) -> torch.Tensor:
+        # Added chunks are concatenated once, on the first search after them.
+        if self._chunks:
+            self._embeddings = torch.cat([self._embeddings] + self._chunks)
+            self._chunks = []
+        return self._embeddings
+
+    def add(self, embeddings, ids: List = None) -> None:
+        embeddings = normalize(embeddings)
+        assert embeddings.shape[1] == self.dim
+        if ids is None:
+            ids = range(len(self), len(self) + embeddings.shape[0])
+        assert len(ids) == embeddings.shape[0]
+        self.ids.extend(ids)
+        self._chunks.append(embeddings)
+
+    def search(self, queries, k: int) -> Tuple[torch.Tensor, torch.Tensor]:
+        # The cosine similarities and row indices (into ids) of the k
+        # nearest embeddings of every query, best first. Query rows are
+        # searched in blocks as well.
+        queries = normalize(queries)
+        embeddings = self.embeddings
+        results = [top_k(queries[start:start + self.block_size],
+                         embeddings, k, self.block_size)
+                   for start in range(0, queries.shape[0], self.block_size)]
+        k = min(k, len(self))
+        if not results:
+            return torch.zeros(0, k), torch.zeros(0, k, dtype=torch.long)
+        return (torch.cat([scores for scores, _ in results]),
+                torch.cat([indices for _, indices in results]))
@@ -0,0 +1,130 @@
+from typing import List, Tuple
+
+import torch
+
+from .exact import BLOCK_SIZE, merge_top_k, normalize, top_k
+
+
+def spherical_kmeans(
+        embeddings: torch.Tensor,
+        num_clusters: int,
+        num_iterations: int = 10,
+        generator: torch.Generator = None) -> torch.Tensor:
+    # Unit-length centroids that maximize the cosine similarity of the
+    # (unit-length) embeddings to their nearest centroid. A cluster that
+    # loses all its members keeps its previous centroid.
+    order = torch.randperm(embeddings.shape[0], generator=generator)
+    centroids = embeddings[order[:num_clusters]]
+    for _ in range(num_iterations):
+        assignment = top_k(embeddings, centroids, 1)[1][:, 0]
+        sums = torch.zeros_like(centroids).index_add_(
+            0, assignment, embeddings)
+        counts = torch.bincount(assignment, minlength=num_clusters)
+        centroids = torch.where(
+            (counts > 0).unsqueeze(-1),
+            torch.nn.functional.normalize(sums, dim=-1),
+            centroids)
+    return centroids
+
+
+class IVFIndex:
+    # Approximate cosine search with an inverted file: the embeddings are
+    # split into num_lists lists by their nearest k-means centroid, and a
+    # query only scans the lists of its num_probes nearest centroids. Recall
+    # grows with num_probes at a proportional cost in speed.
+    def __init__(
+            self,
+            dim: int,
+            num_lists: int = 256,
+            num_probes: int = 8,
+            num_iterations: int = 10,
+            max_train_size: int = 256 * 256,
+            seed: int = 0):
+        self.dim = dim
+        self.num_lists = num_lists
+        self.num_probes = num_probes
+        self.num_iterations = num_iterations
+        self.max_train_size = max_train_size
+        self.generator = torch.Generator()
+        self.generator.manual_seed(seed)
+        self.ids = []
+        self.centroids = None
+        self.list_rows = []
+        self.list_embeddings = []
+
+    def __len__(self):
+        return len(self.ids)
+
+    @property
+    def is_trained(self) -> bool:
+        return self.centroids is not None
+
+    def train(self, embeddings) -> None:
+        # Fits the centroids to (a sample of at most max_train_size of) the
+        # embeddings. Embeddings added later are assigned to these
+        # centroids, so they should come from the same distribution.
+        embeddings = normalize(embeddings)
+        if embeddings.shape[0] > self.max_train_size:
+            order = torch.randperm(
+                embeddings.shape[0], generator=self.generator)
+            embeddings = embeddings[order[:self.max_train_size]]
+        num_lists = min(self.num_lists, embeddings.shape[0])
+        self.centroids = spherical_kmeans(
+            embeddings, num_lists, self.num_iterations, self.generator)
+        self.list_rows = [torch.zeros(0, dtype=torch.long)
+                          for _ in range(num_lists)]
+        self.list_embeddings = [torch.zeros(0, self.dim)
+                                for _ in range(num_lists)]
+
+    def add(self, embeddings, ids: List = None) -> None:
+        # Trains the index on the first embeddings added, unless it has
+        # been trained already.
+        embeddings = normalize(embeddings)
+        assert embeddings.shape[1] == self.dim
+        if ids is None:
+            ids = range(len(self), len(self) + embeddings.shape[0])
+        assert len(ids) == embeddings.shape[0]
+        if not self.is_trained:
+            self.train(embeddings)
+
+        rows = torch.arange(len(self), len(self) + embeddings.shape[0])
+        self.ids.extend(ids)
+        assignment = top_k(embeddings, self.centroids, 1)[1][:, 0]
+        for i in assignment.unique().tolist():
+            members = assignment == i
+            self.list_rows[i] = torch.cat([self.list_rows[i], rows[members]])
+            self.list_embeddings[i] = torch.cat(
+                [self.list_embeddings[i], embeddings[members]])
+
+    def search(
+            self,
+            queries,
+            k: int,
+            num_probes: int = None) -> Tuple[torch.Tensor, torch.Tensor]:
+        # Like ExactIndex.search. When the probed lists hold fewer than k
+        # embeddings, the missing results have index -1 and score -inf.
+        if num_probes is None:
+            num_probes = self.num_probes
+        queries = normalize(queries)
+        scores = queries.new_full((queries.shape[0], k), -float('inf'))
+        indices = torch.full((queries.shape[0], k), -1, dtype=torch.long)
+        if not self.is_trained:
+            return scores, indices
+
+        # Every list is scanned once, by all of the queries that probe it.
+        probes = top_k(queries, self.centroids, num_probes)[1]
+        for i in probes.unique().tolist():
+            rows = self.list_rows[i]
+            if rows.shape[0] == 0:
+                continue
+            members = (probes == i).any(dim=1).nonzero().squeeze(-1)
+            for start in range(0, rows.shape[0], BLOCK_SIZE):
+                block = self.list_embeddings[i][start:start + BLOCK_SIZE]
+                scores[members], indices[members] = merge_top_k(
+                    scores[members],
+                    indices[members],
+                    queries[members] @ block.T,
+                    rows[start:start + BLOCK_SIZE].expand(
+                        members.shape[0], -1),
+                    k)
+        return scores, indices
@@ -0,0 +1,118 @@
+from typing import List
+
+import torch
+
+from .dense_graph import DenseGraph
+
+
+def compute_subtree_sizes(
+        num_nodes: int,
+        parents: List[int],
+        children: List[int]) -> torch.Tensor:
+    # Nodes are numbered in preorder, so the subtree of node i is the slice
+    # [i, i + subtree_sizes[i]) and children always come after their parent.
+    parent_of = [-1] * num_nodes
+    for parent, child in zip(parents, children):
+        parent_of[child] = parent
+    subtree_sizes = [1] * num_nodes
+    for i in range(num_nodes - 1, -1, -1):
+        if parent_of[i] >= 0:
+            subtree_sizes[parent_of[i]] += subtree_sizes[i]
+    return torch.tensor(subtree_sizes, dtype=torch.long)
+
+
+def drop_edges_degree(
+        degree: torch.Tensor,
+        edge_index: torch.Tensor,
+        edge_mask: torch.Tensor) -> torch.Tensor:
+    # Degrees after removing the edges not in edge_mask, updated from the
+    # removed edges only.
+    if degree is None:
+        return None
+    removed = edge_index[0][~edge_mask]
+    return degree - torch.bincount(removed, minlength=degree.shape[0])
+
+
+class SparseGraph:
+    def __init__(self, node_features: torch.Tensor,
+                 edge_index: torch.Tensor,
+                 subtree_sizes: torch.Tensor = None,
+                 degree: torch.Tensor = None) -> None:
+        # degree counts the entries of each row of the adjacency matrix
+        # (self-loops included), which is all the GCN normalization needs.
+        self.node_features = node_features
+        self.edge_index = edge_index
+        self.subtree_sizes = subtree_sizes
+        self.degree = degree
+
+    @property
+    def num_nodes(self) -> int:
+        return self.node_features.shape[0]
+
+    @property
+    def num_edges(self) -> int:
+        return self.edge_index.shape[1] / 2
+
+    def neighbors(self, node: int) -> torch.Tensor:
+        return self.edge_index[1][self.edge_index[0] == node]
+
+    def with_node_features(self, node_features: torch.Tensor) -> 'SparseGraph':
+        return SparseGraph(
+            node_features,
+            self.edge_index,
+            self.subtree_sizes,
+            self.degree)
+
+    def drop_nodes(self, node_mask: torch.Tensor) -> 'SparseGraph':
+        row, col = self.edge_index
+        edge_mask = node_mask[row] & node_mask[col]
+        return SparseGraph(
+            self.node_features * node_mask.unsqueeze(-1),
+            self.edge_index[:, edge_mask],
+            self.subtree_sizes,
+            drop_edges_degree(self.degree, self.edge_index, edge_mask))
+
+    def to_dense(self) -> DenseGraph:
+        adjacency_matrix = torch.zeros(self.num_nodes, self.num_nodes)
+        adjacency_matrix[self.edge_index[0], self.edge_index[1]] = 1
+        return DenseGraph(
+            node_features=self.node_features,
+            adjacency_matrix=adjacency_matrix)
+
+    @staticmethod
+    def from_dense(graph: DenseGraph) -> 'SparseGraph':
+        edge_index = graph.adjacency_matrix.nonzero().t().contiguous()
+        return SparseGraph(
+            node_features=graph.node_features,
+            edge_index=edge_index)
+
+    def save(self, path: str) -> None:
+        data = {'node_features': self.node_features,
+                'edge_index': self.edge_index}
+        if self.subtree_sizes is not None:
+            data['subtree_sizes'] = self.subtree_sizes
+        if self.degree is not None:
+            data['degree'] = self.degree
+        torch.save(data, path)
+
+    @staticmethod
+    def load(path: str) -> 'SparseGraph':
+        data = torch.load(path)
+        return SparseGraph(
+            node_features=data['node_features'],
+            edge_index=data['edge_index'],
+            subtree_sizes=data.get('subtree_sizes'),
+            degree=data.get('degree'))
+
+
+def load_graph(path: str):
+    data = torch.load(path)
+    if 'edge_index' in data:
+        return SparseGraph(
+            node_features=data['node_features'],
+            edge_index=data['edge_index'],
+            subtree_sizes=data.get('subtree_sizes'),
+            degree=data.get('degree'))
+    return DenseGraph(
+        node_features=data['node_features'],
+        adjacency_matrix=data['adjacency_matrix'])
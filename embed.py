@@ -0,0 +1,122 @@
+import argparse
+import logging
+import time
+
+import torch
+
+from codeclr.cass import CassConfig
+from codeclr.data.util import load_dataset
+from codeclr.inference import CassFileDataset, load_encoder, write_embeddings
+
+logging.basicConfig(
+    format='[%(asctime)s] %(pathname)s:%(lineno)d %(levelname)s - %(message)s',
+    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--checkpoint', type=str, required=True,
+                    help='The pretrain.py checkpoint whose encoder to use.')
+parser.add_argument(
+    '--cas_dir',
+    type=str,
+    default=None,
+    help='A directory of .cas files to embed (searched recursively). Requires --vocab_file.')
+parser.add_argument(
+    '--data_dir',
+    type=str,
+    default=None,
+    help='A directory of graphs preprocessed by preprocess.py (files or shards) to embed.')
+parser.add_argument('--vocab_file', type=str, default=None,
+                    help='The vocab.pt that preprocess.py built for training.')
+parser.add_argument(
+    '--output_dir',
+    type=str,
+    default='embeddings',
+    help='The directory in which to store embeddings.npy and ids.json.')
+parser.add_argument('--batch_size', type=int, default=256,
+                    help='The number of graphs to encode at once.')
+parser.add_argument(
+    '--num_workers',
+    type=int,
+    default=0,
+    help='The number of worker processes that build graphs while the encoder runs.')
+parser.add_argument('--dtype', type=str, default='float32',
+                    choices=['float16', 'float32'],
+                    help='The dtype of the stored embeddings.')
+parser.add_argument(
+    '--num_threads',
+    type=int,
+    default=None,
+    help='The number of intra-op threads (torch.set_num_threads).')
+# CASS configuration
+parser.add_argument(
+    '--annot_mode',
+    type=int,
+    default=2,
+    choices=[0, 1, 2],
+    help='CASS configuration: node prefix label. 0: No change. 1: Add a prefix to each internal nodel label. 2: Add a prefix to parenthesis node label.')
+parser.add_argument(
+    '--compound_mode',
+    type=int,
+    default=1,
+    choices=[0, 1, 2],
+    help='CASS configuration: compound statements. 0: No change. 1: Drop all features relevant to compound statements. 2: Replace with "{#}".')
+parser.add_argument(
+    '--gfun_mode',
+    type=int,
+    default=1,
+    choices=[0, 1, 2],
+    help='CASS configuration: global functions. 0: No change. 1: Drop all features relevant to global functions. 2: Drop function identifier and replace with "#EXFUNC".')
+parser.add_argument(
+    '--gvar_mode',
+    type=int,
+    default=3,
+    choices=[0, 1, 2, 3],
+    help='CASS configuration: global variables. 0: No change. 1: Drop all features relevant to global variables. 2: Replace with "$GVAR". 3: Replace with "$VAR".')
+parser.add_argument(
+    '--fsig_mode',
+    type=int,
+    default=1,
+    choices=[0, 1],
+    help='CASS configuration: function I/O cardinality. 0: No change. 1: Include the input and output cardinality per function in GAT.')
+
+
+def main(args):
+    if (args.cas_dir is None) == (args.data_dir is None):
+        logger.error('Pass exactly one of --cas_dir and --data_dir.')
+        exit(1)
+    if args.num_threads is not None:
+        torch.set_num_threads(args.num_threads)
+
+    if args.cas_dir is not None:
+        if args.vocab_file is None:
+            logger.error('--cas_dir requires --vocab_file.')
+            exit(1)
+        config = CassConfig(
+            annot_mode=args.annot_mode,
+            compound_mode=args.compound_mode,
+            gfun_mode=args.gfun_mode,
+            gvar_mode=args.gvar_mode,
+            fsig_mode=args.fsig_mode)
+        dataset = CassFileDataset(
+            args.cas_dir, torch.load(args.vocab_file), config)
+    else:
+        dataset = load_dataset(args.data_dir)
+
+    encoder = load_encoder(args.checkpoint)
+    logger.info(f'Embedding {len(dataset)} graphs...')
+    start = time.perf_counter()
+    write_embeddings(
+        args.output_dir,
+        encoder,
+        dataset,
+        batch_size=args.batch_size,
+        num_workers=args.num_workers,
+        dtype=args.dtype)
+    graphs_per_sec = len(dataset) / (time.perf_counter() - start)
+    logger.info(
+        f'Wrote {len(dataset)} embeddings to {args.output_dir} ({graphs_per_sec:.1f} graphs/sec)')
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -1,12 +1,19 @@
 import argparse
+import collections
+import functools
+import json
 import logging
+import multiprocessing
 import os
 
 import torch
 from torchtext.vocab import build_vocab_from_iterator
 import tqdm
 
-from codeclr.cass import CassConfig, cass_tree_to_graph, load_file
+from codeclr import DenseGraph, SparseGraph
+from codeclr.cass import CassConfig, build_graph, cass_tree_to_graph, collect_graph_arrays, iter_file
+from codeclr.data.graph_dataset import NODE_COUNTS_FILE
+from codeclr.data.graph_shards import write_index, write_shard
 
 logging.basicConfig(
     format='[%(asctime)s] %(pathname)s:%(lineno)d %(levelname)s - %(message)s',
@@ -33,6 +40,27 @@ parser.add_argument(
     type=str,
     default='data/preprocessed',
     help='The name of the directory in which to store the preprocessed data.')
+parser.add_argument(
+    '--graph_format',
+    type=str,
+    default='sparse',
+    choices=['dense', 'sparse'],
+    help='The graph representation to store. dense: N x N adjacency matrix. sparse: 2 x E edge index.')
+parser.add_argument(
+    '--output_format',
+    type=str,
+    default='files',
+    choices=['files', 'shards'],
+    help='How to store the graphs. files: one file per program under all/ and per problem. shards: one packed, memory-mappable shard per problem under shards/.')
+parser.add_argument(
+    '--workers',
+    type=int,
+    default=1,
+    help='The number of worker processes across which to shard the problem directories.')
+parser.add_argument(
+    '--single_pass',
+    action='store_true',
+    help='Parse each CASS file once, caching the graph structure between the vocabulary and graph phases.')
 # CASS configuration
 parser.add_argument(
     '--annot_mode',
@@ -64,77 +92,262 @@ parser.add_argument(
     default=1,
     choices=[0, 1],
     help='CASS configuration: function I/O cardinality. 0: No change. 1: Include the input and output cardinality per function in GAT.')
-args = parser.parse_args()
-
-if not os.path.exists(args.data_dir):
-    logger.error(f'Data directory {args.data_dir} does not exist.')
-    exit(1)
-
-
-def yield_tokens(file_path: str, config: CassConfig = None):
-    for directory in tqdm.tqdm(os.listdir(file_path), leave=False):
-        if os.path.isdir(os.path.join(file_path, directory)):
-            for file in os.listdir(os.path.join(file_path, directory)):
-                cass_trees = load_file(
-                    os.path.join(file_path, directory, file), config=config)
-                nodes = []
-                [nodes.extend(cass_tree.nodes) for cass_tree in cass_trees]
-                yield [node.n if node.n else '' for node in nodes]
-
-
-for benchmark in args.benchmark:
-    DIRECTORY_NAME = f'Project_CodeNet_C++{benchmark}'
-    DATA_DIR = os.path.join(args.data_dir, DIRECTORY_NAME, 'cass')
-    if not os.path.exists(DATA_DIR):
-        logger.error(
-            f'Data directory {DATA_DIR} does not exist. Could not preprocess data for {benchmark}.')
-        continue
-
-    config = CassConfig(
-        annot_mode=args.annot_mode,
-        compound_mode=args.compound_mode,
-        gfun_mode=args.gfun_mode,
-        gvar_mode=args.gvar_mode,
-        fsig_mode=args.fsig_mode)
-    logger.info(
-        f'Preprocessing C++{benchmark} with {config.tag}...')
-    PREPROCESSED_DIR = os.path.join(
-        args.output_dir, DIRECTORY_NAME, config.tag)
-    os.makedirs(PREPROCESSED_DIR, exist_ok=True)
-
-    logger.info(f'Generating vocabulary...')
-    vocab = build_vocab_from_iterator(
-        yield_tokens(DATA_DIR, config), specials=['<unk>'])
-    vocab.set_default_index(vocab['<unk>'])
-    logger.info(f'Vocabulary size: {len(vocab)}')
-    torch.save(vocab, os.path.join(
-        PREPROCESSED_DIR, 'vocab.pt'))
-
-    for directory in tqdm.tqdm(
-            os.listdir(DATA_DIR), leave=False):
-        if os.path.isdir(
+
+
+def count_tokens(directory: str, data_dir: str, config: CassConfig = None):
+    counter = collections.Counter()
+    for file in sorted(os.listdir(os.path.join(data_dir, directory))):
+        for labels in iter_file(
+                os.path.join(data_dir, directory, file),
+                config=config,
+                labels_only=True):
+            counter.update([label if label else '' for label in labels])
+    return counter
+
+
+def parse_directory(
+        directory: str,
+        data_dir: str,
+        cache_dir: str,
+        config: CassConfig = None):
+    # Parses every file once, counting labels for the vocabulary and caching
+    # the graph structure with labels interned to directory-local ids.
+    label_ids = {}
+    label_counts = []
+    filenames = []
+    node_types, local_label_ids, parents, children = [], [], [], []
+    node_offsets, edge_offsets = [0], [0]
+    for filename in sorted(os.listdir(os.path.join(data_dir, directory))):
+        cass_trees = iter_file(
             os.path.join(
-                DATA_DIR,
-                directory)):
-            OUTPUT_DIR_ALL = os.path.join(
-                PREPROCESSED_DIR, 'all')
-            OUTPUT_DIR_SORTED = os.path.join(
-                PREPROCESSED_DIR, directory)
-            os.makedirs(OUTPUT_DIR_ALL, exist_ok=True)
-            os.makedirs(OUTPUT_DIR_SORTED, exist_ok=True)
-
-            for filename in os.listdir(
-                    os.path.join(DATA_DIR, directory)):
-                if filename.endswith('.cas'):
-                    cass_trees = load_file(os.path.join(
-                        DATA_DIR, directory, filename), config)
-                    dense_graph = cass_tree_to_graph(
-                        cass_trees, vocabulary=vocab)
-                    dense_graph.save(
-                        os.path.join(
-                            OUTPUT_DIR_SORTED, filename.replace(
-                                '.cas', '.pt')))
-                    dense_graph.save(
-                        os.path.join(
-                            OUTPUT_DIR_ALL,
-                            f'{directory}_{filename.replace(".cas", ".pt")}'))
+                data_dir,
+                directory,
+                filename),
+            config=config,
+            compact=True)
+        types, labels, ps, cs = collect_graph_arrays(cass_trees)
+        ids = []
+        for label in labels:
+            label_id = label_ids.setdefault(label, len(label_ids))
+            if label_id == len(label_counts):
+                label_counts.append(0)
+            label_counts[label_id] += 1
+            ids.append(label_id)
+
+        if filename.endswith('.cas'):
+            filenames.append(filename)
+            node_types.extend(types)
+            local_label_ids.extend(ids)
+            parents.extend(ps)
+            children.extend(cs)
+            node_offsets.append(len(node_types))
+            edge_offsets.append(len(parents))
+
+    torch.save({
+        'labels': list(label_ids),
+        'filenames': filenames,
+        'node_types': torch.tensor(node_types, dtype=torch.int32),
+        'label_ids': torch.tensor(local_label_ids, dtype=torch.int32),
+        'parents': torch.tensor(parents, dtype=torch.int32),
+        'children': torch.tensor(children, dtype=torch.int32),
+        'node_offsets': node_offsets,
+        'edge_offsets': edge_offsets,
+    }, os.path.join(cache_dir, f'{directory}.pt'))
+    return collections.Counter(dict(zip(label_ids, label_counts)))
+
+
+vocab = None
+
+
+def load_vocab(vocab_file: str):
+    global vocab
+    vocab = torch.load(vocab_file)
+
+
+def build_directory_graphs(
+        directory: str,
+        data_dir: str,
+        config: CassConfig = None,
+        sparse: bool = True):
+    for filename in sorted(os.listdir(os.path.join(data_dir, directory))):
+        if filename.endswith('.cas'):
+            cass_trees = iter_file(os.path.join(
+                data_dir, directory, filename), config, compact=True)
+            graph = cass_tree_to_graph(
+                cass_trees,
+                vocabulary=vocab,
+                sparse=sparse)
+            yield filename, graph
+
+
+def build_cached_directory_graphs(
+        directory: str,
+        cache_dir: str,
+        sparse: bool = True):
+    cache_file = os.path.join(cache_dir, f'{directory}.pt')
+    cache = torch.load(cache_file)
+    remap = torch.tensor(vocab.lookup_indices(cache['labels']))
+    label_ids = remap[cache['label_ids'].long()]
+    node_offsets, edge_offsets = cache['node_offsets'], cache['edge_offsets']
+    for i, filename in enumerate(cache['filenames']):
+        nodes = slice(node_offsets[i], node_offsets[i + 1])
+        edges = slice(edge_offsets[i], edge_offsets[i + 1])
+        graph = build_graph(
+            cache['node_types'][nodes],
+            label_ids[nodes],
+            cache['parents'][edges],
+            cache['children'][edges],
+            sparse=sparse)
+        yield filename, graph
+    os.remove(cache_file)
+
+
+def preprocess_directory(
+        directory: str,
+        build_graphs,
+        preprocessed_dir: str,
+        output_format: str = 'files'):
+    if output_format == 'shards':
+        # Shards hold sparse graphs; the per-problem view is the shard itself.
+        graphs = []
+        names = []
+        for filename, graph in build_graphs(directory):
+            if isinstance(graph, DenseGraph):
+                graph = SparseGraph.from_dense(graph)
+            graphs.append(graph)
+            names.append(filename.replace('.cas', ''))
+        write_shard(
+            os.path.join(preprocessed_dir, 'shards'), directory, graphs, names)
+        return
+
+    os.makedirs(os.path.join(preprocessed_dir, 'all'), exist_ok=True)
+    os.makedirs(os.path.join(preprocessed_dir, directory), exist_ok=True)
+    node_counts = {}
+    for filename, graph in build_graphs(directory):
+        graph.save(
+            os.path.join(
+                preprocessed_dir, directory, filename.replace(
+                    '.cas', '.pt')))
+        file_name_all = f'{directory}_{filename.replace(".cas", ".pt")}'
+        graph.save(os.path.join(preprocessed_dir, 'all', file_name_all))
+        node_counts[file_name_all] = graph.num_nodes
+    return node_counts
+
+
+def map_directories(
+        fn,
+        directories,
+        workers: int,
+        initializer=None,
+        initargs=()):
+    # Results come back in the order of directories, so the serial and
+    # parallel paths produce the same output.
+    if workers <= 1:
+        if initializer is not None:
+            initializer(*initargs)
+        yield from map(fn, directories)
+        return
+    with multiprocessing.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        yield from pool.imap(fn, directories)
+
+
+def main(args):
+    if not os.path.exists(args.data_dir):
+        logger.error(f'Data directory {args.data_dir} does not exist.')
+        exit(1)
+
+    for benchmark in args.benchmark:
+        DIRECTORY_NAME = f'Project_CodeNet_C++{benchmark}'
+        DATA_DIR = os.path.join(args.data_dir, DIRECTORY_NAME, 'cass')
+        if not os.path.exists(DATA_DIR):
+            logger.error(
+                f'Data directory {DATA_DIR} does not exist. Could not preprocess data for {benchmark}.')
+            continue
+
+        config = CassConfig(
+            annot_mode=args.annot_mode,
+            compound_mode=args.compound_mode,
+            gfun_mode=args.gfun_mode,
+            gvar_mode=args.gvar_mode,
+            fsig_mode=args.fsig_mode)
+        logger.info(
+            f'Preprocessing C++{benchmark} with {config.tag}...')
+        PREPROCESSED_DIR = os.path.join(
+            args.output_dir, DIRECTORY_NAME, config.tag)
+        os.makedirs(PREPROCESSED_DIR, exist_ok=True)
+
+        directories = sorted(
+            directory for directory in os.listdir(DATA_DIR)
+            if os.path.isdir(os.path.join(DATA_DIR, directory)))
+
+        CACHE_DIR = os.path.join(PREPROCESSED_DIR, 'cache')
+        if args.single_pass:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            count_fn = functools.partial(
+                parse_directory,
+                data_dir=DATA_DIR,
+                cache_dir=CACHE_DIR,
+                config=config)
+        else:
+            count_fn = functools.partial(
+                count_tokens, data_dir=DATA_DIR, config=config)
+
+        logger.info(f'Generating vocabulary...')
+        counter = collections.Counter()
+        for partial_counter in tqdm.tqdm(
+                map_directories(count_fn, directories, args.workers),
+                total=len(directories),
+                leave=False):
+            counter.update(partial_counter)
+        vocab = build_vocab_from_iterator([counter], specials=['<unk>'])
+        vocab.set_default_index(vocab['<unk>'])
+        logger.info(f'Vocabulary size: {len(vocab)}')
+        VOCAB_FILE = os.path.join(PREPROCESSED_DIR, 'vocab.pt')
+        torch.save(vocab, VOCAB_FILE)
+
+        if args.single_pass:
+            build_graphs = functools.partial(
+                build_cached_directory_graphs,
+                cache_dir=CACHE_DIR,
+                sparse=args.graph_format == 'sparse')
+        else:
+            build_graphs = functools.partial(
+                build_directory_graphs,
+                data_dir=DATA_DIR,
+                config=config,
+                sparse=args.graph_format == 'sparse')
+        graph_fn = functools.partial(
+            preprocess_directory,
+            build_graphs=build_graphs,
+            preprocessed_dir=PREPROCESSED_DIR,
+            output_format=args.output_format)
+        if args.output_format == 'shards':
+            os.makedirs(
+                os.path.join(
+                    PREPROCESSED_DIR,
+                    'shards'),
+                exist_ok=True)
+
+        node_counts = {}
+        for directory_node_counts in tqdm.tqdm(
+                map_directories(
+                    graph_fn,
+                    directories,
+                    args.workers,
+                    initializer=load_vocab,
+                    initargs=(VOCAB_FILE,)),
+                total=len(directories),
+                leave=False):
+            if directory_node_counts is not None:
+                node_counts.update(directory_node_counts)
+        if args.single_pass:
+            os.rmdir(CACHE_DIR)
+        if args.output_format == 'shards':
+            write_index(os.path.join(PREPROCESSED_DIR, 'shards'), directories)
+        else:
+            with open(os.path.join(PREPROCESSED_DIR, 'all', NODE_COUNTS_FILE), 'w') as f:
+                json.dump(node_counts, f)
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
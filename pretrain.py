@@ -1,14 +1,21 @@
 import argparse
 import logging
 import os
+import time
+from contextlib import nullcontext
 
 import numpy as np
 import torch
+import torch.distributed as dist
 from torch.utils import tensorboard
 
+from codeclr import profiling
 from codeclr.cass import CassConfig
 from codeclr.data import train_val_test_split
+from codeclr.data.util import load_split
 from codeclr.model import ContrastiveLearner
+from codeclr.model.distributed import average_gradients
+from codeclr.search import evaluate_retrieval
 
 
 logging.basicConfig(
@@ -25,6 +32,13 @@ parser.add_argument('--log_dir', type=str, default='logs',
                     help='The directory in which to store the logs.')
 parser.add_argument('--save_interval', type=int, default=1,
                     help='The number of epochs between saving the model.')
+parser.add_argument(
+    '--eval_interval',
+    type=int,
+    default=1,
+    help='The number of epochs between MAP@R evaluations of the validation split (0 to disable). The test split is evaluated after training.')
+parser.add_argument('--eval_batch_size', type=int, default=256,
+                    help='The batch size for embedding graphs for evaluation.')
 parser.add_argument('--num_epochs', type=int, default=1,
                     help='The number of epochs for which to train.')
 parser.add_argument('--batch_size', type=int,
@@ -38,6 +52,83 @@ parser.add_argument(
     type=float,
     default=0.25,
     help='The fraction of nodes to mask for data augmentation.')
+parser.add_argument('--temperature', type=float, default=0.1,
+                    help='The temperature of the InfoNCE loss.')
+parser.add_argument(
+    '--queue_size',
+    type=int,
+    default=0,
+    help='If positive, use a momentum key encoder and a queue of this many past embeddings as negatives (MoCo) instead of the in-batch negatives.')
+parser.add_argument(
+    '--momentum',
+    type=float,
+    default=0.999,
+    help='The momentum of the key encoder when --queue_size is set, applied once per optimizer step.')
+parser.add_argument(
+    '--grad_cache_chunk_size',
+    type=int,
+    default=None,
+    help='If set, encode each batch in chunks of this many graphs with gradient caching, so large batches fit in memory.')
+parser.add_argument(
+    '--accumulation_steps',
+    type=int,
+    default=1,
+    help='The number of batches whose gradients are averaged per optimizer step.')
+parser.add_argument('--bf16', action='store_true',
+                    help='Run the encoder under bfloat16 autocast.')
+parser.add_argument(
+    '--compile',
+    action='store_true',
+    help='Compile the encoder with torch.compile, padding batches to bucketed sizes to limit recompiles. Requires PyTorch 2.2 or later.')
+parser.add_argument(
+    '--num_threads',
+    type=int,
+    default=None,
+    help='The number of intra-op threads (torch.set_num_threads).')
+parser.add_argument(
+    '--num_interop_threads',
+    type=int,
+    default=None,
+    help='The number of inter-op threads (torch.set_num_interop_threads).')
+parser.add_argument(
+    '--profile',
+    action='store_true',
+    help='Time the phases of every training step (data wait, augmentation, forward, loss, backward, optimizer step, graph loading) and log them with graphs/sec and nodes/sec to TensorBoard and profile.jsonl.')
+parser.add_argument('--profile_interval', type=int, default=10,
+                    help='The number of training steps per --profile record.')
+parser.add_argument(
+    '--trace_start',
+    type=int,
+    default=None,
+    help='If set, capture a torch.profiler trace of --trace_steps training steps from this step on, into the trace/ log directory.')
+parser.add_argument('--trace_steps', type=int, default=5,
+                    help='The number of training steps to trace.')
+parser.add_argument('--seed', type=int, default=None,
+                    help='The random seed for data augmentation.')
+parser.add_argument(
+    '--split_seed',
+    type=int,
+    default=0,
+    help='The random seed for the train/val/test split. The split is saved next to the data and reused.')
+parser.add_argument('--shuffle', action='store_true',
+                    help='Reshuffle the training order every epoch (always '
+                    'done with size-bucketed batches).')
+parser.add_argument('--num_workers', type=int, default=0,
+                    help='The number of data loading worker processes.')
+parser.add_argument(
+    '--prefetch_factor',
+    type=int,
+    default=2,
+    help='The number of batches each data loading worker prefetches.')
+parser.add_argument('--pin_memory', action='store_true',
+                    help='Load batches into pinned memory.')
+parser.add_argument('--bucket_by_size', action='store_true',
+                    help='Batch graphs of similar node counts together.')
+parser.add_argument(
+    '--max_nodes_per_batch',
+    type=int,
+    default=None,
+    help='Build size-bucketed batches of at most this many nodes instead of --batch_size graphs.')
 # CASS configuration
 parser.add_argument(
     '--annot_mode',
@@ -91,6 +182,24 @@ parser.add_argument(
     help='The second data augmentation method.')
 args = parser.parse_args()
 
+# Launched by torchrun with more than one process, every process trains on
+# its own shard of the data with gloo, and rank 0 writes the logs and
+# checkpoints.
+distributed = int(os.environ.get('WORLD_SIZE', 1)) > 1
+rank = 0
+world_size = 1
+if distributed:
+    dist.init_process_group('gloo')
+    rank = dist.get_rank()
+    world_size = dist.get_world_size()
+    if rank > 0:
+        logger.setLevel(logging.WARNING)
+
+if args.num_threads is not None:
+    torch.set_num_threads(args.num_threads)
+if args.num_interop_threads is not None:
+    torch.set_num_interop_threads(args.num_interop_threads)
+
 config = CassConfig(
     annot_mode=args.annot_mode,
     compound_mode=args.compound_mode,
@@ -100,24 +209,58 @@ config = CassConfig(
 
 parameter_tag = f'augment_1={args.augment_1}_augment_2={args.augment_2}_mask_frac={args.mask_frac}_batch_size={args.batch_size}_lr={args.lr}_{config.tag}'
 LOG_DIR = os.path.join(args.log_dir, parameter_tag)
-os.makedirs(LOG_DIR, exist_ok=True)
-writer = tensorboard.SummaryWriter(LOG_DIR)
+writer = None
+profile_file = None
+if rank == 0:
+    os.makedirs(LOG_DIR, exist_ok=True)
+    writer = tensorboard.SummaryWriter(LOG_DIR)
+    if args.profile:
+        profiling.enable()
+        profile_file = open(os.path.join(LOG_DIR, 'profile.jsonl'), 'a')
 
 logger.info('Loading data...')
 ALL_DATA_DIR = os.path.join(
     args.data_dir,
     f'Project_CodeNet_C++{args.benchmark}',
     config.tag,
-    'all')
+    'shards')
+if not os.path.exists(ALL_DATA_DIR):
+    ALL_DATA_DIR = os.path.join(os.path.dirname(ALL_DATA_DIR), 'all')
 
 if not os.path.exists(ALL_DATA_DIR):
     logger.error(f'Data directory does not exist: {ALL_DATA_DIR}')
     exit(1)
 
+SPLIT_FILE = os.path.join(
+    os.path.dirname(ALL_DATA_DIR),
+    f'split_{os.path.basename(ALL_DATA_DIR)}_train_frac={args.train_frac}_split_seed={args.split_seed}.json')
+# Rank 0 writes the split file before the other ranks read it.
+if distributed and rank > 0:
+    dist.barrier()
 train_dataloader, val_dataloader, test_dataloader = train_val_test_split(
     ALL_DATA_DIR,
     train_frac=args.train_frac,
-    batch_size=args.batch_size)
+    batch_size=args.batch_size,
+    seed=args.split_seed,
+    split_file=SPLIT_FILE,
+    shuffle=args.shuffle,
+    num_workers=args.num_workers,
+    pin_memory=args.pin_memory,
+    prefetch_factor=args.prefetch_factor,
+    bucket_by_size=args.bucket_by_size,
+    max_nodes_per_batch=args.max_nodes_per_batch,
+    num_replicas=world_size,
+    rank=rank)
+if distributed and rank == 0:
+    dist.barrier()
+# Retrieval is evaluated on rank 0, over the whole of each split.
+dataset = split = None
+if rank == 0:
+    dataset, split = load_split(
+        ALL_DATA_DIR,
+        train_frac=args.train_frac,
+        seed=args.split_seed,
+        split_file=SPLIT_FILE)
 logger.info('Successfully loaded data.')
 
 VOCAB_FILE = os.path.join(
@@ -142,38 +285,195 @@ model = ContrastiveLearner(
     mask_frac=args.mask_frac,
     mask_idx=mask_idx,
     augment_1=args.augment_1,
-    augment_2=args.augment_2)
+    augment_2=args.augment_2,
+    seed=None if args.seed is None else args.seed + rank,
+    temperature=args.temperature,
+    queue_size=args.queue_size,
+    momentum=args.momentum)
+
+if args.compile:
+    if not hasattr(torch.nn.Module, 'compile'):
+        logger.error('--compile requires PyTorch 2.2 or later.')
+        exit(1)
+    encoders = [model.encoder]
+    if args.queue_size > 0:
+        encoders.append(model.key_encoder)
+    for encoder in encoders:
+        encoder.pad_to_buckets = True
+        encoder.compile(dynamic=False)
+
+# DistributedDataParallel starts all ranks from the weights of rank 0 and
+# averages the gradients in backward. The queue stays identical across ranks
+# by construction, so buffers are not broadcast.
+ddp_model = model
+if distributed:
+    ddp_model = torch.nn.parallel.DistributedDataParallel(
+        model, broadcast_buffers=False)
 
 optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
 
+
+def optimizer_step(num_batches: int, synced: bool = True):
+    # Gradients computed outside DistributedDataParallel's reduction
+    # (gradient caching, or a trailing partial accumulation step) are
+    # averaged over ranks here. Gradients are summed over the accumulated
+    # batches; average them.
+    with profiling.timer('optimizer_step'):
+        if distributed and not synced:
+            average_gradients(model)
+        if num_batches > 1:
+            for parameter in model.parameters():
+                if parameter.grad is not None:
+                    parameter.grad.div_(num_batches)
+        optimizer.step()
+        optimizer.zero_grad()
+
+
+def evaluate(epoch: int, split_name: str):
+    # MAP@R and precision@1 of retrieving programs that solve the same
+    # problem, over the embeddings of a held-out split.
+    with torch.autocast('cpu', dtype=torch.bfloat16, enabled=args.bf16):
+        results = evaluate_retrieval(
+            model.encoder,
+            dataset,
+            split[split_name],
+            batch_size=args.eval_batch_size,
+            num_workers=args.num_workers)
+    logger.info(f'Epoch {epoch} {split_name}: MAP@R {results["map@r"]:.4f}, '
+                f'precision@1 {results["precision@1"]:.4f}')
+    writer.add_scalar(f'{split_name}/map_at_r', results['map@r'], epoch)
+    writer.add_scalar(
+        f'{split_name}/precision_at_1', results['precision@1'], epoch)
+
+
+# The trace covers steps [trace_start, trace_start + trace_steps) of the whole
+# run; its schedule counts the steps before them as waiting and warm-up.
+trace = None
+if rank == 0 and args.trace_start is not None:
+    trace = torch.profiler.profile(
+        activities=[torch.profiler.ProfilerActivity.CPU],
+        schedule=torch.profiler.schedule(
+            wait=max(args.trace_start - 1, 0),
+            warmup=min(args.trace_start, 1),
+            active=args.trace_steps,
+            repeat=1),
+        on_trace_ready=torch.profiler.tensorboard_trace_handler(
+            os.path.join(LOG_DIR, 'trace')),
+        record_shapes=True)
+step = 0
+
 logger.info('Training...')
+if trace is not None:
+    trace.start()
 for epoch in range(args.num_epochs):
+    # The samplers reshuffle only when told the epoch, identically on every
+    # rank.
+    for sampler in [train_dataloader.sampler, train_dataloader.batch_sampler]:
+        if hasattr(sampler, 'set_epoch'):
+            sampler.set_epoch(epoch)
+    num_batches = len(train_dataloader)
     epoch_train_losses = []
+    epoch_num_graphs = 0
+    epoch_start = time.perf_counter()
+    num_accumulated = 0
+    optimizer.zero_grad()
+    # Profile intervals leave out validation and evaluation time.
+    profiling.INSTRUMENTATION.reset()
+    wait_start = time.perf_counter()
     for batch_idx, batch in enumerate(train_dataloader):
-        optimizer.zero_grad()
-        loss = model(batch)
-        loss.backward()
-        optimizer.step()
+        profiling.record('data_wait', time.perf_counter() - wait_start)
+        # Only the last batch of an accumulation step syncs gradients.
+        sync = num_accumulated + 1 == args.accumulation_steps
+        # The encoder only changes at optimizer steps, so the key encoder
+        # follows it on the first batch of each step.
+        model.update_key_encoder = num_accumulated == 0
+        no_sync = nullcontext()
+        if distributed and (args.grad_cache_chunk_size or not sync):
+            no_sync = ddp_model.no_sync()
+        # Only the forward pass runs under autocast: the backward pass of the
+        # sparse CSR aggregation has no bfloat16 CPU kernel.
+        autocast = torch.autocast(
+            'cpu', dtype=torch.bfloat16, enabled=args.bf16)
+        with no_sync:
+            with autocast:
+                if args.grad_cache_chunk_size:
+                    loss = model.forward_backward(
+                        batch, args.grad_cache_chunk_size)
+                else:
+                    loss = ddp_model(batch)
+            if not args.grad_cache_chunk_size:
+                with profiling.timer('backward'):
+                    loss.backward()
+        num_accumulated += 1
+        if num_accumulated == args.accumulation_steps:
+            optimizer_step(num_accumulated,
+                           synced=not args.grad_cache_chunk_size)
+            num_accumulated = 0
 
+        epoch_num_graphs += len(batch)
         epoch_train_losses.append(loss.item())
-        batch_iteration = epoch * len(train_dataloader) + batch_idx
-        writer.add_scalar('train/batch_loss', loss.item(), batch_iteration)
+        batch_iteration = epoch * num_batches + batch_idx
+        if writer is not None:
+            writer.add_scalar('train/batch_loss', loss.item(), batch_iteration)
+
+        step += 1
+        if args.profile:
+            profiling.count('graphs', len(batch))
+            profiling.count('nodes', sum(graph.num_nodes for graph in batch))
+            if step % args.profile_interval == 0:
+                profiling.INSTRUMENTATION.flush(step, writer, profile_file)
+        if trace is not None:
+            trace.step()
+        wait_start = time.perf_counter()
+    if num_accumulated > 0:
+        optimizer_step(num_accumulated, synced=False)
+    if args.profile and step % args.profile_interval != 0:
+        profiling.INSTRUMENTATION.flush(step, writer, profile_file)
+
+    # Every rank trains on its share of the graphs at the same time.
+    graphs_per_sec = world_size * epoch_num_graphs / \
+        (time.perf_counter() - epoch_start)
+    logger.info(f'Epoch {epoch}: {graphs_per_sec:.1f} training graphs/sec')
 
     epoch_train_loss = np.mean(epoch_train_losses)
-    writer.add_scalar('train/loss', loss.item(), epoch)
+    if writer is not None:
+        writer.add_scalar('train/graphs_per_sec', graphs_per_sec, epoch)
+        writer.add_scalar('train/loss', loss.item(), epoch)
 
+    model.eval()
     with torch.no_grad():
         epoch_val_losses = []
         for batch in val_dataloader:
-            loss = model(batch)
+            with torch.autocast('cpu', dtype=torch.bfloat16, enabled=args.bf16):
+                loss = model(batch)
             epoch_val_losses.append(loss.item())
 
         epoch_val_loss = np.mean(epoch_val_losses)
-        writer.add_scalar('val/loss', loss.item(), epoch)
+        if writer is not None:
+            writer.add_scalar('val/loss', loss.item(), epoch)
+    model.train()
+
+    if args.eval_interval > 0 and epoch % args.eval_interval == 0:
+        if rank == 0:
+            evaluate(epoch, 'val')
+        # The other ranks wait for the evaluation here rather than in the
+        # first collective of the next epoch.
+        if distributed:
+            dist.barrier()
 
-    if epoch % args.save_interval == 0:
+    if rank == 0 and epoch % args.save_interval == 0:
         torch.save({
             'epoch': epoch,
             'model_state_dict': model.state_dict(),
             'optimizer_state_dict': optimizer.state_dict(),
         }, os.path.join(LOG_DIR, f'checkpoint_{epoch}.pt'))
+if trace is not None:
+    trace.stop()
+if profile_file is not None:
+    profile_file.close()
+
+if rank == 0 and args.eval_interval > 0:
+    evaluate(args.num_epochs - 1, 'test')
+
+if distributed:
+    dist.destroy_process_group()
@@ -0,0 +1,82 @@
+import argparse
+import logging
+
+import torch
+
+from codeclr.inference import load_embeddings
+from codeclr.search import ExactIndex, IVFIndex, evaluate_index
+
+logging.basicConfig(
+    format='[%(asctime)s] %(pathname)s:%(lineno)d %(levelname)s - %(message)s',
+    level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+parser = argparse.ArgumentParser()
+parser.add_argument('--embeddings_dir', type=str, default='embeddings',
+                    help='The output directory of embed.py.')
+parser.add_argument('--index', type=str, default='ivf',
+                    choices=['exact', 'ivf'], help='The search index.')
+parser.add_argument('--k', type=int, default=10,
+                    help='The number of neighbours to retrieve.')
+parser.add_argument('--num_lists', type=int, default=256,
+                    help='IVF: the number of k-means lists.')
+parser.add_argument('--num_probes', type=int, default=8,
+                    help='IVF: the number of lists each query scans.')
+parser.add_argument(
+    '--num_queries',
+    type=int,
+    default=1000,
+    help='The number of random embeddings to use as queries when measuring recall@k and queries/sec.')
+parser.add_argument(
+    '--query_ids',
+    type=str,
+    nargs='*',
+    default=[],
+    help='Ids of embedded programs whose nearest neighbours to print.')
+parser.add_argument(
+    '--chunk_size',
+    type=int,
+    default=1 << 16,
+    help='The number of embeddings to add to the index at once.')
+parser.add_argument('--seed', type=int, default=0, help='The random seed.')
+
+
+def main(args):
+    embeddings, ids = load_embeddings(args.embeddings_dir)
+    dim = embeddings.shape[1]
+    exact_index = ExactIndex(dim)
+    if args.index == 'ivf':
+        index = IVFIndex(
+            dim,
+            num_lists=args.num_lists,
+            num_probes=args.num_probes,
+            seed=args.seed)
+    else:
+        index = exact_index
+
+    logger.info(f'Indexing {len(ids)} embeddings...')
+    for start in range(0, len(ids), args.chunk_size):
+        chunk = embeddings[start:start + args.chunk_size]
+        chunk_ids = ids[start:start + args.chunk_size]
+        index.add(chunk, chunk_ids)
+        if index is not exact_index:
+            exact_index.add(chunk, chunk_ids)
+
+    generator = torch.Generator()
+    generator.manual_seed(args.seed)
+    queries = torch.randperm(len(ids), generator=generator)[
+        :args.num_queries].sort().values.numpy()
+    results = evaluate_index(index, exact_index, embeddings[queries], args.k)
+    logger.info(
+        ', '.join(f'{name}: {value:.4g}' for name, value in results.items()))
+
+    row = {id: i for i, id in enumerate(ids)}
+    for query_id in args.query_ids:
+        scores, indices = index.search(embeddings[[row[query_id]]], args.k)
+        neighbours = [f'{index.ids[i]} ({score:.3f})' for score, i in zip(
+            scores[0].tolist(), indices[0].tolist()) if i >= 0]
+        print(f'{query_id}: {", ".join(neighbours)}')
+
+
+if __name__ == '__main__':
+    main(parser.parse_args())
@@ -1,8 +1,14 @@
+import collections
 import os
 
 import pytest
+import torch
+from torchtext.vocab import build_vocab_from_iterator
 
-from codeclr.cass import CassTree, load_file
+from codeclr.cass import CassConfig, CassTree, CompactCassTree, bag_of_features, bags_of_features, cass_tree_to_graph, collect_graph_arrays, feature_ids, iter_file, label_cache_info, load_file, set_label_cache_size
+from codeclr.cass.cass import LABEL_CACHE_SIZE
+from codeclr.cass.features import hash_feature
+from codeclr.cass.util import deserialize
 
 
 def test_deserialize_file_one_cass_tree() -> None:
@@ -24,3 +30,183 @@ def test_deserialize_file_multiple_cass_trees() -> None:
     assert(len(cass_trees) == 4)
     for cass_tree in cass_trees:
         assert(isinstance(cass_tree, CassTree))
+
+
+def reference_cass_tree_to_graph(cass_trees, vocabulary):
+    nodes = []
+    [nodes.extend(cass_tree.nodes) for cass_tree in cass_trees]
+    num_nodes = len(nodes)
+    for i, node in enumerate(nodes):
+        node.set_id(i)
+
+    node_features = torch.zeros(num_nodes, 2)
+    adjacency_matrix = torch.zeros(num_nodes, num_nodes)
+    for node in nodes:
+        node_features[node.id, 0] = node.node_type.value[0]
+        if node.n:
+            node_features[node.id, 1] = vocabulary[node.n]
+        else:
+            node_features[node.id, 1] = vocabulary['']
+        for child in node.children:
+            adjacency_matrix[node.id, child.id] = 1
+            adjacency_matrix[child.id, node.id] = 1
+        adjacency_matrix[node.id, node.id] = 1
+    return node_features, adjacency_matrix
+
+
+@pytest.mark.parametrize('file_name',
+                         ['one_cass_tree.cas',
+                          'multiple_cass_trees.cas'])
+def test_cass_tree_to_graph_matches_reference(file_name) -> None:
+    cass_trees = load_file(os.path.join(
+        os.path.dirname(__file__), 'examples', file_name))
+    vocab = build_vocab_from_iterator(
+        [[node.n if node.n else '' for tree in cass_trees for node in tree.nodes]],
+        specials=['<unk>'])
+    node_features, adjacency_matrix = reference_cass_tree_to_graph(
+        cass_trees, vocab)
+    graph = cass_tree_to_graph(cass_trees, vocabulary=vocab)
+    assert(graph.node_features.dtype == node_features.dtype)
+    assert(torch.equal(graph.node_features, node_features))
+    assert(torch.equal(graph.adjacency_matrix, adjacency_matrix))
+
+
+def preorder(root):
+    nodes = []
+    stack = [root]
+    while stack:
+        node = stack.pop()
+        nodes.append(node)
+        stack.extend(reversed(node.children))
+    return nodes
+
+
+@pytest.mark.parametrize('file_name',
+                         ['one_cass_tree.cas',
+                          'multiple_cass_trees.cas'])
+def test_deserialize_links_nodes_in_preorder(file_name) -> None:
+    cass_trees = load_file(os.path.join(
+        os.path.dirname(__file__), 'examples', file_name))
+    for cass_tree in cass_trees:
+        start = 0 if cass_tree.fun_sig_node is None else 1
+        assert(preorder(cass_tree.root) == cass_tree.nodes[start:])
+        assert(cass_tree.root.parent is None)
+        for node in cass_tree.nodes[start:]:
+            for i, child in enumerate(node.children):
+                assert(child.parent is node)
+                assert(child.child_id == i)
+
+
+def test_deserialize_deep_tree() -> None:
+    depth = 5000
+    tokens = [str(depth + 1)]
+    for _ in range(depth):
+        tokens.extend(['I#compound_statement#{$$$}', '1'])
+    tokens.append('Vx')
+    cass_tree = deserialize('\t'.join(tokens), None)
+    assert(len(cass_tree.nodes) == depth + 1)
+    assert(cass_tree.nodes[-1].parent is cass_tree.nodes[-2])
+    assert(cass_tree.leaf_ranges[cass_tree.root] == (0, 1))
+
+
+@pytest.mark.parametrize('file_name',
+                         ['one_cass_tree.cas',
+                          'multiple_cass_trees.cas'])
+@pytest.mark.parametrize('config',
+                         [CassConfig(),
+                          CassConfig(annot_mode=2, compound_mode=1,
+                                     gfun_mode=1, gvar_mode=3, fsig_mode=1),
+                          CassConfig(annot_mode=1, compound_mode=2,
+                                     gfun_mode=3, gvar_mode=2)])
+def test_compact_cass_tree_matches_cass_tree(file_name, config) -> None:
+    file_name = os.path.join(os.path.dirname(__file__), 'examples', file_name)
+    cass_trees = load_file(file_name, config)
+    compact_trees = load_file(file_name, config, compact=True)
+    assert(len(compact_trees) == len(cass_trees))
+    for cass_tree, compact_tree in zip(cass_trees, compact_trees):
+        assert(isinstance(compact_tree, CompactCassTree))
+        index = {node: i for i, node in enumerate(cass_tree.nodes)}
+        assert(compact_tree.num_nodes == len(cass_tree.nodes))
+        assert(list(compact_tree.leaf_nodes) == [
+            index[node] for node in cass_tree.leaf_nodes])
+        for i, node in enumerate(cass_tree.nodes):
+            assert(compact_tree.node_type(i) == node.node_type)
+            assert(compact_tree.n(i) == node.n)
+            assert(compact_tree.removed[i] == node.removed)
+            assert(compact_tree.children(i) == [
+                index[child] for child in node.children])
+            parent = -1 if node.parent is None else index[node.parent]
+            assert(compact_tree.parent[i] == parent)
+            assert(compact_tree.child_id[i] == node.child_id)
+            if node in cass_tree.leaf_ranges:
+                assert(compact_tree.leaf_range(i) ==
+                       cass_tree.leaf_ranges[node])
+        assert(compact_tree.featurize() == cass_tree.featurize())
+    assert(collect_graph_arrays(compact_trees) ==
+           collect_graph_arrays(cass_trees))
+
+
+def test_label_cache_is_shared_and_bounded() -> None:
+    set_label_cache_size(4)
+    file_name = os.path.join(
+        os.path.dirname(__file__), 'examples', 'one_cass_tree.cas')
+    load_file(file_name, CassConfig(gvar_mode=3))
+    load_file(file_name, CassConfig(gvar_mode=3))
+    info = label_cache_info()
+    assert(info['size'] <= 4)
+    assert(info['hits'] > 0)
+    assert(0 < info['hit_rate'] < 1)
+
+    set_label_cache_size(LABEL_CACHE_SIZE)
+    load_file(file_name, CassConfig(gvar_mode=3))
+    misses = label_cache_info()['misses']
+    load_file(file_name, CassConfig(gvar_mode=3), compact=True)
+    info = label_cache_info()
+    assert(info['misses'] == misses)
+    assert(info['size'] == misses)
+
+
+@pytest.mark.parametrize('file_name',
+                         ['one_cass_tree.cas',
+                          'multiple_cass_trees.cas'])
+def test_iter_file(file_name) -> None:
+    file_name = os.path.join(os.path.dirname(__file__), 'examples', file_name)
+    config = CassConfig(annot_mode=2, compound_mode=1, gvar_mode=3)
+    cass_trees = load_file(file_name, config)
+    cass_iter = iter_file(file_name, config)
+    assert(not isinstance(cass_iter, list))
+    assert([len(cass_tree.nodes) for cass_tree in cass_iter] ==
+           [len(cass_tree.nodes) for cass_tree in cass_trees])
+    labels = list(iter_file(file_name, config, labels_only=True))
+    assert(labels == [[node.n for node in cass_tree.nodes]
+                      for cass_tree in cass_trees])
+
+
+@pytest.mark.parametrize('file_name',
+                         ['one_cass_tree.cas',
+                          'multiple_cass_trees.cas'])
+@pytest.mark.parametrize('config',
+                         [CassConfig(),
+                          CassConfig(annot_mode=2, compound_mode=1,
+                                     gfun_mode=1, gvar_mode=3, fsig_mode=1)])
+def test_feature_ids_match_featurize(file_name, config) -> None:
+    num_buckets = 1 << 16
+    cass_trees = load_file(
+        os.path.join(
+            os.path.dirname(__file__),
+            'examples',
+            file_name),
+        config,
+        compact=True)
+    for cass_tree in cass_trees:
+        expected = collections.Counter(
+            hash_feature(feature) % num_buckets
+            for feature in cass_tree.featurize())
+        ids = feature_ids(cass_tree, num_buckets)
+        assert(collections.Counter(ids.tolist()) == expected)
+
+    bags = bags_of_features([cass_trees, cass_trees[:1]], num_buckets)
+    assert(bags.shape == (2, num_buckets))
+    assert(torch.equal(bags.to_dense()[0],
+                       bag_of_features(cass_trees, num_buckets).to_dense()))
+    assert(bags.to_dense()[1].sum() == len(cass_trees[0].featurize()))
@@ -0,0 +1,71 @@
+import pytest
+import torch
+
+from codeclr.data.graph_sampler import BucketBatchSampler, GraphSampler
+
+
+def random_node_counts(n: int):
+    generator = torch.Generator()
+    generator.manual_seed(0)
+    return torch.randint(1, 1000, (n,), generator=generator).tolist()
+
+
+def test_bucket_batch_sampler_fixed_size() -> None:
+    node_counts = random_node_counts(200)
+    sampler = BucketBatchSampler(
+        range(200), node_counts, batch_size=16, bucket_size=64, drop_last=True)
+    batches = list(sampler)
+    assert(len(batches) == len(sampler) == 12)
+    assert(all(len(batch) == 16 for batch in batches))
+    assert(len(set(i for batch in batches for i in batch)) == 192)
+    spread = sum(max(node_counts[i] for i in batch) - min(node_counts[i]
+                 for i in batch) for batch in batches) / len(batches)
+    assert(spread < 400)
+
+
+def test_bucket_batch_sampler_max_nodes() -> None:
+    node_counts = random_node_counts(200)
+    sampler = BucketBatchSampler(range(200), node_counts, max_nodes=2000)
+    batches = list(sampler)
+    assert(sorted(i for batch in batches for i in batch) == list(range(200)))
+    assert(all(sum(node_counts[i] for i in batch) <= 2000
+               for batch in batches))
+
+
+def test_bucket_batch_sampler_reshuffles_every_epoch() -> None:
+    node_counts = random_node_counts(100)
+    sampler = BucketBatchSampler(
+        range(100), node_counts, max_nodes=2000, seed=1)
+    epoch_0 = list(sampler)
+    assert(list(sampler) == epoch_0)
+    sampler.set_epoch(1)
+    epoch_1 = list(sampler)
+    assert(epoch_0 != epoch_1)
+    assert(len(sampler) == len(epoch_1))
+    sampler.set_epoch(0)
+    assert(list(sampler) == epoch_0)
+
+
+@pytest.mark.parametrize('shuffle', [False, True])
+def test_graph_sampler_shards_across_replicas(shuffle) -> None:
+    order = list(GraphSampler(range(10), shuffle=shuffle, seed=3))
+    shards = [list(GraphSampler(range(10), shuffle=shuffle, seed=3,
+                                num_replicas=3, rank=rank))
+              for rank in range(3)]
+    assert(all(len(shard) == 4 for shard in shards))
+    # Interleaved, the shards give the order padded with its first indices.
+    assert([shard[j] for j in range(4) for shard in shards] ==
+           order + order[:2])
+
+
+def test_bucket_batch_sampler_shards_across_replicas() -> None:
+    node_counts = random_node_counts(200)
+    batches = list(BucketBatchSampler(range(200), node_counts, max_nodes=2000))
+    shards = [list(BucketBatchSampler(range(200), node_counts,
+                                      max_nodes=2000, num_replicas=3,
+                                      rank=rank))
+              for rank in range(3)]
+    num_batches = len(batches) // 3
+    assert(all(len(shard) == num_batches for shard in shards))
+    assert([shard[j] for j in range(num_batches) for shard in shards] ==
+           batches[:3 * num_batches])
@@ -0,0 +1,39 @@
+import os
+
+import pytest
+import torch
+
+from codeclr import SparseGraph
+from codeclr.data import ShardedGraphDataset
+from codeclr.data.graph_shards import write_index, write_shard
+
+
+def random_graph(num_nodes: int) -> SparseGraph:
+    node_features = torch.randint(0, 10, (num_nodes, 2)).float()
+    edge_index = torch.randint(0, num_nodes, (2, 3 * num_nodes))
+    degree = torch.bincount(edge_index[0], minlength=num_nodes)
+    return SparseGraph(node_features, edge_index, degree=degree)
+
+
+def test_sharded_graph_dataset(tmp_path) -> None:
+    shards = {
+        'p00001': [random_graph(n) for n in [3, 5, 1]],
+        'p00002': [random_graph(n) for n in [7, 2]],
+    }
+    for shard, graphs in shards.items():
+        write_shard(tmp_path, shard, graphs,
+                    [f's{i}' for i in range(len(graphs))])
+    write_index(tmp_path, list(shards))
+
+    dataset = ShardedGraphDataset(tmp_path)
+    assert(len(dataset) == 5)
+    for file_name, i in zip(dataset.file_names, range(len(dataset))):
+        shard, name = file_name.split('_')
+        expected = shards[shard][int(name[1:])]
+        graph = dataset[i]
+        assert(torch.equal(graph.node_features, expected.node_features))
+        assert(torch.equal(graph.edge_index, expected.edge_index))
+        assert(torch.equal(graph.degree, expected.degree))
+
+    problem_dataset = ShardedGraphDataset(tmp_path, shards=['p00002'])
+    assert(len(problem_dataset) == 2)
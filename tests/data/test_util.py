@@ -0,0 +1,42 @@
+import os
+
+import pytest
+import torch
+
+from codeclr.data.graph_sampler import GraphSampler
+from codeclr.data.util import split_file_names
+
+
+def test_split_is_seeded_and_persisted(tmp_path) -> None:
+    file_names = [f'p{i:05d}_s1.pt' for i in range(100)]
+    split = split_file_names(file_names, train_frac=0.6, seed=1)
+    assert(len(split['train']) == 60)
+    assert(len(split['val']) == 20)
+    assert(len(split['test']) == 20)
+    assert(sorted(split['train'] + split['val'] + split['test']) == file_names)
+    assert(split == split_file_names(
+        list(reversed(file_names)), train_frac=0.6, seed=1))
+    assert(split != split_file_names(file_names, train_frac=0.6, seed=2))
+
+    split_file = os.path.join(tmp_path, 'split.json')
+    saved = split_file_names(file_names, seed=1, split_file=split_file)
+    assert(os.path.exists(split_file))
+    assert(saved == split_file_names(
+        list(reversed(file_names)), seed=3, split_file=split_file))
+    with pytest.raises(ValueError):
+        split_file_names(file_names + ['p00100_s1.pt'], split_file=split_file)
+    with pytest.raises(ValueError):
+        split_file_names(file_names[1:], split_file=split_file)
+
+
+def test_graph_sampler_shuffles_every_epoch() -> None:
+    sampler = GraphSampler(range(10, 30), shuffle=True, seed=0)
+    epoch_0 = list(sampler)
+    assert(list(sampler) == epoch_0)
+    sampler.set_epoch(1)
+    epoch_1 = list(sampler)
+    assert(sorted(epoch_0) == list(range(10, 30)))
+    assert(epoch_0 != epoch_1)
+    sampler.set_epoch(0)
+    assert(list(sampler) == epoch_0)
+    assert(list(GraphSampler(range(3))) == [0, 1, 2])
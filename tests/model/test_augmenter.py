@@ -0,0 +1,86 @@
+import os
+
+import pytest
+import torch
+from torchtext.vocab import build_vocab_from_iterator
+
+from codeclr import GraphBatch
+from codeclr.cass import cass_tree_to_graph, load_file
+from codeclr.cass.cass import NodeType
+from codeclr.model.augmenter import Augmenter, NodeDropper, NodeMasker, SubtreeMasker
+from tests.model.test_encoder import random_tree
+
+
+def random_batch() -> GraphBatch:
+    torch.manual_seed(0)
+    return GraphBatch.from_graphs(
+        [random_tree(n) for n in [1, 4, 13, 40, 9]])
+
+
+def test_node_masker_masks_frac_per_graph() -> None:
+    graphs = random_batch()
+    augment = NodeMasker(mask_frac=0.25, mask_idx=7)(graphs)
+    masked = augment.node_features[:, 0] == NodeType.Mask.value
+    assert(torch.equal(torch.bincount(graphs.batch[masked], minlength=5),
+                       torch.tensor([0, 1, 3, 10, 2])))
+    assert(torch.all(augment.node_features[masked, 1] == 7))
+    assert(torch.equal(augment.node_features[~masked],
+                       graphs.node_features[~masked]))
+    assert(torch.equal(augment.edge_index, graphs.edge_index))
+
+
+def test_node_dropper_drops_edges() -> None:
+    graphs = random_batch()
+    augment = NodeDropper(drop_frac=0.25)(graphs)
+    dropped = torch.all(augment.node_features == 0, dim=-1) & \
+        torch.any(graphs.node_features != 0, dim=-1)
+    assert(torch.bincount(graphs.batch[dropped], minlength=5).sum() <= 16)
+    row, col = augment.edge_index
+    assert(not torch.any(dropped[row] | dropped[col]))
+
+
+def test_subtree_masker_masks_subtree() -> None:
+    graphs = random_batch()
+    subtree_sizes = graphs.compute_subtree_sizes()
+    augment = SubtreeMasker(mask_frac=0.25, mask_idx=7)(graphs)
+    masked = augment.node_features[:, 0] == NodeType.Mask.value
+    assert(torch.equal(torch.bincount(graphs.batch[masked], minlength=5),
+                       torch.tensor([0, 1, 3, 10, 2])))
+    for i in range(graphs.num_graphs):
+        nodes = (masked & (graphs.batch == i)).nonzero().squeeze(-1)
+        if len(nodes) == 0:
+            continue
+        root = nodes[0]
+        assert(torch.equal(nodes, torch.arange(root, root + len(nodes))))
+        assert(len(nodes) <= subtree_sizes[root])
+
+
+def test_subtree_sizes_are_stored_with_graphs() -> None:
+    file_name = os.path.join(
+        os.path.dirname(__file__), '..', 'cass', 'examples',
+        'multiple_cass_trees.cas')
+    cass_trees = load_file(file_name)
+    vocab = build_vocab_from_iterator(
+        [[node.n if node.n else '' for tree in cass_trees for node in tree.nodes]])
+    graph = cass_tree_to_graph(cass_trees, vocabulary=vocab, sparse=True)
+    graphs = GraphBatch.from_graphs([graph])
+    assert(torch.equal(graph.subtree_sizes, graphs.compute_subtree_sizes()))
+    for tree in cass_trees:
+        for node in tree.nodes:
+            assert(graph.subtree_sizes[node.id] == count_nodes(node))
+
+
+def count_nodes(node) -> int:
+    return 1 + sum(count_nodes(child) for child in node.children)
+
+
+@pytest.mark.parametrize('augment', ['node_mask', 'node_drop', 'subtree_mask'])
+def test_augmenter_seed_is_reproducible(augment) -> None:
+    graphs = random_batch()
+    views = []
+    for _ in range(2):
+        augmenter = Augmenter(augment_1=augment, augment_2=augment, seed=3)
+        views.append(augmenter(graphs))
+    for view_1, view_2 in zip(*views):
+        assert(torch.equal(view_1.node_features, view_2.node_features))
+        assert(torch.equal(view_1.edge_index, view_2.edge_index))
@@ -0,0 +1,95 @@
+import torch
+import torch.distributed as dist
+import torch.multiprocessing as mp
+
+from codeclr.model import ContrastiveLearner
+from codeclr.model.distributed import all_gather, average_gradients
+
+from .test_encoder import random_tree
+
+
+WORLD_SIZE = 2
+# Unequal shares, to exercise padding in all_gather.
+SHARES = [[3, 9, 4, 12], [6, 2, 8]]
+
+
+def make_model(**kwargs) -> ContrastiveLearner:
+    torch.manual_seed(0)
+    return ContrastiveLearner(
+        [16, 16, 8], vocab_size=100, augment_1='identity',
+        augment_2='identity', temperature=0.2, **kwargs)
+
+
+def make_graphs():
+    torch.manual_seed(1)
+    return [[random_tree(n) for n in share] for share in SHARES]
+
+
+def gradients(model: torch.nn.Module):
+    return [p.grad.clone() for p in model.parameters() if p.grad is not None]
+
+
+def run_rank(rank: int, init_file: str, result_file: str) -> None:
+    dist.init_process_group(
+        'gloo', init_method=f'file://{init_file}', rank=rank,
+        world_size=WORLD_SIZE)
+    graphs = make_graphs()[rank]
+    results = {}
+
+    x = torch.full((len(graphs), 2), float(rank), requires_grad=True)
+    gathered = all_gather(x)
+    (gathered.sum(dim=1) * torch.arange(gathered.shape[0])).sum().backward()
+    results['gathered'] = gathered.detach()
+    results['gather_grad'] = x.grad
+
+    model = make_model()
+    ddp_model = torch.nn.parallel.DistributedDataParallel(model)
+    loss = ddp_model(graphs)
+    loss.backward()
+    results['loss'] = loss.detach()
+    results['grads'] = gradients(model)
+
+    model.zero_grad()
+    with ddp_model.no_sync():
+        model.forward_backward(graphs, chunk_size=2)
+    average_gradients(model)
+    results['cached_grads'] = gradients(model)
+
+    queue_model = make_model(queue_size=16, momentum=0.9)
+    queue_model(graphs)
+    results['queue'] = queue_model.queue
+
+    torch.save(results, f'{result_file}.{rank}')
+    dist.destroy_process_group()
+
+
+def test_distributed_training_matches_single_process(tmp_path) -> None:
+    result_file = str(tmp_path / 'results')
+    mp.spawn(run_rank, args=(str(tmp_path / 'init'), result_file),
+             nprocs=WORLD_SIZE)
+    results = [torch.load(f'{result_file}.{rank}')
+               for rank in range(WORLD_SIZE)]
+    graphs = sum(make_graphs(), [])
+
+    for rank, share in enumerate(SHARES):
+        assert(torch.equal(results[rank]['gathered'][:, 0], torch.tensor(
+            [0.] * len(SHARES[0]) + [1.] * len(SHARES[1]))))
+        # Every rank's loss weighs row i by i; the gradient is their sum.
+        start = sum(len(s) for s in SHARES[:rank])
+        rows = torch.arange(start, start + len(share)).float()
+        assert(torch.equal(results[rank]['gather_grad'],
+                           WORLD_SIZE * rows.unsqueeze(1).expand(-1, 2)))
+
+    model = make_model()
+    loss = model(graphs)
+    loss.backward()
+    expected = gradients(model)
+    queue_model = make_model(queue_size=16, momentum=0.9)
+    queue_model(graphs)
+    for result in results:
+        assert(torch.allclose(result['loss'], loss.detach(), atol=1e-6))
+        for grad, cached_grad, expected_grad in zip(
+                result['grads'], result['cached_grads'], expected):
+            assert(torch.allclose(grad, expected_grad, atol=1e-5))
+            assert(torch.allclose(cached_grad, expected_grad, atol=1e-5))
+        assert(torch.allclose(result['queue'], queue_model.queue, atol=1e-6))
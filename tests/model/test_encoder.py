@@ -0,0 +1,109 @@
+import pytest
+import torch
+
+from codeclr import DenseGraph, GraphBatch, SparseGraph
+from codeclr.model.encoder import Encoder, bucket_size
+
+
+def random_tree(num_nodes: int) -> SparseGraph:
+    # Nodes are numbered in preorder: each new node hangs off a random node on
+    # the path from the root to the previous node.
+    path = [0]
+    parents = []
+    for i in range(1, num_nodes):
+        depth = torch.randint(0, len(path), (1,)).item()
+        del path[depth + 1:]
+        parents.append(path[-1])
+        path.append(i)
+    parents = torch.tensor(parents, dtype=torch.long)
+    children = torch.arange(1, num_nodes)
+    loops = torch.arange(num_nodes)
+    edge_index = torch.stack([torch.cat([parents, children, loops]),
+                              torch.cat([children, parents, loops])])
+    node_features = torch.stack([torch.randint(
+        0, 10, (num_nodes,)), torch.randint(0, 100, (num_nodes,))], dim=1).float()
+    return SparseGraph(node_features, edge_index)
+
+
+def preprocessed_tree(num_nodes: int) -> SparseGraph:
+    # Row-sorted edges and a stored degree, like preprocessed graphs, so the
+    # encoder aggregates with a CSR adjacency.
+    graph = random_tree(num_nodes)
+    row = graph.edge_index[0]
+    return SparseGraph(
+        graph.node_features,
+        graph.edge_index[:, torch.argsort(row, stable=True)],
+        degree=torch.bincount(row, minlength=num_nodes))
+
+
+def reference_forward(encoder: Encoder, graphs):
+    graph_embeddings = []
+    for graph in graphs:
+        graph = graph.to_dense()
+        x = graph.node_features.int()
+        x = torch.cat([encoder.node_type_embedding(x[:, 0]),
+                       encoder.node_label_embedding(x[:, 1])], dim=-1)
+        for layer in encoder.layers:
+            x = layer(x, graph.adjacency_matrix, add_loop=False)
+            x = encoder.activation(x)
+        x = x.squeeze(0)
+        pooled = torch.cat([x.mean(dim=0), x.max(dim=0)[0]], dim=-1)
+        graph_embeddings.append(encoder.readout(pooled))
+    return torch.stack(graph_embeddings)
+
+
+def test_batched_forward_matches_per_graph_forward() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [1, 2, 17, 40, 5]]
+    encoder = Encoder([16, 16, 8], vocab_size=100)
+    expected = reference_forward(encoder, graphs)
+    assert(torch.allclose(encoder(graphs), expected, atol=1e-5))
+    assert(torch.allclose(
+        encoder(GraphBatch.from_graphs(graphs)), expected, atol=1e-5))
+    dense_graphs = [graph.to_dense() for graph in graphs]
+    assert(torch.allclose(encoder(dense_graphs), expected, atol=1e-5))
+
+
+def test_stored_degree_matches_recomputed_degree() -> None:
+    torch.manual_seed(0)
+    graphs = [preprocessed_tree(n) for n in [1, 2, 17, 40, 5]]
+    batch = GraphBatch.from_graphs(graphs)
+    node_mask = torch.rand(batch.num_nodes) > 0.3
+    dropped = batch.drop_nodes(node_mask)
+    assert(torch.equal(dropped.degree, torch.bincount(
+        dropped.edge_index[0], minlength=dropped.num_nodes)))
+
+    encoder = Encoder([16, 16, 8], vocab_size=100)
+    dropped.degree = None
+    assert(torch.allclose(encoder(batch.drop_nodes(node_mask)),
+                          encoder(dropped), atol=1e-6))
+
+
+def test_bucket_size() -> None:
+    sizes = [bucket_size(n) for n in range(1, 2000)]
+    assert(all(size >= n for n, size in zip(range(1, 2000), sizes)))
+    assert(all(size < 1.25 * n or size <= 4
+               for n, size in zip(range(1, 2000), sizes)))
+    assert(len(set(sizes)) <= 4 * 11)
+
+
+def test_padded_forward_matches_unpadded_forward() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [1, 2, 17, 40, 5]]
+    encoder = Encoder([16, 16, 8], vocab_size=100)
+    expected = encoder(graphs)
+    encoder.pad_to_buckets = True
+    padded = encoder(graphs)
+    assert(padded.shape == expected.shape)
+    assert(torch.allclose(padded, expected, atol=1e-5))
+
+
+def test_bfloat16_autocast_forward() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [3, 17, 40]]
+    encoder = Encoder([16, 16, 8], vocab_size=100)
+    expected = encoder(graphs)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        out = encoder(graphs)
+    out.float().sum().backward()
+    assert(torch.allclose(out.float(), expected, atol=0.1))
@@ -0,0 +1,173 @@
+import copy
+
+import pytest
+import torch
+
+from codeclr.model import ContrastiveLearner
+from codeclr.model.loss import info_nce_loss, moco_loss
+
+from .test_encoder import preprocessed_tree, random_tree
+
+
+def reference_info_nce_loss(anchors, positives, temperature):
+    z = torch.cat([anchors, positives])
+    n = z.shape[0]
+    losses = []
+    for i in range(n):
+        j = (i + n // 2) % n
+        sims = torch.stack([torch.nn.functional.cosine_similarity(
+            z[i], z[k], dim=0) / temperature for k in range(n) if k != i])
+        pos = torch.nn.functional.cosine_similarity(
+            z[i], z[j], dim=0) / temperature
+        losses.append(-torch.log(torch.exp(pos) / torch.exp(sims).sum()))
+    return torch.stack(losses).mean()
+
+
+@pytest.mark.parametrize('temperature', [0.05, 0.5, 1.0])
+def test_info_nce_loss_matches_reference(temperature) -> None:
+    torch.manual_seed(0)
+    anchors = torch.randn(6, 8)
+    positives = anchors + 0.1 * torch.randn(6, 8)
+    assert(torch.allclose(
+        info_nce_loss(anchors, positives, temperature),
+        reference_info_nce_loss(anchors, positives, temperature),
+        atol=1e-5))
+
+
+def test_info_nce_loss_is_stable_at_low_temperature() -> None:
+    torch.manual_seed(0)
+    anchors = torch.randn(4, 8)
+    loss = info_nce_loss(anchors, -anchors, temperature=1e-3)
+    assert(torch.isfinite(loss))
+
+
+def test_grad_cache_matches_full_batch_gradients() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [3, 9, 4, 12, 6, 2, 8]]
+    model = ContrastiveLearner(
+        [16, 16, 8], vocab_size=100, augment_1='identity',
+        augment_2='identity', temperature=0.2)
+
+    model.zero_grad()
+    loss = model(graphs)
+    loss.backward()
+    expected = [p.grad.clone() for p in model.parameters()]
+    assert(any(grad.abs().sum() > 0 for grad in expected))
+
+    model.zero_grad()
+    cached_loss = model.forward_backward(graphs, chunk_size=3)
+    assert(torch.allclose(cached_loss, loss.detach(), atol=1e-6))
+    for p, grad in zip(model.parameters(), expected):
+        assert(torch.allclose(p.grad, grad, atol=1e-5))
+
+
+def test_moco_loss_matches_reference() -> None:
+    torch.manual_seed(0)
+    queries = torch.randn(4, 8)
+    keys = queries + 0.1 * torch.randn(4, 8)
+    queue = torch.nn.functional.normalize(torch.randn(10, 8), dim=-1)
+    expected = []
+    for q, k in zip(queries, keys):
+        pos = torch.nn.functional.cosine_similarity(q, k, dim=0) / 0.2
+        neg = torch.nn.functional.cosine_similarity(
+            q.unsqueeze(0), queue, dim=-1) / 0.2
+        expected.append(-pos + torch.logsumexp(
+            torch.cat([pos.unsqueeze(0), neg]), dim=0))
+    assert(torch.allclose(moco_loss(queries, keys, queue, 0.2),
+                          torch.stack(expected).mean(), atol=1e-5))
+
+
+def test_queue_and_momentum_encoder() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [3, 9, 4, 12, 6]]
+    model = ContrastiveLearner(
+        [16, 16, 8], vocab_size=100, queue_size=7, momentum=0.5)
+    key_weight = model.key_encoder.readout.weight.clone()
+    queue = model.queue.clone()
+
+    loss = model(graphs)
+    loss.backward()
+    assert(model.key_encoder.readout.weight.grad is None)
+    assert(model.queue_ptr.item() == 5)
+    assert(torch.equal(model.queue[5:], queue[5:]))
+    assert(not torch.equal(model.queue[:5], queue[:5]))
+
+    with torch.no_grad():
+        model.encoder.readout.weight.add_(1)
+    model(graphs)
+    assert(model.queue_ptr.item() == 3)
+    expected = 0.5 * key_weight + 0.5 * model.encoder.readout.weight
+    assert(torch.allclose(model.key_encoder.readout.weight, expected))
+
+    model.update_key_encoder = False
+    key_weight = model.key_encoder.readout.weight.clone()
+    model(graphs)
+    assert(torch.equal(model.key_encoder.readout.weight, key_weight))
+    assert(model.queue_ptr.item() == 1)
+    model.update_key_encoder = True
+
+    model.eval()
+    queue = model.queue.clone()
+    with torch.no_grad():
+        model(graphs)
+    assert(torch.equal(model.queue, queue))
+    assert(model.queue_ptr.item() == 1)
+
+
+def test_grad_cache_matches_full_batch_gradients_with_queue() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [3, 9, 4, 12, 6, 2, 8]]
+    model = ContrastiveLearner(
+        [16, 16, 8], vocab_size=100, augment_1='identity',
+        augment_2='identity', queue_size=16, momentum=0.9)
+    cached_model = copy.deepcopy(model)
+
+    loss = model(graphs)
+    loss.backward()
+    cached_loss = cached_model.forward_backward(graphs, chunk_size=3)
+    assert(torch.allclose(cached_loss, loss.detach(), atol=1e-6))
+    assert(torch.allclose(cached_model.queue, model.queue, atol=1e-6))
+    for p, cached_p in zip(model.encoder.parameters(),
+                           cached_model.encoder.parameters()):
+        assert(torch.allclose(cached_p.grad, p.grad, atol=1e-5))
+
+
+@pytest.mark.parametrize('queue_size', [0, 8])
+def test_backward_after_bfloat16_autocast(queue_size) -> None:
+    # As pretrain.py runs it, with preprocessed graphs: only the forward
+    # pass is autocast.
+    torch.manual_seed(0)
+    graphs = [preprocessed_tree(n) for n in [3, 9, 4, 12]]
+    model = ContrastiveLearner(
+        [16, 16, 8], vocab_size=100, queue_size=queue_size)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        loss = model(graphs)
+    loss.backward()
+    grads = [p.grad for p in model.encoder.parameters() if p.grad is not None]
+    assert(grads and all(torch.isfinite(grad).all() for grad in grads))
+
+
+@pytest.mark.parametrize('queue_size', [0, 8])
+def test_grad_cache_under_bfloat16_autocast(queue_size) -> None:
+    # As pretrain.py runs it, with preprocessed graphs.
+    torch.manual_seed(0)
+    graphs = [preprocessed_tree(n) for n in [3, 9, 4, 12]]
+    model = ContrastiveLearner(
+        [16, 16, 8], vocab_size=100, queue_size=queue_size)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        loss = model.forward_backward(graphs, chunk_size=2)
+    assert(torch.isfinite(loss))
+    grads = [p.grad for p in model.encoder.parameters() if p.grad is not None]
+    assert(grads and all(torch.isfinite(grad).all() for grad in grads))
+
+
+def test_queue_under_bfloat16_autocast() -> None:
+    torch.manual_seed(0)
+    graphs = [random_tree(n) for n in [3, 9, 4]]
+    model = ContrastiveLearner([16, 16, 8], vocab_size=100, queue_size=8)
+    with torch.autocast('cpu', dtype=torch.bfloat16):
+        loss = model(graphs)
+    loss.backward()
+    assert(loss.dtype == torch.float32)
+    assert(model.queue.dtype == torch.float32)
+    assert(model.queue_ptr.item() == 3)
@@ -0,0 +1,117 @@
+import pytest
+import torch
+
+from codeclr.data.util import problem_labels
+from codeclr.search import ExactIndex, IVFIndex, evaluate_index, map_at_r, recall_at_k
+
+
+def clustered_embeddings(n: int, dim: int = 16, num_clusters: int = 20):
+    generator = torch.Generator()
+    generator.manual_seed(0)
+    centers = torch.randn(num_clusters, dim, generator=generator)
+    assignment = torch.randint(0, num_clusters, (n,), generator=generator)
+    return centers[assignment] + 0.3 * \
+        torch.randn(n, dim, generator=generator)
+
+
+def brute_force(queries, embeddings, k):
+    similarities = torch.nn.functional.cosine_similarity(
+        queries.unsqueeze(1), embeddings.unsqueeze(0), dim=-1)
+    return similarities.topk(k, dim=1)
+
+
+def test_exact_index_matches_brute_force() -> None:
+    embeddings = clustered_embeddings(1000)
+    queries = clustered_embeddings(50) + 0.1
+    index = ExactIndex(16, block_size=64)
+    index.add(embeddings[:300])
+    index.add(embeddings[300:].numpy())
+    scores, indices = index.search(queries, 5)
+    expected_scores, expected_indices = brute_force(queries, embeddings, 5)
+    assert(torch.allclose(scores, expected_scores, atol=1e-5))
+    assert(torch.equal(indices, expected_indices))
+
+
+def test_exact_index_with_fewer_embeddings_than_k() -> None:
+    index = ExactIndex(16)
+    index.add(clustered_embeddings(3), ids=['a', 'b', 'c'])
+    scores, indices = index.search(clustered_embeddings(2), 5)
+    assert(indices.shape == (2, 3))
+    assert(sorted(index.ids[i]
+           for i in indices[0].tolist()) == ['a', 'b', 'c'])
+
+
+def test_ivf_index_probing_every_list_is_exact() -> None:
+    embeddings = clustered_embeddings(1000)
+    queries = clustered_embeddings(50) + 0.1
+    index = IVFIndex(16, num_lists=10)
+    index.add(embeddings)
+    assert(sum(len(rows) for rows in index.list_rows) == 1000)
+    scores, indices = index.search(queries, 5, num_probes=10)
+    expected_scores, expected_indices = brute_force(queries, embeddings, 5)
+    assert(torch.allclose(scores, expected_scores, atol=1e-5))
+    assert(torch.equal(indices, expected_indices))
+
+
+@pytest.mark.parametrize('num_probes', [1, 4])
+def test_ivf_index_recall(num_probes) -> None:
+    embeddings = clustered_embeddings(2000)
+    exact_index = ExactIndex(16)
+    exact_index.add(embeddings)
+    index = IVFIndex(16, num_lists=20, num_probes=num_probes)
+    # Incremental insertion into the lists trained on the first chunk.
+    index.add(embeddings[:1000])
+    index.add(embeddings[1000:])
+    assert(len(index) == 2000)
+    results = evaluate_index(index, exact_index, embeddings[:100], k=10)
+    assert(results['recall@10'] > 0.8)
+    assert(results['queries_per_sec'] > 0)
+
+
+def test_recall_at_k() -> None:
+    exact = torch.tensor([[0, 1], [2, 3]])
+    assert(recall_at_k(exact, exact) == 1.0)
+    assert(recall_at_k(torch.tensor([[1, 5], [-1, -1]]), exact) == 0.25)
+
+
+def reference_map_at_r(embeddings, labels):
+    similarities = torch.nn.functional.cosine_similarity(
+        embeddings.unsqueeze(1), embeddings.unsqueeze(0), dim=-1)
+    similarities.fill_diagonal_(-float('inf'))
+    average_precisions, hits_at_1 = [], []
+    for i in range(len(labels)):
+        r = (labels == labels[i]).sum().item() - 1
+        if r == 0:
+            continue
+        retrieved = similarities[i].argsort(descending=True)[:r]
+        relevant = (labels[retrieved] == labels[i]).float()
+        precisions = relevant.cumsum(0) / torch.arange(1, r + 1)
+        average_precisions.append((precisions * relevant).sum() / r)
+        hits_at_1.append(relevant[0])
+    return (torch.stack(average_precisions).mean().item(),
+            torch.stack(hits_at_1).mean().item())
+
+
+@pytest.mark.parametrize('block_size', [7, 4096])
+def test_map_at_r_matches_reference(block_size) -> None:
+    embeddings = clustered_embeddings(300, num_clusters=5)
+    generator = torch.Generator()
+    generator.manual_seed(1)
+    # Noisy labels, plus one singleton label that is skipped.
+    labels = torch.randint(0, 8, (300,), generator=generator)
+    labels[0] = 8
+    results = map_at_r(embeddings, labels, block_size=block_size)
+    map_r, precision_at_1 = reference_map_at_r(embeddings, labels)
+    assert(abs(results['map@r'] - map_r) < 1e-5)
+    assert(abs(results['precision@1'] - precision_at_1) < 1e-5)
+
+
+def test_map_at_r_is_one_for_separated_labels() -> None:
+    embeddings = torch.eye(4).repeat_interleave(3, dim=0)
+    results = map_at_r(embeddings, torch.arange(4).repeat_interleave(3))
+    assert(results == {'map@r': 1.0, 'precision@1': 1.0})
+
+
+def test_problem_labels() -> None:
+    labels = problem_labels(['p2_s1.pt', 'p1_s1.pt', 'p2_s2.pt', 'p3_s1'])
+    assert(labels.tolist() == [0, 1, 0, 2])
@@ -0,0 +1,88 @@
+import os
+import warnings
+
+import numpy as np
+import pytest
+import torch
+from torchtext.vocab import build_vocab_from_iterator
+
+from codeclr.cass import load_file
+from codeclr.inference import CassFileDataset, load_embeddings, load_encoder, write_embeddings
+from codeclr.model import ContrastiveLearner
+from codeclr.search import ExactIndex
+
+from .model.test_encoder import random_tree
+
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(__file__), 'cass', 'examples')
+
+
+class ListDataset(torch.utils.data.Dataset):
+    def __init__(self, graphs):
+        self.graphs = graphs
+        self.file_names = [f'p{i}_s{i}.pt' for i in range(len(graphs))]
+
+    def __len__(self):
+        return len(self.graphs)
+
+    def __getitem__(self, index):
+        return self.graphs[index]
+
+
+def save_checkpoint(tmp_path, vocab_size: int = 100) -> str:
+    torch.manual_seed(0)
+    model = ContrastiveLearner([16, 16, 8], vocab_size=vocab_size)
+    checkpoint_file = str(tmp_path / 'checkpoint.pt')
+    torch.save({'model_state_dict': model.state_dict()}, checkpoint_file)
+    return checkpoint_file
+
+
+def test_load_encoder(tmp_path) -> None:
+    encoder = load_encoder(save_checkpoint(tmp_path))
+    assert(encoder.layer_sizes == [16, 16, 8])
+    assert(encoder.vocab_size == 100)
+    assert(not encoder.training)
+
+
+@pytest.mark.parametrize('dtype', ['float16', 'float32'])
+def test_write_embeddings(tmp_path, dtype) -> None:
+    encoder = load_encoder(save_checkpoint(tmp_path))
+    dataset = ListDataset([random_tree(n) for n in [3, 9, 4, 12, 6]])
+    write_embeddings(str(tmp_path / 'out'), encoder, dataset,
+                     batch_size=2, dtype=dtype)
+
+    embeddings, ids = load_embeddings(str(tmp_path / 'out'))
+    assert(isinstance(embeddings, np.memmap))
+    assert(embeddings.dtype == dtype)
+    assert(ids == ['p0_s0', 'p1_s1', 'p2_s2', 'p3_s3', 'p4_s4'])
+    with torch.no_grad():
+        expected = encoder(dataset.graphs)
+    assert(torch.allclose(torch.from_numpy(embeddings.astype(np.float32)),
+                          expected, atol=1e-2 if dtype == 'float16' else 1e-6))
+
+    # The read-only memmap is searched as search.py does, without warnings.
+    with warnings.catch_warnings():
+        warnings.simplefilter('error')
+        index = ExactIndex(8)
+        index.add(embeddings[:3], ids[:3])
+        index.add(embeddings[3:], ids[3:])
+        _, indices = index.search(embeddings, 1)
+    assert(torch.equal(indices[:, 0], torch.arange(5)))
+
+
+def test_cass_file_dataset(tmp_path) -> None:
+    cass_trees = load_file(os.path.join(
+        EXAMPLES_DIR, 'multiple_cass_trees.cas'))
+    vocab = build_vocab_from_iterator(
+        [[node.n if node.n else '' for tree in cass_trees for node in tree.nodes]],
+        specials=['<unk>'])
+    vocab.set_default_index(vocab['<unk>'])
+    dataset = CassFileDataset(EXAMPLES_DIR, vocab)
+    assert(dataset.ids == ['multiple_cass_trees', 'one_cass_tree'])
+
+    graph = dataset[0]
+    assert(graph.num_nodes == sum(len(tree.nodes) for tree in cass_trees))
+    encoder = load_encoder(save_checkpoint(tmp_path, len(vocab)))
+    write_embeddings(str(tmp_path / 'out'), encoder, dataset)
+    embeddings, _ = load_embeddings(str(tmp_path / 'out'))
+    assert(embeddings.shape == (2, 8))
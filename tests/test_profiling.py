@@ -0,0 +1,50 @@
+import io
+import json
+
+import pytest
+
+from codeclr import profiling
+from codeclr.model import ContrastiveLearner
+
+from .model.test_encoder import random_tree
+
+
+@pytest.fixture
+def instrumentation():
+    profiling.enable()
+    yield profiling.INSTRUMENTATION
+    profiling.enable(False)
+
+
+def test_disabled_instrumentation_records_nothing() -> None:
+    assert(not profiling.INSTRUMENTATION.enabled)
+    assert(profiling.timer('a') is profiling.timer('b'))
+    with profiling.timer('a'):
+        profiling.record('b', 1.0)
+        profiling.count('c')
+    assert(profiling.INSTRUMENTATION.summary().keys() == {'seconds'})
+
+
+def test_timers_and_counters(instrumentation) -> None:
+    with profiling.timer('a'):
+        pass
+    profiling.record('a', 1.0)
+    profiling.count('graphs', 3)
+    summary = instrumentation.summary()
+    assert(1.0 < summary['a_seconds'] < 2.0)
+    assert(summary['graphs'] == 3)
+    assert(summary['graphs_per_sec'] > 0)
+
+
+def test_contrastive_learner_phases(instrumentation) -> None:
+    graphs = [random_tree(n) for n in [3, 9, 4]]
+    model = ContrastiveLearner([16, 16, 8], vocab_size=100)
+    model(graphs)
+    model.forward_backward(graphs, chunk_size=2)
+
+    jsonl_file = io.StringIO()
+    summary = instrumentation.flush(7, jsonl_file=jsonl_file)
+    for phase in ['augment', 'forward', 'loss', 'backward']:
+        assert(summary[f'{phase}_seconds'] > 0)
+    assert(json.loads(jsonl_file.getvalue()) == {'step': 7, **summary})
+    assert(instrumentation.summary().keys() == {'seconds'})
@@ -0,0 +1,57 @@
+import os
+
+import pytest
+import torch
+from torchtext.vocab import build_vocab_from_iterator
+
+from codeclr import DenseGraph, SparseGraph, load_graph
+from codeclr.cass import cass_tree_to_graph, load_file
+from codeclr.model.encoder import Encoder
+
+
+def load_example(sparse: bool):
+    file_name = os.path.join(
+        os.path.dirname(__file__),
+        'cass',
+        'examples',
+        'multiple_cass_trees.cas')
+    cass_trees = load_file(file_name)
+    vocab = build_vocab_from_iterator(
+        [[node.n if node.n else '' for tree in cass_trees for node in tree.nodes]],
+        specials=['<unk>'])
+    return cass_tree_to_graph(cass_trees, vocabulary=vocab, sparse=sparse)
+
+
+def test_sparse_graph_matches_dense_graph() -> None:
+    dense_graph = load_example(sparse=False)
+    sparse_graph = load_example(sparse=True)
+    assert(isinstance(sparse_graph, SparseGraph))
+    assert(sparse_graph.num_nodes == dense_graph.num_nodes)
+    assert(sparse_graph.num_edges == dense_graph.num_edges)
+    assert(torch.equal(sparse_graph.to_dense().adjacency_matrix,
+                       dense_graph.adjacency_matrix))
+    assert(torch.equal(SparseGraph.from_dense(dense_graph).edge_index,
+                       sparse_graph.edge_index))
+
+
+def test_sparse_graph_save_load(tmp_path) -> None:
+    sparse_graph = load_example(sparse=True)
+    path = os.path.join(tmp_path, 'graph.pt')
+    sparse_graph.save(path)
+    loaded = load_graph(path)
+    assert(isinstance(loaded, SparseGraph))
+    assert(torch.equal(loaded.node_features, sparse_graph.node_features))
+    assert(torch.equal(loaded.edge_index, sparse_graph.edge_index))
+    assert(torch.equal(loaded.degree, sparse_graph.degree))
+    assert(torch.equal(loaded.degree, torch.bincount(
+        loaded.edge_index[0], minlength=loaded.num_nodes)))
+
+
+def test_encoder_sparse_matches_dense() -> None:
+    torch.manual_seed(0)
+    dense_graph = load_example(sparse=False)
+    sparse_graph = load_example(sparse=True)
+    encoder = Encoder([16, 16, 8], vocab_size=1000)
+    dense_embedding = encoder([dense_graph])
+    sparse_embedding = encoder([sparse_graph])
+    assert(torch.allclose(dense_embedding, sparse_embedding, atol=1e-5))